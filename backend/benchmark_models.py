@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Benchmark the face detection backends and compare strategies in services/faceDetection.py
+
+Every measurement runs in a fresh process so cold start and peak RSS belong to one backend only.
+Images are synthetic faces generated from a fixed seed (or your own with --images), so runs on
+the same machine are comparable. Results are printed (or written with --output) as JSON.
+
+Run with: python benchmark_models.py
+          python benchmark_models.py --models yolov8-face,insightface --batch-sizes 1,8 --threads 1,4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib.util
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+SERVICES_DIR = Path(__file__).resolve().parent / 'services'
+
+DETECTOR_MODELS = ['yolov8-face', 'deepface', 'insightface', 'mediapipe', 'onnx']
+COMPARE_STRATEGIES = ['auto', 'deepface', 'insightface', 'yolov8-face', 'mediapipe', 'onnx']
+
+# pip distributions that provide an import name, when they differ
+DISTRIBUTION_NAMES = {'cv2': ('opencv-python', 'opencv-python-headless', 'opencv-contrib-python')}
+BACKEND_PACKAGES = ['cv2', 'numpy', 'ultralytics', 'deepface', 'insightface', 'mediapipe', 'onnxruntime', 'torch']
+
+# Libraries read these when they create their thread pools, so they are set before any import
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+# (width, height) of generated test images: webcam frame, phone photo downscaled, full phone photo
+SYNTHETIC_SIZES = [(640, 480), (1280, 960), (4032, 3024)]
+
+
+def generate_images(output_dir, count, seed=0):
+    """Write count synthetic face-like JPEGs (skin ellipse, eyes, mouth on a noisy background)"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        width, height = SYNTHETIC_SIZES[i % len(SYNTHETIC_SIZES)]
+        background = rng.integers(40, 200, size=3)
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[:] = background
+        img = cv2.add(img, rng.integers(0, 25, size=img.shape, dtype=np.uint8))
+
+        face_h = int(height * rng.uniform(0.35, 0.6))
+        face_w = int(face_h * 0.75)
+        cx = int(rng.uniform(0.35, 0.65) * width)
+        cy = int(rng.uniform(0.4, 0.6) * height)
+        skin = (int(rng.integers(90, 140)), int(rng.integers(130, 180)), int(rng.integers(180, 230)))
+        cv2.ellipse(img, (cx, cy), (face_w // 2, face_h // 2), 0, 0, 360, skin, -1)
+        eye_dx, eye_y, eye_r = face_w // 5, cy - face_h // 8, max(2, face_w // 14)
+        for ex in (cx - eye_dx, cx + eye_dx):
+            cv2.circle(img, (ex, eye_y), eye_r, (255, 255, 255), -1)
+            cv2.circle(img, (ex, eye_y), max(1, eye_r // 2), (40, 30, 20), -1)
+        cv2.line(img, (cx, cy - face_h // 20), (cx - face_w // 16, cy + face_h // 10), (70, 90, 140), max(1, face_w // 60))
+        cv2.ellipse(img, (cx, cy + face_h // 4), (face_w // 6, face_h // 20), 0, 0, 180, (60, 60, 160), max(1, face_w // 40))
+
+        path = output_dir / f'synthetic_{i:03d}_{width}x{height}.jpg'
+        cv2.imwrite(str(path), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(str(path))
+    return paths
+
+
+def collect_images(images_dir):
+    patterns = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp')
+    return sorted(str(p) for pattern in patterns for p in Path(images_dir).glob(pattern))
+
+
+def configure_threads(threads):
+    """Limit native thread pools in this (fresh) process; must run before backends are imported"""
+    if threads:
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(threads)
+
+
+def apply_thread_limits(threads):
+    """Limit thread pools that are configured after import"""
+    if not threads:
+        return
+    import cv2
+    cv2.setNumThreads(threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(latencies_ms):
+    import numpy as np
+
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+def elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def load_service():
+    """Import faceDetection.py in a benchmark worker with caching off so every call does real work"""
+    os.environ['FACE_CACHE'] = '0'
+    # Backends print progress to stdout; keep the parent's JSON output clean
+    sys.stdout = sys.stderr
+    sys.path.insert(0, str(SERVICES_DIR))
+    start = time.perf_counter()
+    import faceDetection
+    return faceDetection, elapsed_ms(start)
+
+
+def bench_detector(model, images, iterations, warmup, batch_sizes, threads):
+    """Cold start, warm latency and batch throughput of one FaceDetector in this process"""
+    configure_threads(threads)
+    try:
+        service, import_ms = load_service()
+        apply_thread_limits(threads)
+
+        start = time.perf_counter()
+        detector = service.get_detector(model)
+        load_ms = elapsed_ms(start)
+
+        start = time.perf_counter()
+        first = detector.detect(images[0])
+        first_ms = elapsed_ms(start)
+        if first.get('error'):
+            return {'error': first['error'], 'peak_rss_mb': peak_rss_mb()}
+
+        for i in range(warmup):
+            detector.detect(images[i % len(images)])
+
+        latencies = []
+        faces_found = 0
+        for i in range(iterations):
+            start = time.perf_counter()
+            result = detector.detect(images[i % len(images)])
+            latencies.append(elapsed_ms(start))
+            faces_found += int(result.get('face_count', 0) > 0)
+
+        throughput = {}
+        for batch_size in batch_sizes:
+            batch = [images[i % len(images)] for i in range(batch_size)]
+            rounds = max(1, iterations // batch_size)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                detector.detect_batch(batch)
+            throughput[str(batch_size)] = round(batch_size * rounds / (elapsed_ms(start) / 1000), 2)
+
+        return {
+            'detector_class': type(detector).__name__,
+            'cold_start_ms': {
+                'import': round(import_ms, 3),
+                'model_load': round(load_ms, 3),
+                'first_inference': round(first_ms, 3),
+                'total': round(import_ms + load_ms + first_ms, 3)
+            },
+            'warm_latency': summarize(latencies),
+            'images_per_second': throughput,
+            'face_found_rate': round(faces_found / max(1, iterations), 3),
+            'peak_rss_mb': peak_rss_mb()
+        }
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}', 'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_compare(strategy, pairs, iterations, warmup, threads):
+    """Cold start and warm latency of compare_faces() with one model strategy in this process"""
+    configure_threads(threads)
+    try:
+        service, import_ms = load_service()
+        apply_thread_limits(threads)
+
+        start = time.perf_counter()
+        first = service.compare_faces(*pairs[0], model_name=strategy)
+        first_ms = elapsed_ms(start)
+        if first.get('error'):
+            return {'error': first['error'], 'peak_rss_mb': peak_rss_mb()}
+
+        for i in range(warmup):
+            service.compare_faces(*pairs[i % len(pairs)], model_name=strategy)
+
+        latencies = []
+        answered_by = {}
+        for i in range(iterations):
+            start = time.perf_counter()
+            result = service.compare_faces(*pairs[i % len(pairs)], model_name=strategy)
+            latencies.append(elapsed_ms(start))
+            stage = result.get('stage') or result.get('model')
+            answered_by[stage] = answered_by.get(stage, 0) + 1
+
+        return {
+            'cold_start_ms': {
+                'import': round(import_ms, 3),
+                'first_compare': round(first_ms, 3),
+                'total': round(import_ms + first_ms, 3)
+            },
+            'warm_latency': summarize(latencies),
+            'pairs_per_second': round(len(latencies) / (sum(latencies) / 1000), 2),
+            'answered_by': answered_by,
+            'peak_rss_mb': peak_rss_mb()
+        }
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}', 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_isolated(function, *args, timeout=None):
+    """Run function(*args) in a fresh interpreter and return its result"""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        try:
+            return executor.submit(function, *args).result(timeout=timeout)
+        except Exception as e:
+            return {'error': f'Benchmark process failed: {type(e).__name__}: {e}'}
+
+
+def environment_info():
+    packages = {}
+    for name in BACKEND_PACKAGES:
+        if importlib.util.find_spec(name) is None:
+            packages[name] = None
+            continue
+        from importlib.metadata import version, PackageNotFoundError
+        packages[name] = 'installed'
+        for dist in DISTRIBUTION_NAMES.get(name, (name,)):
+            try:
+                packages[name] = version(dist)
+                break
+            except PackageNotFoundError:
+                continue
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'packages': packages
+    }
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def name_list(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark face detection backends and compare strategies')
+    parser.add_argument('--models', type=name_list, default=DETECTOR_MODELS,
+                        help='Comma-separated detector models to benchmark')
+    parser.add_argument('--strategies', type=name_list, default=COMPARE_STRATEGIES,
+                        help="Comma-separated compare_faces model strategies ('' to skip)")
+    parser.add_argument('--images', help='Directory of images to use instead of generated synthetic faces')
+    parser.add_argument('--image-count', type=int, default=12, help='Number of synthetic images to generate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthetic images')
+    parser.add_argument('--iterations', type=int, default=30, help='Timed calls per measurement')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed calls after the cold start')
+    parser.add_argument('--batch-sizes', type=int_list, default=[1, 4, 16], help='Batch sizes for throughput')
+    parser.add_argument('--threads', type=int_list, default=[1, os.cpu_count() or 1],
+                        help='Thread counts to run each detector with')
+    parser.add_argument('--timeout', type=float, default=1800, help='Seconds allowed per measurement')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    if args.images:
+        images = collect_images(args.images)
+        if not images:
+            parser.error(f'No images found in {args.images}')
+        image_source = str(Path(args.images).resolve())
+    else:
+        import tempfile
+        images = generate_images(Path(tempfile.mkdtemp(prefix='face-bench-')), args.image_count, args.seed)
+        image_source = f'synthetic(seed={args.seed}, count={args.image_count})'
+    pairs = [(images[i], images[(i + 1) % len(images)]) for i in range(len(images))]
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment_info(),
+        'config': {
+            'images': image_source,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'batch_sizes': args.batch_sizes,
+            'threads': sorted(set(args.threads))
+        },
+        'detectors': {},
+        'compare': {}
+    }
+
+    for model in args.models:
+        report['detectors'][model] = {}
+        for threads in sorted(set(args.threads)):
+            print(f'Benchmarking detector {model} with {threads} thread(s)...', file=sys.stderr)
+            report['detectors'][model][str(threads)] = run_isolated(
+                bench_detector, model, images, args.iterations, args.warmup, args.batch_sizes, threads,
+                timeout=args.timeout
+            )
+
+    compare_threads = max(args.threads)
+    for strategy in args.strategies:
+        print(f'Benchmarking compare_faces strategy {strategy}...', file=sys.stderr)
+        report['compare'][strategy] = run_isolated(
+            bench_compare, strategy, pairs, args.iterations, args.warmup, compare_threads,
+            timeout=args.timeout
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n', encoding='utf-8')
+        print(f'Benchmark report written to {args.output}', file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+// Rebuild the 1:N face search index from embeddings stored in the voters table
+// Only embeddings stored with the given model are indexed (default: the model of the latest registration)
+// Run with: node db/buildFaceIndex.js [embedding-model] [ivf-partitions]
+// e.g. node db/buildFaceIndex.js insightface 1024
+
+import pg from 'pg'
+import dotenv from 'dotenv'
+import { spawn } from 'child_process'
+import path from 'path'
+import { fileURLToPath } from 'url'
+import { dirname } from 'path'
+
+dotenv.config()
+
+const __filename = fileURLToPath(import.meta.url)
+const __dirname = dirname(__filename)
+
+const PYTHON_SCRIPT = path.join(__dirname, '../services/faceDetection.py')
+const PYTHON = process.env.PYTHON || (process.platform === 'win32' ? 'python' : 'python3')
+const BATCH_ROWS = 5000
+
+const { Pool } = pg
+
+const pool = new Pool({
+  host: process.env.DB_HOST || 'localhost',
+  port: process.env.DB_PORT || 5432,
+  database: process.env.DB_NAME || 'voter_registration',
+  user: process.env.DB_USER || 'postgres',
+  password: process.env.DB_PASSWORD || 'postgres',
+})
+
+const encodeEmbedding = (values) => {
+  const buffer = Buffer.alloc(values.length * 4)
+  values.forEach((value, i) => buffer.writeFloatLE(value, i * 4))
+  return buffer.toString('base64')
+}
+
+const runPython = (args, input) => new Promise((resolve, reject) => {
+  const script = spawn(PYTHON, [PYTHON_SCRIPT, ...args], { stdio: ['pipe', 'pipe', 'inherit'] })
+  let stdout = ''
+  script.stdout.on('data', (data) => {
+    stdout += data.toString()
+  })
+  script.on('error', reject)
+  script.on('close', (code) => {
+    if (code === 0) {
+      resolve(stdout.trim())
+    } else {
+      reject(new Error(`faceDetection.py exited with code ${code}: ${stdout.trim()}`))
+    }
+  })
+  script.stdin.end(input || '')
+})
+
+async function buildFaceIndex() {
+  const nlist = process.argv[3]
+
+  try {
+    let embeddingModel = process.argv[2]
+    if (!embeddingModel) {
+      const latest = await pool.query(
+        `SELECT face_embedding_model FROM voters
+         WHERE cardinality(face_embedding) > 0 AND face_embedding_model IS NOT NULL
+         ORDER BY created_at DESC
+         LIMIT 1`
+      )
+      if (latest.rows.length === 0) {
+        console.log('⚠️ No embeddings with a recorded model; nothing to index')
+        process.exit(0)
+      }
+      embeddingModel = latest.rows[0].face_embedding_model
+    }
+
+    console.log(`🔄 Rebuilding face index from stored ${embeddingModel} embeddings...`)
+    const indexDir = process.env.FACE_INDEX_DIR || path.join(__dirname, '../face_index')
+    const fs = await import('fs/promises')
+    await fs.rm(indexDir, { recursive: true, force: true })
+
+    let total = 0
+    let lastCreatedAt = null
+    let lastId = null
+    while (true) {
+      const result = await pool.query(
+        `SELECT id, face_embedding, face_embedding_model, created_at::text AS cursor_created_at
+         FROM voters
+         WHERE cardinality(face_embedding) > 0
+           AND face_embedding_model = $4
+           AND ($1::timestamptz IS NULL OR (created_at, id) > ($1, $2::uuid))
+         ORDER BY created_at, id
+         LIMIT $3`,
+        [lastCreatedAt, lastId, BATCH_ROWS, embeddingModel]
+      )
+      if (result.rows.length === 0) break
+
+      const manifest = result.rows
+        .map(row => JSON.stringify({
+          voter_id: row.id,
+          embedding: encodeEmbedding(row.face_embedding),
+          embedding_model: row.face_embedding_model,
+        }))
+        .join('\n')
+      await runPython(['--action', 'index-add', '--manifest', '-'], manifest)
+
+      total += result.rows.length
+      const last = result.rows[result.rows.length - 1]
+      // As PostgreSQL text: a JS Date would drop the microseconds and re-select rows already indexed
+      lastCreatedAt = last.cursor_created_at
+      lastId = last.id
+      console.log(`   Indexed ${total} voters`)
+    }
+
+    if (nlist && total > 0) {
+      console.log(`🔄 Training ${nlist} IVF partitions...`)
+      await runPython(['--action', 'index-build', '--nlist', String(nlist)])
+    }
+
+    // Embeddings from another model (or stored before the model was recorded) would corrupt the index
+    const skipped = await pool.query(
+      `SELECT COALESCE(face_embedding_model, 'unknown') AS model, COUNT(*)::int AS count
+       FROM voters
+       WHERE cardinality(face_embedding) > 0
+         AND face_embedding_model IS DISTINCT FROM $1
+       GROUP BY 1`,
+      [embeddingModel]
+    )
+    for (const row of skipped.rows) {
+      console.warn(`   ⚠️ Skipped ${row.count} voters with ${row.model} embeddings`)
+    }
+
+    console.log(`✅ Face index rebuilt with ${total} voters`)
+    process.exit(0)
+  } catch (error) {
+    console.error('❌ Face index rebuild error:', error)
+    process.exit(1)
+  }
+}
+
+buildFaceIndex()
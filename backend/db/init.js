@@ -44,11 +44,13 @@ const createTables = async () => {
       selfie_image_url TEXT,
       id_ocr JSONB,
       face_embedding REAL[],
+      face_embedding_model TEXT,
       face_hash TEXT,
       verification_status TEXT DEFAULT 'pending',
       flagged_reason TEXT,
       face_similarity REAL,
       validation_errors JSONB,
+      face_artifacts JSONB,
       created_at TIMESTAMPTZ DEFAULT NOW(),
       updated_at TIMESTAMPTZ DEFAULT NOW()
     )
@@ -93,6 +95,38 @@ const createTables = async () => {
   } catch (e) {
     console.error('Error adding validation_errors column:', e.message)
   }
+  
+  try {
+    // Check if face_artifacts column exists
+    const checkColumn = await pool.query(`
+      SELECT column_name 
+      FROM information_schema.columns 
+      WHERE table_name='voters' AND column_name='face_artifacts'
+    `)
+    
+    if (checkColumn.rows.length === 0) {
+      console.log('Adding face_artifacts column to voters table...')
+      await pool.query(`ALTER TABLE voters ADD COLUMN face_artifacts JSONB`)
+    }
+  } catch (e) {
+    console.error('Error adding face_artifacts column:', e.message)
+  }
+  
+  try {
+    // Check if face_embedding_model column exists
+    const checkColumn = await pool.query(`
+      SELECT column_name 
+      FROM information_schema.columns 
+      WHERE table_name='voters' AND column_name='face_embedding_model'
+    `)
+    
+    if (checkColumn.rows.length === 0) {
+      console.log('Adding face_embedding_model column to voters table...')
+      await pool.query(`ALTER TABLE voters ADD COLUMN face_embedding_model TEXT`)
+    }
+  } catch (e) {
+    console.error('Error adding face_embedding_model column:', e.message)
+  }
 
   // Create audit_logs table
   await pool.query(`
@@ -113,6 +147,16 @@ const createTables = async () => {
   await pool.query(`
     CREATE INDEX IF NOT EXISTS idx_voters_status ON voters(verification_status)
   `)
+  await pool.query(`
+    CREATE INDEX IF NOT EXISTS idx_voters_face_hash ON voters(face_hash)
+  `)
+  // Keyset pagination of the verification history, newest first, with and without a status filter
+  await pool.query(`
+    CREATE INDEX IF NOT EXISTS idx_voters_created_at ON voters(created_at DESC, id DESC)
+  `)
+  await pool.query(`
+    CREATE INDEX IF NOT EXISTS idx_voters_status_created_at ON voters(verification_status, created_at DESC, id DESC)
+  `)
   await pool.query(`
     CREATE INDEX IF NOT EXISTS idx_audit_voter_id ON audit_logs(voter_id)
   `)
@@ -50,6 +50,36 @@ async function migrate() {
       console.log('✅ validation_errors column already exists')
     }
     
+    // Check if face_artifacts column exists
+    const checkFaceArtifacts = await pool.query(`
+      SELECT column_name 
+      FROM information_schema.columns 
+      WHERE table_name='voters' AND column_name='face_artifacts'
+    `)
+    
+    if (checkFaceArtifacts.rows.length === 0) {
+      console.log('➕ Adding face_artifacts column...')
+      await pool.query(`ALTER TABLE voters ADD COLUMN face_artifacts JSONB`)
+      console.log('✅ face_artifacts column added')
+    } else {
+      console.log('✅ face_artifacts column already exists')
+    }
+    
+    // Check if face_embedding_model column exists
+    const checkEmbeddingModel = await pool.query(`
+      SELECT column_name 
+      FROM information_schema.columns 
+      WHERE table_name='voters' AND column_name='face_embedding_model'
+    `)
+    
+    if (checkEmbeddingModel.rows.length === 0) {
+      console.log('➕ Adding face_embedding_model column...')
+      await pool.query(`ALTER TABLE voters ADD COLUMN face_embedding_model TEXT`)
+      console.log('✅ face_embedding_model column added')
+    } else {
+      console.log('✅ face_embedding_model column already exists')
+    }
+    
     // Remove unique constraint if it exists
     try {
       await pool.query(`ALTER TABLE voters DROP CONSTRAINT IF EXISTS voters_id_number_key`)
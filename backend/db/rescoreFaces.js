@@ -0,0 +1,139 @@
+// Re-score every voter's ID photo against their selfie from the face crops stored at registration
+// Only the recognition model runs (no image decoding at full size, no detection)
+// Run with: node db/rescoreFaces.js [model] [--update]
+// e.g. node db/rescoreFaces.js insightface --update
+
+import pg from 'pg'
+import dotenv from 'dotenv'
+import { spawn } from 'child_process'
+import path from 'path'
+import { fileURLToPath } from 'url'
+import { dirname } from 'path'
+
+dotenv.config()
+
+const __filename = fileURLToPath(import.meta.url)
+const __dirname = dirname(__filename)
+
+const PYTHON_SCRIPT = path.join(__dirname, '../services/faceDetection.py')
+const PYTHON = process.env.PYTHON || (process.platform === 'win32' ? 'python' : 'python3')
+const FACE_CROPS_DIR = path.join(__dirname, '../uploads/faces')
+const BATCH_ROWS = 2000
+const RECOGNITION_BATCH_SIZE = 64
+
+const { Pool } = pg
+
+const pool = new Pool({
+  host: process.env.DB_HOST || 'localhost',
+  port: process.env.DB_PORT || 5432,
+  database: process.env.DB_NAME || 'voter_registration',
+  user: process.env.DB_USER || 'postgres',
+  password: process.env.DB_PASSWORD || 'postgres',
+})
+
+const runPython = (args, input) => new Promise((resolve, reject) => {
+  const script = spawn(PYTHON, [PYTHON_SCRIPT, ...args], { stdio: ['pipe', 'pipe', 'inherit'] })
+  let stdout = ''
+  script.stdout.on('data', (data) => {
+    stdout += data.toString()
+  })
+  script.on('error', reject)
+  script.on('close', (code) => {
+    if (code === 0) {
+      resolve(stdout.trim())
+    } else {
+      reject(new Error(`faceDetection.py exited with code ${code}: ${stdout.trim()}`))
+    }
+  })
+  script.stdin.end(input || '')
+})
+
+const cropPath = (cropUrl) => path.join(FACE_CROPS_DIR, path.basename(cropUrl))
+
+async function rescoreFaces() {
+  const args = process.argv.slice(2)
+  const update = args.includes('--update')
+  const model = args.find(arg => !arg.startsWith('--')) || 'auto'
+
+  try {
+    console.log(`🔄 Re-scoring stored face crops with ${model}${update ? ' (saving face_similarity)' : ''}...`)
+
+    let total = 0
+    let failed = 0
+    let changeSum = 0
+    let lastCreatedAt = null
+    let lastId = null
+    while (true) {
+      const result = await pool.query(
+        `SELECT id, face_similarity, face_artifacts->'faces' AS faces,
+           face_artifacts->'detector'->>'family' AS detector, face_artifacts->>'cropSize' AS crop_size,
+           face_artifacts->>'version' AS version, created_at::text AS cursor_created_at
+         FROM voters
+         WHERE face_artifacts->'faces'->'id'->>'crop' IS NOT NULL
+           AND face_artifacts->'faces'->'selfie'->>'crop' IS NOT NULL
+           AND ($1::timestamptz IS NULL OR (created_at, id) > ($1, $2::uuid))
+         ORDER BY created_at, id
+         LIMIT $3`,
+        [lastCreatedAt, lastId, BATCH_ROWS]
+      )
+      if (result.rows.length === 0) break
+
+      const manifest = result.rows
+        .map(row => JSON.stringify({
+          voter_id: row.id,
+          id_image: cropPath(row.faces.id.crop),
+          selfie_image: cropPath(row.faces.selfie.crop),
+          // Unaligned or incompatible crops are refused and reported, never saved
+          aligned: row.faces.id.aligned === true && row.faces.selfie.aligned === true,
+          detector: row.detector,
+          crop_size: row.crop_size,
+          artifact_version: row.version,
+        }))
+        .join('\n')
+      const output = await runPython(
+        ['--action', 'recompare', '--model', model, '--manifest', '-', '--batch-size', String(RECOGNITION_BATCH_SIZE)],
+        manifest
+      )
+
+      const previous = new Map(result.rows.map(row => [row.id, row.face_similarity]))
+      const scored = output.split('\n').filter(Boolean).map(line => JSON.parse(line))
+      const ids = []
+      const similarities = []
+      for (const entry of scored) {
+        if (entry.error) {
+          failed++
+          console.warn(`   ⚠️ ${entry.voter_id || 'batch'}: ${entry.error}`)
+          continue
+        }
+        ids.push(entry.voter_id)
+        similarities.push(entry.similarity)
+        changeSum += Math.abs(entry.similarity - (previous.get(entry.voter_id) ?? 0))
+      }
+
+      if (update && ids.length > 0) {
+        await pool.query(
+          `UPDATE voters SET face_similarity = scores.similarity
+           FROM unnest($1::uuid[], $2::real[]) AS scores(id, similarity)
+           WHERE voters.id = scores.id`,
+          [ids, similarities]
+        )
+      }
+
+      total += ids.length
+      const last = result.rows[result.rows.length - 1]
+      // As PostgreSQL text: a JS Date would drop the microseconds and re-select rows already scored
+      lastCreatedAt = last.cursor_created_at
+      lastId = last.id
+      console.log(`   Re-scored ${total} voters`)
+    }
+
+    const meanChange = total > 0 ? (changeSum / total).toFixed(4) : '0'
+    console.log(`✅ Re-scored ${total} voters (${failed} failed), mean similarity change ${meanChange}`)
+    process.exit(0)
+  } catch (error) {
+    console.error('❌ Face re-scoring error:', error)
+    process.exit(1)
+  }
+}
+
+rescoreFaces()
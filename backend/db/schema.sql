@@ -12,9 +12,13 @@ CREATE TABLE IF NOT EXISTS voters (
   selfie_image_url TEXT,
   id_ocr JSONB,
   face_embedding REAL[],
+  -- Model that produced face_embedding; embeddings from different models are not comparable
+  face_embedding_model TEXT,
   face_hash TEXT,
   verification_status TEXT DEFAULT 'pending',
   flagged_reason TEXT,
+  -- Aligned face crop URLs with their boxes, landmarks and detector (see createFaceArtifacts)
+  face_artifacts JSONB,
   created_at TIMESTAMPTZ DEFAULT NOW(),
   updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -33,6 +37,10 @@ CREATE TABLE IF NOT EXISTS audit_logs (
 CREATE INDEX IF NOT EXISTS idx_voters_id_number ON voters(id_number);
 CREATE INDEX IF NOT EXISTS idx_voters_status ON voters(verification_status);
 CREATE INDEX IF NOT EXISTS idx_voters_phone ON voters(phone);
+CREATE INDEX IF NOT EXISTS idx_voters_face_hash ON voters(face_hash);
+-- Keyset pagination of the verification history (GET /api/verifications)
+CREATE INDEX IF NOT EXISTS idx_voters_created_at ON voters(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_voters_status_created_at ON voters(verification_status, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_audit_voter_id ON audit_logs(voter_id);
 CREATE INDEX IF NOT EXISTS idx_audit_created_at ON audit_logs(created_at);
 
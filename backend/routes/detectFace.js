@@ -1,26 +1,13 @@
 import express from 'express'
 import multer from 'multer'
-import path from 'path'
-import { fileURLToPath } from 'url'
-import { dirname } from 'path'
-import { detectFaces } from '../services/faceDetectionService.js'
+import { v4 as uuidv4 } from 'uuid'
+import { detectFaces, openFaceStream } from '../services/faceDetectionService.js'
 import { detectFacesWithGoogleVision } from '../services/googleVision.js'
 
-const __filename = fileURLToPath(import.meta.url)
-const __dirname = dirname(__filename)
-
 const router = express.Router()
 
-// Configure multer for file uploads
-const storage = multer.diskStorage({
-  destination: (req, file, cb) => {
-    cb(null, path.join(__dirname, '../uploads'))
-  },
-  filename: (req, file, cb) => {
-    const uniqueSuffix = Date.now() + '-' + Math.round(Math.random() * 1e9)
-    cb(null, 'detect-' + uniqueSuffix + path.extname(file.originalname))
-  },
-})
+// Detection uploads are not kept, so hold them in memory and hand the bytes straight to the detector
+const storage = multer.memoryStorage()
 
 const upload = multer({
   storage,
@@ -51,12 +38,17 @@ router.post('/', upload.single('image'), async (req, res) => {
 
     // Get model from body (multer makes form fields available in req.body)
     const model = req.body?.model || req.body?.faceModel
-    const imagePath = req.file.path
+    const image = req.file.buffer
     const detectionModel = model || 'yolov8-face'
+    // Optional DeepFace attribute analysis, e.g. analyze=age,gender; omitted = detection only
+    const detectOptions = {
+      analyze: req.body?.analyze,
+      detectorBackend: req.body?.detectorBackend,
+    }
     
     console.log('Face detection request:', {
       model: detectionModel,
-      filename: req.file.filename,
+      filename: req.file.originalname,
       size: req.file.size,
     })
 
@@ -65,7 +57,7 @@ router.post('/', upload.single('image'), async (req, res) => {
     // Try Google Vision first if model is google-vision
     if (detectionModel === 'google-vision') {
       try {
-        const googleResult = await detectFacesWithGoogleVision(imagePath)
+        const googleResult = await detectFacesWithGoogleVision(image)
         result = {
           face_count: googleResult.faceCount,
           faces: googleResult.faces.map(face => ({
@@ -83,11 +75,11 @@ router.post('/', upload.single('image'), async (req, res) => {
       } catch (error) {
         console.warn('Google Vision face detection failed, falling back to local:', error.message)
         // Fallback to local detection
-        result = await detectFaces(imagePath, detectionModel)
+        result = await detectFaces(image, detectionModel, detectOptions)
       }
     } else {
       // Use local face detection
-      result = await detectFaces(imagePath, detectionModel)
+      result = await detectFaces(image, detectionModel, detectOptions)
     }
 
     // Log result for debugging
@@ -142,5 +134,143 @@ router.post('/', upload.single('image'), async (req, res) => {
   }
 })
 
+// Live capture streams: one tracking process per open camera session
+const FACE_STREAM_MAX_SESSIONS = parseInt(process.env.FACE_STREAM_MAX_SESSIONS || '4')
+const FACE_STREAM_IDLE_MS = parseInt(process.env.FACE_STREAM_IDLE_MS || '30000')
+const streamSessions = new Map()
+// Sessions still starting their process; they count against FACE_STREAM_MAX_SESSIONS too
+let openingStreams = 0
+
+const closeStreamSession = (streamId) => {
+  const session = streamSessions.get(streamId)
+  if (session) {
+    clearTimeout(session.idleTimer)
+    session.stream.close()
+    streamSessions.delete(streamId)
+  }
+}
+
+// Abandoned sessions (closed tab, lost connection) release their process after FACE_STREAM_IDLE_MS
+const touchStreamSession = (streamId) => {
+  const session = streamSessions.get(streamId)
+  clearTimeout(session.idleTimer)
+  session.idleTimer = setTimeout(() => closeStreamSession(streamId), FACE_STREAM_IDLE_MS)
+  session.idleTimer.unref()
+}
+
+/**
+ * POST /api/detect-face/streams
+ * Open a live face tracking session. Body: { model, keyframeInterval }
+ */
+router.post('/streams', async (req, res) => {
+  try {
+    if (streamSessions.size + openingStreams >= FACE_STREAM_MAX_SESSIONS) {
+      res.set('Retry-After', String(Math.ceil(FACE_STREAM_IDLE_MS / 1000)))
+      return res.status(503).json({
+        status: 'error',
+        message: 'Too many live face streams are open. Please try again shortly.',
+      })
+    }
+
+    const model = req.body?.model || 'mediapipe'
+    const keyframeInterval = parseInt(req.body?.keyframeInterval) || null
+    let stream
+    openingStreams++
+    try {
+      stream = await openFaceStream(model, { keyframeInterval })
+    } finally {
+      openingStreams--
+    }
+    const streamId = uuidv4()
+    streamSessions.set(streamId, { stream, idleTimer: null })
+    stream.on('close', () => closeStreamSession(streamId))
+    touchStreamSession(streamId)
+
+    res.status(201).json({
+      status: 'success',
+      streamId,
+      model,
+      keyframeInterval: stream.info?.keyframe_interval,
+      idleTimeoutMs: FACE_STREAM_IDLE_MS,
+    })
+  } catch (error) {
+    console.error('Face stream error:', error)
+    res.status(500).json({
+      status: 'error',
+      message: error.message || 'Failed to open face stream',
+    })
+  }
+})
+
+/**
+ * POST /api/detect-face/streams/:streamId/frames
+ * Boxes for one camera frame (multipart field "frame"). Tracked frames skip the detector; frames sent
+ * while earlier ones are still processing come back with dropped: true.
+ */
+router.post('/streams/:streamId/frames', upload.single('frame'), async (req, res) => {
+  const session = streamSessions.get(req.params.streamId)
+  if (!session) {
+    return res.status(404).json({
+      status: 'error',
+      message: 'Face stream not found or expired',
+    })
+  }
+  if (!req.file) {
+    return res.status(400).json({
+      status: 'error',
+      message: 'Frame is required',
+    })
+  }
+
+  try {
+    touchStreamSession(req.params.streamId)
+    const result = await session.stream.push(req.file.buffer)
+    res.json({
+      status: result.error ? 'error' : 'success',
+      frame: result.frame,
+      keyframe: result.keyframe,
+      dropped: result.dropped || undefined,
+      hasFace: result.face_count > 0,
+      faceCount: result.face_count,
+      faces: result.faces || [],
+      model: result.model,
+      timings_ms: result.timings_ms,
+      error: result.error || undefined,
+    })
+  } catch (error) {
+    console.error('Face stream frame error:', error)
+    res.status(500).json({
+      status: 'error',
+      message: error.message || 'Failed to process frame',
+    })
+  }
+})
+
+/**
+ * POST /api/detect-face/streams/:streamId/reset
+ * Drop the tracked faces; the next frame runs the detector
+ */
+router.post('/streams/:streamId/reset', (req, res) => {
+  const session = streamSessions.get(req.params.streamId)
+  if (!session) {
+    return res.status(404).json({
+      status: 'error',
+      message: 'Face stream not found or expired',
+    })
+  }
+  session.stream.reset()
+  touchStreamSession(req.params.streamId)
+  res.json({ status: 'success' })
+})
+
+/**
+ * DELETE /api/detect-face/streams/:streamId
+ * Close a live face tracking session
+ */
+router.delete('/streams/:streamId', (req, res) => {
+  closeStreamSession(req.params.streamId)
+  res.json({ status: 'success' })
+})
+
 export default router
 
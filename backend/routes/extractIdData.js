@@ -52,6 +52,20 @@ router.post('/', upload.single('idImage'), async (req, res) => {
     console.log('🔍 Validating uploaded image...')
     const validation = await validateIdImage(imagePath)
     
+    // Blank, blurred, badly exposed or tiny images would only give OCR noise
+    if (!validation.usable) {
+      console.warn(`⚠️ Image quality too low: ${validation.reason}`)
+      return res.status(400).json({
+        status: 'error',
+        message: `The uploaded image cannot be read reliably (${validation.reason.toLowerCase()}). Please retake the photo in good light, with the whole ID card in focus.`,
+        validation: {
+          usable: false,
+          reason: validation.reason,
+          issues: validation.quality.issues,
+        },
+      })
+    }
+    
     if (!validation.isIdCard && validation.confidence > 0.6) {
       console.warn('⚠️ Image validation failed - likely not an ID card')
       return res.status(400).json({
@@ -1,16 +1,17 @@
 // API endpoint to get available face detection models
 import express from 'express'
-import { getAvailableModels } from '../services/faceDetectionService.js'
+import { getAvailableModels, getFaceWorkerStats } from '../services/faceDetectionService.js'
 
 const router = express.Router()
 
 /**
  * GET /api/face-models
  * Returns list of available face detection models with their configuration status
+ * Availability is cached; ?refresh=true re-probes the Python environment
  */
 router.get('/', async (req, res) => {
   try {
-    const models = await getAvailableModels()
+    const models = await getAvailableModels({ refresh: req.query.refresh === 'true' })
     res.json({
       status: 'success',
       models,
@@ -30,5 +31,16 @@ router.get('/', async (req, res) => {
   }
 })
 
+/**
+ * GET /api/face-models/workers
+ * Warm worker processes per backend: state, resident memory, restarts and the shared memory budget
+ */
+router.get('/workers', (req, res) => {
+  res.json({
+    status: 'success',
+    workers: getFaceWorkerStats(),
+  })
+})
+
 export default router
 
@@ -0,0 +1,19 @@
+// API endpoint exposing face pipeline metrics for Prometheus scraping
+import express from 'express'
+import { recordWorkerStats, renderMetrics } from '../services/metrics.js'
+import { getFaceWorkerStats } from '../services/faceDetectionService.js'
+
+const router = express.Router()
+
+/**
+ * GET /api/metrics
+ * Per-model stage and job duration histograms, and per-backend worker memory and restarts,
+ * in the Prometheus text format
+ */
+router.get('/', (req, res) => {
+  recordWorkerStats(getFaceWorkerStats())
+  res.set('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+  res.send(renderMetrics())
+})
+
+export default router
@@ -1,26 +1,31 @@
 import express from 'express'
 import multer from 'multer'
+import fs from 'fs/promises'
 import path from 'path'
 import { fileURLToPath } from 'url'
 import { dirname } from 'path'
-import { processRegistration } from '../services/registration.js'
-import { createAuditLog } from '../services/audit.js'
+import {
+  getRegistrationJob,
+  getRegistrationQueueStats,
+  checkRegistrationCapacity,
+  submitRegistration,
+} from '../services/registration.js'
 
 const __filename = fileURLToPath(import.meta.url)
 const __dirname = dirname(__filename)
 
 const router = express.Router()
 
-// Configure multer for file uploads
-const storage = multer.diskStorage({
-  destination: (req, file, cb) => {
-    cb(null, path.join(__dirname, '../uploads'))
-  },
-  filename: (req, file, cb) => {
-    const uniqueSuffix = Date.now() + '-' + Math.round(Math.random() * 1e9)
-    cb(null, file.fieldname + '-' + uniqueSuffix + path.extname(file.originalname))
-  },
-})
+// Keep uploads in memory: the face pipeline gets the bytes directly, and each image is
+// written to uploads/ exactly once for OCR and the voter record
+const storage = multer.memoryStorage()
+
+const saveUpload = async (file) => {
+  const uniqueSuffix = Date.now() + '-' + Math.round(Math.random() * 1e9)
+  const filePath = path.join(__dirname, '../uploads', file.fieldname + '-' + uniqueSuffix + path.extname(file.originalname))
+  await fs.writeFile(filePath, file.buffer)
+  return filePath
+}
 
 const upload = multer({
   storage,
@@ -36,7 +41,14 @@ const upload = multer({
   },
 })
 
+/**
+ * POST /api/register
+ * Saves the uploads and queues the registration: answers 202 with a job id to poll at
+ * GET /api/register/jobs/:jobId, or 503 with Retry-After when the queue is full.
+ * ?wait=true holds the request open and answers with the finished registration instead.
+ */
 router.post('/', upload.fields([{ name: 'idImage' }, { name: 'idBackImage' }, { name: 'selfieImage' }]), async (req, res) => {
+  const savedPaths = []
   try {
     const { fullName, nationalId, dateOfBirth, phoneNumber, address, ocrModel, faceModel } = req.body
 
@@ -47,11 +59,19 @@ router.post('/', upload.fields([{ name: 'idImage' }, { name: 'idBackImage' }, {
       })
     }
 
-    const idImagePath = req.files.idImage[0].path
-    const idBackImagePath = req.files.idBackImage[0].path
-    const selfieImagePath = req.files.selfieImage[0].path
+    // Shed load before touching the disk
+    checkRegistrationCapacity()
 
-    const result = await processRegistration({
+    const idImage = req.files.idImage[0]
+    const selfieImage = req.files.selfieImage[0]
+    const [idImagePath, idBackImagePath, selfieImagePath] = await Promise.all([
+      saveUpload(idImage),
+      saveUpload(req.files.idBackImage[0]),
+      saveUpload(selfieImage),
+    ])
+    savedPaths.push(idImagePath, idBackImagePath, selfieImagePath)
+
+    const job = submitRegistration({
       form: {
         fullName,
         nationalId,
@@ -62,47 +82,40 @@ router.post('/', upload.fields([{ name: 'idImage' }, { name: 'idBackImage' }, {
       idImagePath,
       idBackImagePath,
       selfieImagePath,
+      idImageBuffer: idImage.buffer,
+      selfieImageBuffer: selfieImage.buffer,
       ocrModel: ocrModel || 'tesseract', // Default to tesseract if not specified
       faceModel: faceModel || null, // Face detection model (optional)
     })
 
-    // Create audit log
-    await createAuditLog({
-      voterId: result.voterId,
-      action: 'registration_submitted',
-      actor: 'system',
-      details: {
-        status: result.status,
-        flaggedReason: result.flaggedReason,
-      },
-    })
+    if (req.query.wait === 'true') {
+      await job.done
+      if (job.status === 'failed') {
+        throw new Error(job.error)
+      }
+      return res.json(job.result)
+    }
 
-    res.json({
-      status: result.status,
-      voterId: result.voterId,
-      message: result.message,
-      similarity: result.similarity,
-      validationErrors: result.validationErrors,
-      flaggedReason: result.flaggedReason,
-      data: {
-        fullName,
-        nationalId,
-        dateOfBirth,
-        phoneNumber,
-        address,
-      },
-      extractedData: result.ocrResult ? {
-        fullName: result.ocrResult.fullName || result.ocrResult.name || null,
-        idNumber: result.ocrResult.idNumber || null,
-        dateOfBirth: result.ocrResult.dateOfBirth || result.ocrResult.dob || null,
-        sex: result.ocrResult.sex || null,
-        districtOfBirth: result.ocrResult.districtOfBirth || null,
-        placeOfIssue: result.ocrResult.placeOfIssue || null,
-        dateOfIssue: result.ocrResult.dateOfIssue || null,
-        method: result.ocrResult.method || null,
-      } : null,
-    })
+    res.status(202)
+      .location(`${req.baseUrl}/jobs/${job.id}`)
+      .json({
+        status: 'accepted',
+        jobId: job.id,
+        statusUrl: `${req.baseUrl}/jobs/${job.id}`,
+        message: 'Registration received and queued for verification.',
+      })
   } catch (error) {
+    if (error.code === 'QUEUE_FULL') {
+      // Nothing was queued; don't keep the uploads
+      await Promise.all(savedPaths.map(file => fs.unlink(file).catch(() => {})))
+      res.set('Retry-After', String(error.retryAfterSeconds))
+      return res.status(503).json({
+        status: 'error',
+        message: 'The server is busy processing other registrations. Please try again shortly.',
+        retryAfter: error.retryAfterSeconds,
+      })
+    }
+
     console.error('Registration error:', error)
     console.error('Error stack:', error.stack)
     
@@ -117,4 +130,31 @@ router.post('/', upload.fields([{ name: 'idImage' }, { name: 'idBackImage' }, {
   }
 })
 
+/**
+ * GET /api/register/jobs/:jobId
+ * Status of a queued registration: queued (with position), running (with stage),
+ * completed (with the registration result) or failed (with the error)
+ */
+router.get('/jobs/:jobId', (req, res) => {
+  const job = getRegistrationJob(req.params.jobId)
+  if (!job) {
+    return res.status(404).json({
+      status: 'error',
+      message: 'Registration job not found or expired',
+    })
+  }
+  res.json(job)
+})
+
+/**
+ * GET /api/register/queue
+ * Queue depth and per-stage concurrency, for monitoring
+ */
+router.get('/queue', (req, res) => {
+  res.json({
+    status: 'success',
+    ...getRegistrationQueueStats(),
+  })
+})
+
 export default router
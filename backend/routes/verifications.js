@@ -1,119 +1,155 @@
 // API endpoint to get all verifications/history
 import express from 'express'
 import pool from '../db/init.js'
+import { recompareFaces } from '../services/faceDetectionService.js'
+import { storedFacePair } from '../services/registration.js'
+import { createAuditLog } from '../services/audit.js'
 
 const router = express.Router()
 
+// History pages: default and largest page sizes
+const DEFAULT_PAGE_SIZE = 50
+const MAX_PAGE_SIZE = 200
+// Totals are cached this long; below VERIFICATION_EXACT_COUNT_MAX rows they are exact, above it the
+// planner's row estimate is returned (marked totalApproximate) instead of scanning the table
+const VERIFICATION_COUNT_TTL_MS = parseInt(process.env.VERIFICATION_COUNT_TTL_MS || '30000')
+const VERIFICATION_EXACT_COUNT_MAX = parseInt(process.env.VERIFICATION_EXACT_COUNT_MAX || '100000')
+
+// JSONB is already parsed by PostgreSQL; older rows may hold a JSON string or a bare message
+const parseValidationErrors = (value) => {
+  if (!value) return null
+  if (typeof value === 'string') {
+    try {
+      return JSON.parse(value)
+    } catch (e) {
+      // If parsing fails, treat it as a single error message
+      return [value]
+    }
+  }
+  return Array.isArray(value) ? value : [value]
+}
+
+// Cursors carry created_at as PostgreSQL text, keeping the microseconds a JS Date would drop
+const encodeCursor = (row) => Buffer.from(JSON.stringify([row.cursor_created_at, row.id])).toString('base64url')
+
+const decodeCursor = (cursor) => {
+  try {
+    const [createdAt, id] = JSON.parse(Buffer.from(cursor, 'base64url').toString('utf8'))
+    return typeof createdAt === 'string' && /^[0-9a-f-]{36}$/i.test(id) ? { createdAt, id } : null
+  } catch (e) {
+    return null
+  }
+}
+
+const countCache = new Map()
+
+/**
+ * Number of verifications (optionally with one status), cached for VERIFICATION_COUNT_TTL_MS
+ */
+const countVerifications = async (status) => {
+  const key = status || ''
+  const cached = countCache.get(key)
+  if (cached && cached.expiresAt > Date.now()) {
+    return cached
+  }
+  
+  const where = status ? ' WHERE verification_status = $1' : ''
+  const params = status ? [status] : []
+  // The planner's estimate costs nothing; only count exactly while that is cheap
+  const plan = await pool.query(`EXPLAIN (FORMAT JSON) SELECT 1 FROM voters${where}`, params)
+  const estimate = Math.round(plan.rows[0]['QUERY PLAN'][0].Plan['Plan Rows'])
+  
+  let entry
+  if (estimate >= VERIFICATION_EXACT_COUNT_MAX) {
+    entry = { total: estimate, approximate: true }
+  } else {
+    const countResult = await pool.query(`SELECT COUNT(*) FROM voters${where}`, params)
+    entry = { total: parseInt(countResult.rows[0].count), approximate: false }
+  }
+  entry.expiresAt = Date.now() + VERIFICATION_COUNT_TTL_MS
+  countCache.set(key, entry)
+  return entry
+}
+
 /**
  * GET /api/verifications
- * Returns all verification records with their status
- * Query params: status (optional) - filter by status
+ * Returns a page of verification summaries, newest first; OCR data, images and face artifacts come from /:id
+ * Query params: status (optional) - filter by status, limit (default 50, max 200),
+ * cursor (optional) - nextCursor of the previous page
+ * Pages are read from the (created_at, id) index, so a deep page costs the same as the first
  */
 router.get('/', async (req, res) => {
   try {
-    const { status, limit = 50, offset = 0 } = req.query
+    const { status, cursor } = req.query
+    const limit = Math.min(MAX_PAGE_SIZE, Math.max(1, parseInt(req.query.limit) || DEFAULT_PAGE_SIZE))
+    
+    const after = cursor ? decodeCursor(cursor) : null
+    if (cursor && !after) {
+      return res.status(400).json({
+        status: 'error',
+        message: 'Invalid cursor',
+      })
+    }
+    
+    const conditions = []
+    const params = []
+    if (status) {
+      params.push(status)
+      conditions.push(`verification_status = $${params.length}`)
+    }
+    if (after) {
+      params.push(after.createdAt, after.id)
+      conditions.push(`(created_at, id) < ($${params.length - 1}::timestamptz, $${params.length}::uuid)`)
+    }
+    params.push(limit + 1) // One extra row tells whether another page follows
     
-    let query = `
+    const query = `
       SELECT 
         id,
         id_number,
         name,
         dob,
         phone,
-        address,
         verification_status,
         flagged_reason,
         face_similarity,
         validation_errors,
-        id_image_url,
-        selfie_image_url,
-        id_ocr,
-        created_at
+        created_at,
+        created_at::text AS cursor_created_at
       FROM voters
+      ${conditions.length > 0 ? `WHERE ${conditions.join(' AND ')}` : ''}
+      ORDER BY created_at DESC, id DESC
+      LIMIT $${params.length}
     `
     
-    const params = []
-    
-    if (status) {
-      query += ` WHERE verification_status = $1`
-      params.push(status)
-    }
-    
-    query += ` ORDER BY created_at DESC LIMIT $${params.length + 1} OFFSET $${params.length + 2}`
-    params.push(parseInt(limit), parseInt(offset))
-    
-    const result = await pool.query(query, params)
-    
-    // Get total count
-    let countQuery = 'SELECT COUNT(*) FROM voters'
-    const countParams = []
-    if (status) {
-      countQuery += ' WHERE verification_status = $1'
-      countParams.push(status)
-    }
-    const countResult = await pool.query(countQuery, countParams)
-    const total = parseInt(countResult.rows[0].count)
+    const [result, count] = await Promise.all([
+      pool.query(query, params),
+      countVerifications(status),
+    ])
+    const rows = result.rows.slice(0, limit)
+    const hasMore = result.rows.length > limit
     
     res.json({
       status: 'success',
-      verifications: result.rows.map(row => {
-        // Handle validation_errors - JSONB is already parsed by PostgreSQL
-        let validationErrors = null
-        if (row.validation_errors) {
-          if (typeof row.validation_errors === 'string') {
-            // If it's a string, try to parse it
-            try {
-              validationErrors = JSON.parse(row.validation_errors)
-            } catch (e) {
-              // If parsing fails, treat it as a single error message
-              validationErrors = [row.validation_errors]
-            }
-          } else if (Array.isArray(row.validation_errors)) {
-            // Already an array
-            validationErrors = row.validation_errors
-          } else if (typeof row.validation_errors === 'object') {
-            // Already an object, convert to array if needed
-            validationErrors = Array.isArray(row.validation_errors) ? row.validation_errors : [row.validation_errors]
-          }
-        }
-        
-        // Handle id_ocr - JSONB is already parsed by PostgreSQL
-        let ocrData = null
-        if (row.id_ocr) {
-          if (typeof row.id_ocr === 'string') {
-            try {
-              ocrData = JSON.parse(row.id_ocr)
-            } catch (e) {
-              ocrData = null
-            }
-          } else {
-            ocrData = row.id_ocr
-          }
-        }
-        
-        return {
-          id: row.id,
-          idNumber: row.id_number,
-          name: row.name,
-          dateOfBirth: row.dob,
-          phone: row.phone,
-          address: row.address,
-          status: row.verification_status,
-          flaggedReason: row.flagged_reason,
-          faceSimilarity: row.face_similarity,
-          validationErrors,
-          idImageUrl: row.id_image_url,
-          selfieImageUrl: row.selfie_image_url,
-          idBackImageUrl: ocrData?.idBackImageUrl || null,
-          ocrData: ocrData,
-          createdAt: row.created_at,
-          isApproved: row.verification_status === 'verified',
-          isFailed: row.verification_status === 'flagged' || row.verification_status === 'rejected',
-        }
-      }),
-      total,
-      limit: parseInt(limit),
-      offset: parseInt(offset),
+      verifications: rows.map(row => ({
+        id: row.id,
+        idNumber: row.id_number,
+        name: row.name,
+        dateOfBirth: row.dob,
+        phone: row.phone,
+        status: row.verification_status,
+        flaggedReason: row.flagged_reason,
+        faceSimilarity: row.face_similarity,
+        validationErrors: parseValidationErrors(row.validation_errors),
+        createdAt: row.created_at,
+        isApproved: row.verification_status === 'verified',
+        isFailed: row.verification_status === 'flagged' || row.verification_status === 'rejected',
+      })),
+      total: count.total,
+      totalApproximate: count.approximate,
+      limit,
+      hasMore,
+      nextCursor: hasMore ? encodeCursor(rows[rows.length - 1]) : null,
     })
   } catch (error) {
     console.error('Error fetching verifications:', error)
@@ -196,6 +232,7 @@ router.get('/:id', async (req, res) => {
         id_image_url,
         selfie_image_url,
         id_ocr,
+        face_artifacts,
         created_at
       FROM voters
       WHERE id = $1`,
@@ -211,22 +248,6 @@ router.get('/:id', async (req, res) => {
     
     const row = result.rows[0]
     
-    // Handle validation_errors
-    let validationErrors = null
-    if (row.validation_errors) {
-      if (typeof row.validation_errors === 'string') {
-        try {
-          validationErrors = JSON.parse(row.validation_errors)
-        } catch (e) {
-          validationErrors = [row.validation_errors]
-        }
-      } else if (Array.isArray(row.validation_errors)) {
-        validationErrors = row.validation_errors
-      } else if (typeof row.validation_errors === 'object') {
-        validationErrors = Array.isArray(row.validation_errors) ? row.validation_errors : [row.validation_errors]
-      }
-    }
-    
     // Handle id_ocr
     let ocrData = null
     if (row.id_ocr) {
@@ -253,11 +274,12 @@ router.get('/:id', async (req, res) => {
         status: row.verification_status,
         flaggedReason: row.flagged_reason,
         faceSimilarity: row.face_similarity,
-        validationErrors,
+        validationErrors: parseValidationErrors(row.validation_errors),
         idImageUrl: row.id_image_url,
         selfieImageUrl: row.selfie_image_url,
         idBackImageUrl: ocrData?.idBackImageUrl || null,
         ocrData: ocrData,
+        faceArtifacts: row.face_artifacts || null,
         createdAt: row.created_at,
         isApproved: row.verification_status === 'verified',
         isFailed: row.verification_status === 'flagged' || row.verification_status === 'rejected',
@@ -272,5 +294,78 @@ router.get('/:id', async (req, res) => {
   }
 })
 
+/**
+ * POST /api/verifications/:id/recompare
+ * Re-scores the ID photo against the selfie from the face crops stored at registration, so only
+ * the recognition model runs. Body: model (default auto), save (store the new face_similarity)
+ */
+router.post('/:id/recompare', async (req, res) => {
+  try {
+    const { id } = req.params
+    const { model = 'auto', save = false } = req.body || {}
+    
+    const result = await pool.query(
+      `SELECT id, face_similarity, face_artifacts FROM voters WHERE id = $1`,
+      [id]
+    )
+    if (result.rows.length === 0) {
+      return res.status(404).json({
+        status: 'error',
+        message: 'Verification not found',
+      })
+    }
+    
+    const row = result.rows[0]
+    const faces = row.face_artifacts?.faces
+    if (!faces?.id?.crop || !faces?.selfie?.crop) {
+      return res.status(409).json({
+        status: 'error',
+        message: 'No stored face crops for this verification; it was registered without face artifacts',
+      })
+    }
+    
+    const [comparison] = await recompareFaces([storedFacePair(row.id, row.face_artifacts)], model)
+    if (comparison.error) {
+      // Nothing is saved: unaligned crops (e.g. from the yolov8-face fallback) would give a misleading score
+      return res.status(422).json({
+        status: 'error',
+        message: comparison.error,
+        unaligned: comparison.unaligned || undefined,
+      })
+    }
+    
+    if (save === true || save === 'true') {
+      await pool.query(`UPDATE voters SET face_similarity = $1 WHERE id = $2`, [comparison.similarity, row.id])
+      await createAuditLog({
+        voterId: row.id,
+        action: 'face_recompared',
+        actor: 'admin',
+        details: {
+          model: comparison.model,
+          previousSimilarity: row.face_similarity,
+          similarity: comparison.similarity,
+        },
+      })
+    }
+    
+    res.json({
+      status: 'success',
+      recompare: {
+        model: comparison.model,
+        similarity: comparison.similarity,
+        previousSimilarity: row.face_similarity,
+        saved: save === true || save === 'true',
+      },
+    })
+  } catch (error) {
+    console.error('Error recomparing faces:', error)
+    res.status(500).json({
+      status: 'error',
+      message: 'Failed to recompare faces',
+      error: error.message,
+    })
+  }
+})
+
 export default router
 
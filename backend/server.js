@@ -9,7 +9,9 @@ import ocrModelsRoutes from './routes/ocrModels.js'
 import faceModelsRoutes from './routes/faceModels.js'
 import detectFaceRoutes from './routes/detectFace.js'
 import verificationsRoutes from './routes/verifications.js'
+import metricsRoutes from './routes/metrics.js'
 import { initDatabase } from './db/init.js'
+import { shutdownTesseractPool } from './services/tesseractPool.js'
 
 dotenv.config()
 
@@ -34,6 +36,7 @@ app.use('/api/ocr-models', ocrModelsRoutes)
 app.use('/api/face-models', faceModelsRoutes)
 app.use('/api/detect-face', detectFaceRoutes)
 app.use('/api/verifications', verificationsRoutes)
+app.use('/api/metrics', metricsRoutes)
 
 // Health check
 app.get('/api/health', (req, res) => {
@@ -43,10 +46,20 @@ app.get('/api/health', (req, res) => {
 // Initialize database and start server
 initDatabase()
   .then(() => {
-    app.listen(PORT, () => {
+    const server = app.listen(PORT, () => {
       console.log(`Server running on port ${PORT}`)
       console.log(`Environment: ${process.env.NODE_ENV || 'development'}`)
     })
+
+    // Stop accepting requests, then terminate the warm OCR workers before exiting
+    // (face workers are stopped by their own exit hook)
+    const shutdown = (signal) => {
+      console.log(`${signal} received, shutting down...`)
+      server.close()
+      shutdownTesseractPool().finally(() => process.exit(0))
+    }
+    process.once('SIGTERM', shutdown)
+    process.once('SIGINT', shutdown)
   })
   .catch((error) => {
     console.error('Failed to initialize database:', error)
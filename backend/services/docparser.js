@@ -1,10 +1,9 @@
 // Docparser Service - Structured document parsing for Kenyan ID cards
 // Uses zonal OCR and pattern matching for better accuracy
 
-import fs from 'fs/promises'
-import { createWorker } from 'tesseract.js'
+import { recognizeText } from './tesseractPool.js'
 import { parseKenyanID } from './idParser.js'
-import { preprocessImage } from './imagePreprocessor.js'
+import { preprocessImageBuffer } from './imagePreprocessor.js'
 
 /**
  * Docparser-style structured parsing for Kenyan ID cards
@@ -12,38 +11,16 @@ import { preprocessImage } from './imagePreprocessor.js'
  */
 export const parseIDWithDocparser = async (imagePath) => {
   try {
-    // Preprocess image first (rotation correction, contrast enhancement)
-    let processedImagePath = imagePath
+    // Preprocess image first (rotation correction, contrast enhancement), in memory
+    let processedImage = imagePath
     try {
-      processedImagePath = await preprocessImage(imagePath)
+      processedImage = (await preprocessImageBuffer(imagePath)) || imagePath
     } catch (error) {
       console.warn('⚠️ Image preprocessing failed in docparser, using original:', error.message)
     }
     
-    // Create Tesseract worker for zonal OCR with LSTM engine
-    const worker = await createWorker('eng', 1, {
-      logger: m => {
-        // Suppress verbose logging
-      }
-    })
-    
-    // Configure for better accuracy
-    // Note: tessedit_ocr_engine_mode must be set during createWorker, not setParameters
-    await worker.setParameters({
-      tessedit_pageseg_mode: '6', // Assume uniform block of text
-      tessedit_char_whitelist: 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<:.,/- ',
-      preserve_interword_spaces: '1', // Preserve spaces between words
-    })
-    
-    // Extract full text first
-    const { data: { text: fullText } } = await worker.recognize(processedImagePath)
-    
-    // Clean up preprocessed image if it was created
-    if (processedImagePath !== imagePath) {
-      try {
-        await fs.unlink(processedImagePath).catch(() => {}) // Ignore errors
-      } catch {}
-    }
+    // Extract full text first, on a warm worker from the shared Tesseract pool
+    const fullText = await recognizeText(processedImage)
     
     // Parse using improved parser
     const parsed = parseKenyanID(fullText)
@@ -64,8 +41,6 @@ export const parseIDWithDocparser = async (imagePath) => {
       method: 'docparser',
     }
     
-    await worker.terminate()
-    
     return combined
   } catch (error) {
     console.error('Docparser extraction error:', error)
@@ -4,39 +4,527 @@ Face Detection Service
 Supports multiple face detection models: YOLOv8, DeepFace, InsightFace, and MediaPipe
 """
 
+import gc
+import io
+import os
 import sys
 import json
+import time
+import struct
 import argparse
 import base64
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
-# Handle import errors gracefully
-try:
-    import cv2
-    import numpy as np
-except ImportError as e:
-    error_result = {
-        'error': f'OpenCV not installed: {str(e)}. Run: pip install opencv-python numpy',
-        'face_count': 0,
-        'faces': []
-    }
-    # Output to stderr so Node.js can catch it even on exit code 1
-    print(json.dumps(error_result), file=sys.stderr)
-    sys.exit(1)
+_IMPORT_START = time.perf_counter()
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access. Once loaded it replaces
+    itself in this module's globals, so later lookups go straight to the real module.
+    """
+
+    def __init__(self, alias, name, install_hint, on_load=None):
+        self._alias = alias
+        self._name = name
+        self._install_hint = install_hint
+        self._on_load = on_load
+
+    def load(self):
+        try:
+            module = importlib.import_module(self._name)
+        except ImportError as e:
+            raise ImportError(f'{self._name} not installed: {str(e)}. Run: pip install {self._install_hint}')
+        globals()[self._alias] = module
+        if self._on_load:
+            self._on_load(module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+# Native thread pools each library sizes from these variables when it loads
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'FACE_ORT_INTRA_THREADS')
+
+# Threads this process may use, set by configure_threads(); None leaves every library at its default
+_THREADS = None
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def thread_budget():
+    """
+    Threads one job may use: FACE_THREADS if set, otherwise the cores available to this process
+    split evenly across FACE_CONCURRENT_JOBS (the number of face processes Node runs at once)
+    """
+    explicit = int(os.environ.get('FACE_THREADS') or 0)
+    if explicit > 0:
+        return explicit
+    concurrent_jobs = max(1, int(os.environ.get('FACE_CONCURRENT_JOBS') or 1))
+    return max(1, available_cores() // concurrent_jobs)
+
+
+def configure_threads(threads=None):
+    """
+    Cap OpenMP/BLAS, TensorFlow, ONNX Runtime, OpenCV and PyTorch threads at the job's budget so
+    concurrent face processes don't oversubscribe the cores. The environment variables only reach
+    libraries loaded afterwards, so call this before the first model loads; values already set win.
+    """
+    global _THREADS
+    _THREADS = threads or thread_budget()
+    if _THREADS < available_cores():
+        for name in THREAD_ENV_VARS:
+            os.environ.setdefault(name, str(_THREADS))
+    apply_thread_limits()
+    return _THREADS
+
+
+def apply_thread_limits(module=None):
+    """Apply the thread budget to libraries configured at runtime rather than through the environment"""
+    if _THREADS is None:
+        return
+    if 'cv2' in sys.modules:
+        sys.modules['cv2'].setNumThreads(_THREADS)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(_THREADS)
+
+
+# OpenCV and NumPy are only imported by actions that touch images or embeddings; capability
+# probes, index stats and worker startup don't pay for them
+cv2 = LazyModule('cv2', 'cv2', 'opencv-python numpy', on_load=apply_thread_limits)
+np = LazyModule('np', 'numpy', 'numpy')
+
+# Images of one job processed at the same time (the ID and the selfie of a comparison)
+CONCURRENT_IMAGES = 2
+_EXECUTOR = None
+
+
+def map_concurrent(fn, items):
+    """
+    [fn(item) for item in items], spread over a small shared thread pool when the job's thread budget
+    has a core for each. Only for work that releases the GIL (decoding, ONNX Runtime inference) and
+    backends that are safe to call from several threads.
+    """
+    global _EXECUTOR
+    items = list(items)
+    if len(items) < 2 or (_THREADS or thread_budget()) < 2:
+        return [fn(item) for item in items]
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=CONCURRENT_IMAGES, thread_name_prefix='face-image')
+    return list(_EXECUTOR.map(fn, items))
+
+
+class StageTimer:
+    """Wall-clock timings in milliseconds for the named stages of one request"""
+    
+    def __init__(self):
+        self.timings_ms = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.timings_ms[name] = round(self.timings_ms.get(name, 0.0) + elapsed, 3)
+    
+    def total_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 3)
+
+
+# Timer of the job this process is running (jobs run one at a time); stages on helper threads add up
+_JOB_TIMER = None
+
+
+@contextmanager
+def job_timer():
+    """Collect the stage timings of everything done while the block runs"""
+    global _JOB_TIMER
+    previous, _JOB_TIMER = _JOB_TIMER, StageTimer()
+    try:
+        yield _JOB_TIMER
+    finally:
+        _JOB_TIMER = previous
+
+
+@contextmanager
+def timed(stage):
+    """Time a hot-path stage (decode, preprocess, model_load, inference, embedding, ...) into the current job"""
+    timer = _JOB_TIMER
+    if timer is None:
+        yield
+    else:
+        with timer.stage(stage):
+            yield
+
+
+# Side of the aligned face crops kept as registration artifacts: the ArcFace input size
+FACE_CROP_SIZE = 112
 
 
 class FaceDetector:
-    """Base class for face detectors"""
+    """Base class for face detectors. image_path may also be encoded image bytes or a decoded BGR array."""
+    
+    # Longest image side the model works at; larger uploads are downscaled before inference
+    input_side = 640
+    
+    def prepare(self, image_path):
+        """Decode an image at the detector's input size. Returns (image, scale back to original coordinates)."""
+        return prepare_image(image_path, self.input_side)
     
     def detect(self, image_path):
         """Detect faces in image. Returns list of detections with bounding boxes."""
         raise NotImplementedError
+    
+    def detect_batch(self, image_paths):
+        """Detect faces in several images. Backends with batched inference override this."""
+        return [self.detect(image_path) for image_path in image_paths]
+    
+    def embed(self, image_path):
+        """Detect faces and return a compact embedding plus face_hash per face"""
+        return {'face_count': 0, 'faces': [], 'error': f'{type(self).__name__} does not produce face embeddings'}
+    
+    def locate(self, image):
+        """Faces in a decoded image as (box [x1, y1, x2, y2], score, five landmarks or None) in its coordinates"""
+        result = self.detect(image)
+        if result.get('error'):
+            raise RuntimeError(result['error'])
+        return [
+            ([face['bounding_box'][k] for k in ('x1', 'y1', 'x2', 'y2')], face.get('confidence', 0.0), None)
+            for face in result.get('faces', [])
+        ]
+    
+    def align(self, image, box, landmarks, size=FACE_CROP_SIZE):
+        """Fixed-size crop of one face; detectors that find landmarks align it like their recognizer does"""
+        return box_crop(image, box, size)
+    
+    def embed_crops(self, crops):
+        """(n, dim) embeddings of aligned face crops, or None when the backend has no recognition model"""
+        return None
+
+
+def is_image_bytes(image):
+    return isinstance(image, (bytes, bytearray, memoryview))
+
+
+def decode_image(image, flags=None):
+    """Decode an image path or encoded image bytes (sent in memory by the Node side) to a BGR array"""
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    if is_image_bytes(image):
+        return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flags)
+    return cv2.imread(str(image), flags)
+
+
+def load_image(image):
+    """Decode an image path or bytes to a BGR array; arrays are passed through so callers can decode once"""
+    if isinstance(image, np.ndarray):
+        return image
+    return decode_image(image)
+
+
+# JPEG start-of-frame markers (SOF0-SOF15 minus DHT, JPG and DAC), which carry the image size
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# libjpeg can decode directly at 1/2, 1/4 or 1/8 scale, skipping most of the IDCT work
+REDUCED_DECODE_FLAGS = (
+    (8, 'IMREAD_REDUCED_COLOR_8'),
+    (4, 'IMREAD_REDUCED_COLOR_4'),
+    (2, 'IMREAD_REDUCED_COLOR_2'),
+)
+
+
+def jpeg_size(image):
+    """(width, height) read from a JPEG frame header without decoding, or None for other formats"""
+    with (io.BytesIO(image) if is_image_bytes(image) else open(image, 'rb')) as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            if f.read(1) != b'\xff':
+                return None
+            code = b'\xff'
+            while code == b'\xff':  # skip fill bytes
+                code = f.read(1)
+            if not code:
+                return None
+            code = code[0]
+            if code == 0x01 or 0xD0 <= code <= 0xD7:
+                continue  # standalone markers have no length
+            length = f.read(2)
+            if len(length) < 2 or code == 0xDA:
+                return None
+            if code in JPEG_SOF_MARKERS:
+                header = f.read(5)
+                if len(header) < 5:
+                    return None  # truncated frame header
+                height, width = struct.unpack('>xHH', header)
+                return width, height
+            f.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+
+def prepare_image(image, max_side=None):
+    """
+    Decode an image (or take a decoded array) with its longest side reduced to max_side.
+    Large JPEGs are decoded at 1/2, 1/4 or 1/8 resolution by libjpeg, and the remainder is
+    resized with area interpolation. Returns (image, scale) where multiplying coordinates by
+    scale maps them back onto the full-resolution image, or (None, 1.0) if it cannot be read.
+    """
+    factor = 1
+    img = None
+    if max_side and not isinstance(image, np.ndarray):
+        try:
+            size = jpeg_size(image)
+        except (OSError, struct.error):
+            size = None
+        if size:
+            for reduction, flag in REDUCED_DECODE_FLAGS:
+                if max(size) // reduction >= max_side:
+                    with timed('decode'):
+                        factor, img = reduction, decode_image(image, getattr(cv2, flag))
+                    break
+    if img is None:
+        with timed('decode'):
+            factor, img = 1, load_image(image)
+    if img is None:
+        return None, 1.0
+    
+    scale = float(factor)
+    longest = max(img.shape[:2])
+    if max_side and longest > max_side:
+        ratio = max_side / longest
+        size = (max(1, round(img.shape[1] * ratio)), max(1, round(img.shape[0] * ratio)))
+        with timed('preprocess'):
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        scale /= ratio
+    return img, scale
+
+
+def alignment_source(img, source):
+    """
+    The image face crops are cut from and the factor mapping img coordinates onto it. source is the
+    (original image, scale) img was prepared from: when img is a downscaled copy the original is decoded
+    at full resolution, so small faces (e.g. on ID cards) keep their detail for recognition. Decoding per
+    image, right before its crops are cut, keeps one full-resolution image in memory at a time.
+    """
+    if source is None or source[1] == 1.0:
+        return img, 1.0
+    image, scale = source
+    with timed('decode'):
+        full = load_image(image)
+    if full is None:
+        return img, 1.0
+    return full, scale
+
+
+def box_crop(image, box, size=FACE_CROP_SIZE):
+    """Square crop centred on a face box, scaled to size x size; parts outside the image are black"""
+    x1, y1, x2, y2 = (float(value) for value in box[:4])
+    scale = size / max(x2 - x1, y2 - y1, 1.0)
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+    matrix = np.float32([[scale, 0, size / 2 - center_x * scale], [0, scale, size / 2 - center_y * scale]])
+    return cv2.warpAffine(image, matrix, (size, size), borderValue=0.0)
+
+
+def rescale_detections(result, scale):
+    """Map bounding boxes found on a downscaled image back to full-resolution coordinates"""
+    if scale != 1.0:
+        for face in result.get('faces', []):
+            box = face.get('bounding_box')
+            if box:
+                for name, value in box.items():
+                    box[name] = float(value * scale)
+    return result
+
+
+_FACE_CASCADE = None
+
+
+def haar_cascade():
+    """OpenCV's frontal face Haar cascade, loaded once, or None where this OpenCV build lacks it"""
+    global _FACE_CASCADE
+    if _FACE_CASCADE is None:
+        try:
+            _FACE_CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            if _FACE_CASCADE.empty():
+                _FACE_CASCADE = False
+        except Exception as e:
+            print(f"Haar cascade unavailable: {e}", file=sys.stderr)
+            _FACE_CASCADE = False
+    return _FACE_CASCADE or None
+
+
+def face_roi(image, margin=0.4):
+    """
+    Crop the region holding the faces a Haar cascade finds, padded by margin on each side,
+    so embedding models only search and align within it. Returns (crop, (x_offset, y_offset));
+    the whole image is returned when no face is found.
+    """
+    cascade = haar_cascade()
+    if cascade is None:
+        return image, (0, 0)
+    
+    faces = cascade.detectMultiScale(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), 1.1, 5, minSize=(30, 30))
+    if len(faces) == 0:
+        return image, (0, 0)
+    
+    x1, y1 = faces[:, 0].min(), faces[:, 1].min()
+    x2, y2 = (faces[:, 0] + faces[:, 2]).max(), (faces[:, 1] + faces[:, 3]).max()
+    pad_x, pad_y = int((x2 - x1) * margin), int((y2 - y1) * margin)
+    x1, y1 = max(0, x1 - pad_x), max(0, y1 - pad_y)
+    x2, y2 = min(image.shape[1], x2 + pad_x), min(image.shape[0], y2 + pad_y)
+    return image[y1:y2, x1:x2], (int(x1), int(y1))
+
+
+# Quality gate: every measure is taken on a copy with its longest side at QUALITY_INPUT_SIDE, so a check
+# costs a few milliseconds whatever the upload size and sharpness values are comparable across images
+QUALITY_INPUT_SIDE = 320
+# Shortest side of the full-resolution image, in pixels
+QUALITY_MIN_SIDE = int(os.environ.get('FACE_QUALITY_MIN_SIDE', '240'))
+# Variance of the Laplacian; out-of-focus and motion-blurred photos fall far below sharp ones
+QUALITY_MIN_SHARPNESS = float(os.environ.get('FACE_QUALITY_MIN_SHARPNESS', '20'))
+# Spread between the 5th and 95th brightness percentiles; below this the image is blank
+QUALITY_MIN_CONTRAST = float(os.environ.get('FACE_QUALITY_MIN_CONTRAST', '12'))
+# Too dark when the 95th percentile is below this, washed out when the 5th percentile is above 255 minus it
+QUALITY_EXPOSURE_MARGIN = float(os.environ.get('FACE_QUALITY_EXPOSURE_MARGIN', '50'))
+# Width of the largest face in full-resolution pixels; recognition models cannot use smaller faces
+QUALITY_MIN_FACE_PX = int(os.environ.get('FACE_QUALITY_MIN_FACE_PX', '40'))
+
+QUALITY_MESSAGES = {
+    'unreadable': 'Image could not be read',
+    'too_small': 'Image resolution is too low',
+    'blank': 'Image is blank',
+    'too_dark': 'Image is too dark',
+    'too_bright': 'Image is overexposed',
+    'too_blurry': 'Image is too blurry',
+    'face_too_small': 'Face is too small',
+    'no_face': 'No face found by the quick check',
+}
+
+
+def image_quality(image):
+    """
+    Score whether an image is worth running OCR and face models on: resolution, blank frames,
+    exposure (brightness histogram percentiles), blur (variance of the Laplacian) and the size of the
+    largest face a Haar cascade finds, all on a downscaled decode. Returns {usable, score, issues,
+    warnings, messages, metrics}; issues make an image unusable, warnings (no face found by the cascade,
+    which misses tilted or partly covered faces) do not. score is 0-1, 0.5 at the nearest threshold.
+    """
+    img, scale = prepare_image(image, QUALITY_INPUT_SIDE)
+    if img is None:
+        return {'usable': False, 'score': 0.0, 'issues': ['unreadable'], 'warnings': [],
+                'messages': [QUALITY_MESSAGES['unreadable']], 'metrics': {}}
+
+    with timed('quality'):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        width, height = round(gray.shape[1] * scale), round(gray.shape[0] * scale)
+        cumulative = np.cumsum(np.bincount(gray.ravel(), minlength=256)) / gray.size
+        low, median, high = (int(np.searchsorted(cumulative, q)) for q in (0.05, 0.5, 0.95))
+        contrast = high - low
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+        faces = []
+        cascade = haar_cascade()
+        if cascade is not None and contrast >= QUALITY_MIN_CONTRAST:
+            faces = cascade.detectMultiScale(gray, 1.1, 5, minSize=(CASCADE_MIN_FACE_PX, CASCADE_MIN_FACE_PX))
+        face_px = round(float(np.max(faces[:, 2])) * scale) if len(faces) else None
+
+    components = {
+        'too_small': min(width, height) / QUALITY_MIN_SIDE,
+        'blank': contrast / QUALITY_MIN_CONTRAST,
+        'too_dark': high / QUALITY_EXPOSURE_MARGIN,
+        'too_bright': (255 - low) / QUALITY_EXPOSURE_MARGIN,
+        'too_blurry': sharpness / QUALITY_MIN_SHARPNESS,
+    }
+    if face_px is not None:
+        components['face_too_small'] = face_px / QUALITY_MIN_FACE_PX
+    issues = [name for name, ratio in components.items() if ratio < 1.0]
+    if 'blank' in issues:
+        # A blank frame is also flat and dark or bright; report only the cause
+        issues = [name for name in issues if name not in ('too_blurry', 'too_dark', 'too_bright')]
+    warnings = ['no_face'] if cascade is not None and face_px is None and not issues else []
+
+    return {
+        'usable': not issues,
+        'score': round(min(1.0, min(components.values()) / 2), 3),
+        'issues': issues,
+        'warnings': warnings,
+        'messages': [QUALITY_MESSAGES[name] for name in issues + warnings],
+        'metrics': {
+            'width': width,
+            'height': height,
+            'sharpness': round(sharpness, 1),
+            'brightness': median,
+            'contrast': contrast,
+            'dark_level': high,
+            'bright_level': low,
+            'face_count': len(faces),
+            'face_width_px': face_px,
+            'face_fraction': round(face_px / width, 3) if face_px else None,
+        },
+    }
+
+
+def encode_embedding(embedding):
+    """Pack an embedding as base64 of little-endian float32 values"""
+    return base64.b64encode(np.asarray(embedding, dtype='<f4').tobytes()).decode('ascii')
+
+
+def decode_embedding(data):
+    """Inverse of encode_embedding()"""
+    return np.frombuffer(base64.b64decode(data), dtype='<f4')
+
+
+def normalize_embedding(embedding):
+    """L2-normalize an embedding so cosine similarity becomes a dot product"""
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+def face_hash(embedding):
+    """
+    Stable hash of a face embedding. The normalized vector is quantized to int8 first
+    so float noise between runs and platforms does not change the hash.
+    """
+    quantized = np.clip(np.round(normalize_embedding(embedding) * 127), -127, 127).astype(np.int8)
+    return hashlib.sha256(quantized.tobytes()).hexdigest()
+
+
+def embedding_face(bounding_box, confidence, embedding, model):
+    """Embed-action output for one face: normalized float32 embedding as base64 plus its hash"""
+    embedding = normalize_embedding(embedding)
+    return {
+        'bounding_box': bounding_box,
+        'confidence': float(confidence),
+        'model': model,
+        'embedding': encode_embedding(embedding),
+        'embedding_dim': int(embedding.shape[0]),
+        'embedding_dtype': 'float32',
+        'face_hash': face_hash(embedding)
+    }
 
 
 class YOLOv8FaceDetector(FaceDetector):
     """YOLOv8 Face Detection using Ultralytics with OpenCV fallback"""
     
     def __init__(self, model_size='n'):
+        self.model_size = model_size
         try:
             from ultralytics import YOLO
             self.YOLO = YOLO
@@ -77,49 +565,25 @@ class YOLOv8FaceDetector(FaceDetector):
     def detect(self, image_path):
         """Detect faces using YOLOv8 or OpenCV fallback"""
         try:
+            img, scale = self.prepare(image_path)
+            if img is None:
+                return {'face_count': 0, 'faces': [], 'model': 'yolov8-face', 'error': 'Could not read image'}
+            
             if self.model is not None:
                 # Use YOLOv8 model if available
-                results = self.model(image_path, verbose=False)
-                detections = []
-                
-                for result in results:
-                    if result.boxes is not None:
-                        boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes
-                        confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
-                        
-                        for i, (box, conf) in enumerate(zip(boxes, confidences)):
-                            x1, y1, x2, y2 = box
-                            detections.append({
-                                'bounding_box': {
-                                    'x1': float(x1),
-                                    'y1': float(y1),
-                                    'x2': float(x2),
-                                    'y2': float(y2),
-                                    'width': float(x2 - x1),
-                                    'height': float(y2 - y1)
-                                },
-                                'confidence': float(conf),
-                                'model': 'yolov8-face'
-                            })
-                
-                return {
-                    'face_count': len(detections),
-                    'faces': detections,
-                    'model': 'yolov8-face'
-                }
+                with timed('inference'):
+                    results = self.model(img, verbose=False)
+                return rescale_detections(self._format_results(results), scale)
             else:
                 # Fallback to OpenCV face detection
-                img = cv2.imread(image_path)
-                if img is None:
-                    return {'face_count': 0, 'faces': [], 'model': 'yolov8-face', 'error': 'Could not read image'}
-                
                 gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=5,
-                    minSize=(30, 30)
-                )
+                with timed('inference'):
+                    faces = self.face_cascade.detectMultiScale(
+                        gray,
+                        scaleFactor=1.1,
+                        minNeighbors=5,
+                        minSize=(30, 30)
+                    )
                 
                 detections = []
                 for (x, y, w, h) in faces:
@@ -136,16 +600,74 @@ class YOLOv8FaceDetector(FaceDetector):
                         'model': 'yolov8-face-opencv'
                     })
                 
-                return {
+                # Flag the degraded path so callers don't mistake cascade hits for YOLOv8 detections
+                return rescale_detections({
                     'face_count': len(detections),
                     'faces': detections,
-                    'model': 'yolov8-face-opencv'
-                }
+                    'model': 'yolov8-face-opencv',
+                    'fallback': 'haar-cascade',
+                    'warning': f'yolov8{self.model_size}-face.pt not found; faces were found with a Haar cascade '
+                               'and confidences are fixed at 0.9'
+                }, scale)
         except Exception as e:
             print(f"ERROR in face detection: {e}", file=sys.stderr)
             import traceback
             print(traceback.format_exc(), file=sys.stderr)
             return {'face_count': 0, 'faces': [], 'model': 'yolov8-face', 'error': str(e)}
+    
+    def detect_batch(self, image_paths):
+        """Detect faces in several images with a single batched YOLOv8 call"""
+        if self.model is None:
+            return super().detect_batch(image_paths)
+        try:
+            prepared = [self.prepare(image_path) for image_path in image_paths]
+            readable = [img for img, _ in prepared if img is not None]
+            with timed('inference'):
+                results = iter(self.model(readable, verbose=False) if readable else [])
+            return [
+                rescale_detections(self._format_results([next(results)]), scale) if img is not None
+                else {'face_count': 0, 'faces': [], 'model': 'yolov8-face', 'error': 'Could not read image'}
+                for img, scale in prepared
+            ]
+        except Exception as e:
+            print(f"ERROR in batched face detection: {e}", file=sys.stderr)
+            return [{'face_count': 0, 'faces': [], 'model': 'yolov8-face', 'error': str(e)}
+                    for _ in image_paths]
+    
+    def _format_results(self, results):
+        """Convert Ultralytics results for one image into the detector output format"""
+        detections = []
+        
+        for result in results:
+            if result.boxes is not None:
+                boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes
+                confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
+                
+                for box, conf in zip(boxes, confidences):
+                    x1, y1, x2, y2 = box
+                    detections.append({
+                        'bounding_box': {
+                            'x1': float(x1),
+                            'y1': float(y1),
+                            'x2': float(x2),
+                            'y2': float(y2),
+                            'width': float(x2 - x1),
+                            'height': float(y2 - y1)
+                        },
+                        'confidence': float(conf),
+                        'model': 'yolov8-face'
+                    })
+        
+        return {
+            'face_count': len(detections),
+            'faces': detections,
+            'model': 'yolov8-face'
+        }
+
+
+# Attribute models DeepFace.analyze can run on each detected face
+DEEPFACE_ACTIONS = ('age', 'gender', 'race', 'emotion')
+DEFAULT_DEEPFACE_BACKEND = 'opencv'
 
 
 class DeepFaceDetector(FaceDetector):
@@ -160,16 +682,34 @@ class DeepFaceDetector(FaceDetector):
             print("ERROR: DeepFace not installed. Run: pip install deepface", file=sys.stderr)
             raise
     
-    def detect(self, image_path):
-        """Detect faces using DeepFace"""
-        try:
-            # DeepFace can detect and analyze faces
-            result = self.DeepFace.analyze(
-                img_path=image_path,
-                actions=['age', 'gender', 'race', 'emotion'],
-                enforce_detection=False,
-                silent=True
-            )
+    def detect(self, image_path, actions=None, detector_backend=None):
+        """
+        Detect faces using DeepFace. By default only the face detector runs (extract_faces);
+        attribute models run only for the requested actions (age, gender, race, emotion).
+        """
+        try:
+            img, scale = self.prepare(image_path)
+            if img is None:
+                return {'face_count': 0, 'faces': [], 'model': 'deepface', 'error': 'Could not read image'}
+            
+            detector_backend = detector_backend or DEFAULT_DEEPFACE_BACKEND
+            with timed('inference'):
+                if actions:
+                    # DeepFace can detect and analyze faces
+                    result = self.DeepFace.analyze(
+                        img_path=img,
+                        actions=list(actions),
+                        detector_backend=detector_backend,
+                        enforce_detection=False,
+                        silent=True
+                    )
+                else:
+                    result = self.DeepFace.extract_faces(
+                        img_path=img,
+                        detector_backend=detector_backend,
+                        enforce_detection=False,
+                        align=False
+                    )
             
             detections = []
             
@@ -178,13 +718,18 @@ class DeepFaceDetector(FaceDetector):
                 result = [result]
             
             for face_data in result:
-                region = face_data.get('region', {})
+                region = face_data.get('region') or face_data.get('facial_area') or {}
                 x = region.get('x', 0)
                 y = region.get('y', 0)
                 w = region.get('w', 0)
                 h = region.get('h', 0)
+                confidence = face_data.get('face_confidence', face_data.get('confidence'))
+                
+                # With enforce_detection off, "no face" comes back as the whole image at confidence 0
+                if not confidence and w >= img.shape[1] and h >= img.shape[0]:
+                    continue
                 
-                detections.append({
+                detection = {
                     'bounding_box': {
                         'x1': float(x),
                         'y1': float(y),
@@ -193,33 +738,100 @@ class DeepFaceDetector(FaceDetector):
                         'width': float(w),
                         'height': float(h)
                     },
-                    'confidence': 0.95,  # DeepFace doesn't provide confidence, use high default
-                    'model': 'deepface',
-                    'age': face_data.get('age'),
-                    'gender': face_data.get('dominant_gender'),
-                    'emotion': face_data.get('dominant_emotion')
-                })
+                    # Older DeepFace releases don't report a confidence, use high default
+                    'confidence': float(confidence) if confidence else 0.95,
+                    'model': 'deepface'
+                }
+                if 'age' in face_data:
+                    detection['age'] = face_data['age']
+                if 'dominant_gender' in face_data:
+                    detection['gender'] = face_data['dominant_gender']
+                if 'dominant_race' in face_data:
+                    detection['race'] = face_data['dominant_race']
+                if 'dominant_emotion' in face_data:
+                    detection['emotion'] = face_data['dominant_emotion']
+                detections.append(detection)
             
-            return {
+            return rescale_detections({
                 'face_count': len(detections),
                 'faces': detections,
-                'model': 'deepface'
-            }
+                'model': 'deepface',
+                'detector_backend': detector_backend,
+                'actions': list(actions or [])
+            }, scale)
         except Exception as e:
             print(f"ERROR in DeepFace detection: {e}", file=sys.stderr)
             return {'face_count': 0, 'faces': [], 'model': 'deepface', 'error': str(e)}
 
+    def embed(self, image_path, model_name='ArcFace'):
+        """Compute face embeddings with DeepFace.represent on the face region of a downscaled image"""
+        try:
+            img, scale = self.prepare(image_path)
+            if img is None:
+                return {'face_count': 0, 'faces': [], 'model': 'deepface', 'error': 'Could not read image'}
+            with timed('preprocess'):
+                roi, (offset_x, offset_y) = face_roi(img)
+            
+            # With enforce_detection off, DeepFace embeds the whole frame when it finds no face;
+            # that vector would be stored and indexed as if it were the voter's face
+            with timed('embedding'):
+                try:
+                    representations = self.DeepFace.represent(
+                        img_path=roi,
+                        model_name=model_name,
+                        enforce_detection=True
+                    )
+                except ValueError as e:
+                    if 'could not be detected' not in str(e):
+                        raise
+                    representations = []
+            
+            faces = []
+            for rep in representations:
+                area = rep.get('facial_area', {})
+                x, y, w, h = area.get('x', 0), area.get('y', 0), area.get('w', 0), area.get('h', 0)
+                x, y = x + offset_x, y + offset_y
+                faces.append(embedding_face({
+                    'x1': float(x),
+                    'y1': float(y),
+                    'x2': float(x + w),
+                    'y2': float(y + h),
+                    'width': float(w),
+                    'height': float(h)
+                }, rep.get('face_confidence', 0.95), rep['embedding'], 'deepface'))
+            
+            return rescale_detections({
+                'face_count': len(faces),
+                'faces': faces,
+                'model': 'deepface',
+                'embedding_model': model_name
+            }, scale)
+        except Exception as e:
+            print(f"ERROR in DeepFace embedding: {e}", file=sys.stderr)
+            return {'face_count': 0, 'faces': [], 'model': 'deepface', 'error': str(e)}
+    
+    def embed_crops(self, crops, model_name='ArcFace'):
+        """ArcFace embeddings of aligned crops; DeepFace's own detector is skipped"""
+        with timed('embedding'):
+            return np.array([
+                self.DeepFace.represent(img_path=crop, model_name=model_name, detector_backend='skip',
+                                        enforce_detection=False)[0]['embedding']
+                for crop in crops
+            ])
+
 
 class InsightFaceDetector(FaceDetector):
     """InsightFace Face Detection - Modern alternative to RetinaFace"""
     
-    def __init__(self):
+    def __init__(self, det_size=(640, 640), provider='CPUExecutionProvider'):
         try:
             import insightface
             self.insightface = insightface
-            # Load the model
-            self.model = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
-            self.model.prepare(ctx_id=-1, det_size=(640, 640))
+            # Load the model; landmark and gender/age models are never used and would run on every face
+            self.model = insightface.app.FaceAnalysis(providers=[provider], allowed_modules=['detection', 'recognition'])
+            self.model.prepare(ctx_id=-1, det_size=tuple(det_size))
+            self.input_side = max(det_size)
+            self._apply_session_options(provider)
             print("InsightFace loaded successfully", file=sys.stderr)
         except ImportError:
             print("ERROR: InsightFace not installed. Run: pip install insightface", file=sys.stderr)
@@ -228,56 +840,357 @@ class InsightFaceDetector(FaceDetector):
             print(f"ERROR loading InsightFace model: {e}", file=sys.stderr)
             raise
     
+    def _apply_session_options(self, provider):
+        """FaceAnalysis only passes providers to ONNX Runtime; rebuild its sessions when FACE_ORT_* options are set"""
+        import onnxFace
+        
+        if not onnxFace.session_configured():
+            return
+        options = onnxFace.session_options()
+        for model in self.model.models.values():
+            if getattr(model, 'model_file', None) and getattr(model, 'session', None) is not None:
+                model.session = onnxFace.create_session(model.model_file, provider, options)
+    
     def detect(self, image_path):
         """Detect faces using InsightFace"""
         try:
-            img = cv2.imread(image_path)
+            img, scale = self.prepare(image_path)
             if img is None:
                 return {'face_count': 0, 'faces': [], 'model': 'insightface', 'error': 'Could not read image'}
             
-            faces = self.model.get(img)
-            detections = []
+            with timed('inference'):
+                faces = self.model.get(img)
+            return rescale_detections(self._format_faces([
+                (face.bbox, face.det_score, face.embedding if hasattr(face, 'embedding') else None)
+                for face in faces
+            ]), scale)
+        except Exception as e:
+            print(f"ERROR in InsightFace detection: {e}", file=sys.stderr)
+            return {'face_count': 0, 'faces': [], 'model': 'insightface', 'error': str(e)}
+    
+    def embed(self, image_path):
+        """Compute ArcFace embeddings for every face with InsightFace"""
+        try:
+            img, scale = self.prepare(image_path)
+            if img is None:
+                return {'face_count': 0, 'faces': [], 'model': 'insightface', 'error': 'Could not read image'}
             
-            for face in faces:
-                bbox = face.bbox.astype(int)
-                x1, y1, x2, y2 = bbox[0], bbox[1], bbox[2], bbox[3]
-                det_score = face.det_score
-                
-                detections.append({
-                    'bounding_box': {
-                        'x1': float(x1),
-                        'y1': float(y1),
-                        'x2': float(x2),
-                        'y2': float(y2),
-                        'width': float(x2 - x1),
-                        'height': float(y2 - y1)
-                    },
-                    'confidence': float(det_score),
-                    'model': 'insightface',
-                    'embedding': face.embedding.tolist() if hasattr(face, 'embedding') else None
-                })
+            # Detection runs on the downscaled copy; faces are aligned from the full-resolution image
+            faces = []
+            for bbox, det_score, embedding in self.detect_faces_batch([img], [(image_path, scale)])[0]:
+                if embedding is None:
+                    continue
+                x1, y1, x2, y2 = np.asarray(bbox).astype(int)[:4]
+                faces.append(embedding_face({
+                    'x1': float(x1),
+                    'y1': float(y1),
+                    'x2': float(x2),
+                    'y2': float(y2),
+                    'width': float(x2 - x1),
+                    'height': float(y2 - y1)
+                }, det_score, embedding, 'insightface'))
             
-            return {
-                'face_count': len(detections),
-                'faces': detections,
-                'model': 'insightface'
-            }
+            return rescale_detections({
+                'face_count': len(faces),
+                'faces': faces,
+                'model': 'insightface',
+                'embedding_model': 'arcface'
+            }, scale)
         except Exception as e:
-            print(f"ERROR in InsightFace detection: {e}", file=sys.stderr)
+            print(f"ERROR in InsightFace embedding: {e}", file=sys.stderr)
             return {'face_count': 0, 'faces': [], 'model': 'insightface', 'error': str(e)}
+    
+    def locate(self, image):
+        """Detection model only, keeping the five landmarks it finds for alignment"""
+        with timed('inference'):
+            bboxes, kpss = self.model.det_model.detect(image, max_num=0, metric='default')
+        return [(bboxes[i, :4], bboxes[i, 4], kpss[i] if kpss is not None else None) for i in range(bboxes.shape[0])]
+    
+    def align(self, image, box, landmarks, size=FACE_CROP_SIZE):
+        """The crop InsightFace's recognition model sees: similarity-aligned on the landmarks"""
+        if landmarks is None:
+            return super().align(image, box, landmarks, size)
+        from insightface.utils import face_align
+        
+        return face_align.norm_crop(image, landmark=landmarks, image_size=size)
+    
+    def embed_crops(self, crops):
+        """One recognition pass over aligned crops"""
+        rec_model = self.model.models.get('recognition')
+        if rec_model is None:
+            return None
+        with timed('embedding'):
+            return rec_model.get_feat(crops)
+    
+    def detect_batch(self, image_paths):
+        """Detect faces in several images, embedding every face in one recognition pass"""
+        try:
+            prepared = [self.prepare(image_path) for image_path in image_paths]
+            results = []
+            for faces, (_, scale) in zip(self.detect_faces_batch([img for img, _ in prepared]), prepared):
+                if faces is None:
+                    results.append({'face_count': 0, 'faces': [], 'model': 'insightface', 'error': 'Could not read image'})
+                else:
+                    results.append(rescale_detections(self._format_faces(faces), scale))
+            return results
+        except Exception as e:
+            print(f"ERROR in batched InsightFace detection: {e}", file=sys.stderr)
+            return [{'face_count': 0, 'faces': [], 'model': 'insightface', 'error': str(e)}
+                    for _ in image_paths]
+    
+    def detect_faces_batch(self, images, sources=None):
+        """
+        Run the detection model on each decoded image (concurrently when the thread budget allows),
+        then the recognition model once over the stacked aligned crops of every face found.
+        sources optionally gives each image's (original image, scale) so crops are cut at full
+        resolution (see alignment_source). Returns, per image, a list of (bbox, det_score, embedding)
+        in that image's coordinates, or None for unreadable images.
+        """
+        from insightface.utils import face_align
+        
+        rec_model = self.model.models.get('recognition')
+        per_image = []
+        crops = []
+        
+        # ONNX Runtime releases the GIL, so the images' detection passes can overlap
+        with timed('inference'):
+            detections = map_concurrent(
+                lambda img: None if img is None else self.model.det_model.detect(img, max_num=0, metric='default'),
+                images
+            )
+        for img, detection, source in zip(images, detections, sources or [None] * len(images)):
+            if img is None:
+                per_image.append(None)
+                continue
+            bboxes, kpss = detection
+            faces = []
+            if rec_model is not None and kpss is not None and bboxes.shape[0] > 0:
+                aligned_img, scale = alignment_source(img, source)
+            for i in range(bboxes.shape[0]):
+                crop_index = None
+                if rec_model is not None and kpss is not None:
+                    crops.append(face_align.norm_crop(aligned_img, landmark=kpss[i] * scale,
+                                                      image_size=rec_model.input_size[0]))
+                    crop_index = len(crops) - 1
+                faces.append((bboxes[i, :4], bboxes[i, 4], crop_index))
+            per_image.append(faces)
+        
+        with timed('embedding'):
+            embeddings = rec_model.get_feat(crops) if crops else None
+        return [
+            None if faces is None else [
+                (bbox, score, embeddings[index] if index is not None else None)
+                for bbox, score, index in faces
+            ]
+            for faces in per_image
+        ]
+    
+    def _format_faces(self, faces):
+        """Convert (bbox, det_score, embedding) tuples into the detector output format"""
+        detections = []
+        
+        for bbox, det_score, embedding in faces:
+            x1, y1, x2, y2 = np.asarray(bbox).astype(int)[:4]
+            
+            detections.append({
+                'bounding_box': {
+                    'x1': float(x1),
+                    'y1': float(y1),
+                    'x2': float(x2),
+                    'y2': float(y2),
+                    'width': float(x2 - x1),
+                    'height': float(y2 - y1)
+                },
+                'confidence': float(det_score),
+                'model': 'insightface',
+                'embedding': embedding.tolist() if embedding is not None else None
+            })
+        
+        return {
+            'face_count': len(detections),
+            'faces': detections,
+            'model': 'insightface'
+        }
+
+
+def onnx_model_dir():
+    """Directory holding the ONNX backend's models (FACE_ONNX_DIR, default backend/face_models/onnx)"""
+    return Path(os.environ.get('FACE_ONNX_DIR') or Path(__file__).resolve().parent.parent / 'face_models' / 'onnx')
+
+
+def insightface_models_dir():
+    return Path(os.environ.get('INSIGHTFACE_HOME') or Path.home() / '.insightface') / 'models'
+
+
+class OnnxFaceDetector(FaceDetector):
+    """YOLOv8-face detection and ArcFace embeddings on ONNX Runtime, without PyTorch or InsightFace"""
+    
+    def __init__(self, model_size='n', provider='CPUExecutionProvider'):
+        try:
+            import onnxFace
+        except ImportError:
+            print("ERROR: ONNX Runtime not installed. Run: pip install onnxruntime", file=sys.stderr)
+            raise
+        
+        model_dir = onnx_model_dir()
+        detector_path = onnxFace.find_model(model_dir, lambda quantized: onnxFace.detector_filename(model_size, quantized))
+        if detector_path is None:
+            raise FileNotFoundError(f"No {onnxFace.detector_filename(model_size)} in {model_dir}; "
+                                    f"create it with: python faceDetection.py --action export-onnx --model yolov8{model_size}-face")
+        recognizer_path = onnxFace.find_model(model_dir, onnxFace.recognizer_filename)
+        
+        options = onnxFace.session_options()
+        self.detector = onnxFace.YoloFaceOnnx(detector_path, provider, options)
+        self.recognizer = onnxFace.ArcFaceOnnx(recognizer_path, provider, options) if recognizer_path else None
+        self.input_side = self.detector.input_size
+        self.model_files = [path.name for path in (detector_path, recognizer_path) if path]
+        print(f"ONNX Runtime face models loaded: {', '.join(self.model_files)}", file=sys.stderr)
+    
+    def detect(self, image_path):
+        """Detect faces with the ONNX YOLOv8-face model"""
+        return self.detect_batch([image_path])[0]
+    
+    def detect_batch(self, image_paths):
+        """Detect faces in several images with one batched detector call"""
+        try:
+            prepared = [self.prepare(image_path) for image_path in image_paths]
+            readable = [img for img, _ in prepared if img is not None]
+            with timed('inference'):
+                detections = iter(self.detector.detect(readable) if readable else [])
+            results = []
+            for img, scale in prepared:
+                if img is None:
+                    results.append({'face_count': 0, 'faces': [], 'model': 'onnx', 'error': 'Could not read image'})
+                    continue
+                boxes, scores, _ = next(detections)
+                results.append(rescale_detections(self._format_faces(zip(boxes, scores)), scale))
+            return results
+        except Exception as e:
+            print(f"ERROR in ONNX face detection: {e}", file=sys.stderr)
+            return [{'face_count': 0, 'faces': [], 'model': 'onnx', 'error': str(e)} for _ in image_paths]
+    
+    def detect_faces_batch(self, images, sources=None):
+        """
+        Detect faces in decoded images, then embed every face found in a single recognizer call.
+        sources optionally gives each image's (original image, scale) so crops are cut at full
+        resolution (see alignment_source). Returns, per image, a list of (bbox, det_score, embedding)
+        in that image's coordinates, or None for unreadable images.
+        """
+        readable = [img for img in images if img is not None]
+        with timed('inference'):
+            detections = iter(self.detector.detect(readable) if readable else [])
+        per_image = []
+        crops = []
+        
+        for img, source in zip(images, sources or [None] * len(images)):
+            if img is None:
+                per_image.append(None)
+                continue
+            boxes, scores, landmarks = next(detections)
+            faces = []
+            if self.recognizer is not None and len(boxes) > 0:
+                aligned_img, scale = alignment_source(img, source)
+            for i in range(len(boxes)):
+                crop_index = None
+                if self.recognizer is not None:
+                    crops.append(self.recognizer.crop(aligned_img, np.asarray(boxes[i]) * scale,
+                                                      landmarks[i] * scale if landmarks is not None else None))
+                    crop_index = len(crops) - 1
+                faces.append((boxes[i], scores[i], crop_index))
+            per_image.append(faces)
+        
+        with timed('embedding'):
+            embeddings = self.recognizer.embed(crops) if crops else None
+        return [
+            None if faces is None else [
+                (bbox, score, embeddings[index] if index is not None else None)
+                for bbox, score, index in faces
+            ]
+            for faces in per_image
+        ]
+    
+    def embed(self, image_path):
+        """Compute ArcFace embeddings for every face found by the ONNX detector"""
+        if self.recognizer is None:
+            return {'face_count': 0, 'faces': [], 'model': 'onnx',
+                    'error': f'No ArcFace model in {onnx_model_dir()}; run --action export-onnx'}
+        try:
+            img, scale = self.prepare(image_path)
+            if img is None:
+                return {'face_count': 0, 'faces': [], 'model': 'onnx', 'error': 'Could not read image'}
+            
+            # Detection runs on the downscaled copy; faces are aligned from the full-resolution image
+            faces = [
+                embedding_face(self._bounding_box(bbox), score, embedding, 'onnx')
+                for bbox, score, embedding in self.detect_faces_batch([img], [(image_path, scale)])[0]
+            ]
+            return rescale_detections({
+                'face_count': len(faces),
+                'faces': faces,
+                'model': 'onnx',
+                'embedding_model': 'arcface'
+            }, scale)
+        except Exception as e:
+            print(f"ERROR in ONNX face embedding: {e}", file=sys.stderr)
+            return {'face_count': 0, 'faces': [], 'model': 'onnx', 'error': str(e)}
+    
+    def locate(self, image):
+        """Detector only, keeping the five landmarks the YOLOv8-face model predicts"""
+        with timed('inference'):
+            boxes, scores, landmarks = self.detector.detect([image])[0]
+        return [(boxes[i], scores[i], landmarks[i] if landmarks is not None else None) for i in range(len(boxes))]
+    
+    def align(self, image, box, landmarks, size=FACE_CROP_SIZE):
+        import onnxFace
+        
+        return onnxFace.align_crop(image, box, landmarks, size)
+    
+    def embed_crops(self, crops):
+        """One ArcFace call over aligned crops"""
+        if self.recognizer is None:
+            return None
+        size = self.recognizer.input_size
+        crops = [crop if crop.shape[:2] == (size, size) else cv2.resize(crop, (size, size)) for crop in crops]
+        with timed('embedding'):
+            return self.recognizer.embed(crops)
+    
+    @staticmethod
+    def _bounding_box(bbox):
+        x1, y1, x2, y2 = (float(value) for value in bbox[:4])
+        return {
+            'x1': x1,
+            'y1': y1,
+            'x2': x2,
+            'y2': y2,
+            'width': x2 - x1,
+            'height': y2 - y1
+        }
+    
+    def _format_faces(self, faces):
+        """Convert (bbox, score) pairs into the detector output format"""
+        detections = [
+            {'bounding_box': self._bounding_box(bbox), 'confidence': float(score), 'model': 'onnx'}
+            for bbox, score in faces
+        ]
+        
+        return {
+            'face_count': len(detections),
+            'faces': detections,
+            'model': 'onnx'
+        }
 
 
 class MediaPipeFaceDetector(FaceDetector):
     """MediaPipe Face Detection"""
     
-    def __init__(self):
+    def __init__(self, model_selection=1, min_detection_confidence=0.5):
         try:
             import mediapipe as mp
             self.mp = mp
             self.mp_face_detection = mp.solutions.face_detection
             self.detector = self.mp_face_detection.FaceDetection(
-                model_selection=1,  # 0 for short-range, 1 for full-range
-                min_detection_confidence=0.5
+                model_selection=model_selection,  # 0 for short-range, 1 for full-range
+                min_detection_confidence=min_detection_confidence
             )
             print("MediaPipe Face Detection loaded successfully", file=sys.stderr)
         except ImportError:
@@ -287,12 +1200,13 @@ class MediaPipeFaceDetector(FaceDetector):
     def detect(self, image_path):
         """Detect faces using MediaPipe"""
         try:
-            image = cv2.imread(image_path)
+            image, scale = self.prepare(image_path)
             if image is None:
                 return {'face_count': 0, 'faces': [], 'model': 'mediapipe', 'error': 'Could not read image'}
             
             rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            results = self.detector.process(rgb_image)
+            with timed('inference'):
+                results = self.detector.process(rgb_image)
             
             detections = []
             h, w, _ = image.shape
@@ -320,67 +1234,595 @@ class MediaPipeFaceDetector(FaceDetector):
                         'model': 'mediapipe'
                     })
             
-            return {
+            return rescale_detections({
                 'face_count': len(detections),
                 'faces': detections,
                 'model': 'mediapipe'
-            }
+            }, scale)
         except Exception as e:
             print(f"ERROR in MediaPipe detection: {e}", file=sys.stderr)
             return {'face_count': 0, 'faces': [], 'model': 'mediapipe', 'error': str(e)}
 
 
-def get_detector(model_name):
-    """Factory function to get the appropriate detector"""
-    model_name = model_name.lower()
-    
-    try:
-        if model_name.startswith('yolo'):
-            # Extract model size if specified (yolov8n, yolov8s, etc.)
-            size = 'n'  # default to nano
-            if 'yolov8s' in model_name or 'yolov5s' in model_name:
-                size = 's'
-            elif 'yolov8m' in model_name or 'yolov5m' in model_name:
-                size = 'm'
-            elif 'yolov8l' in model_name or 'yolov5l' in model_name:
-                size = 'l'
-            return YOLOv8FaceDetector(model_size=size)
-        elif 'deepface' in model_name:
-            return DeepFaceDetector()
-        elif 'insightface' in model_name or 'insight' in model_name:
-            return InsightFaceDetector()
-        elif 'mediapipe' in model_name or 'media' in model_name:
-            return MediaPipeFaceDetector()
-        else:
-            # Default to YOLOv8
-            return YOLOv8FaceDetector(model_size='n')
-    except ImportError as e:
-        raise ImportError(f"Required package not installed for model '{model_name}': {str(e)}")
-    except Exception as e:
-        raise Exception(f"Failed to initialize detector for model '{model_name}': {str(e)}")
+# Cascade mode: the cheap first stage looks at a small copy of the image, and its answer stands only
+# for exactly one face at least CASCADE_MIN_CONFIDENCE sure and CASCADE_MIN_FACE_PX wide there
+CASCADE_INPUT_SIDE = 320
+CASCADE_MIN_CONFIDENCE = float(os.environ.get('FACE_CASCADE_MIN_CONFIDENCE', '0.8'))
+CASCADE_MIN_FACE_PX = 24
+# Detectors tried, in order, when the first stage is not sure
+CASCADE_ESCALATION = ('insightface', 'onnx', 'yolov8-face')
+# Haar level weight mapped to a confidence of 0.5; the final stage sum is roughly 0-8 for real faces
+HAAR_WEIGHT_MIDPOINT = 2.0
 
 
-def compare_faces(id_image_path, selfie_image_path, model_name='yolov8-face'):
-    """Compare faces between ID and selfie images using face embeddings for accurate similarity"""
-    try:
-        # Try DeepFace first for accurate face verification
-        if model_name == 'deepface' or model_name == 'auto':
+class CascadeFaceDetector(FaceDetector):
+    """
+    Tiered detection with early exit. A cheap first stage (MediaPipe short-range, else OpenCV's Haar
+    cascade) runs on a downscaled image; when it is not sure the image goes to the first CNN detector
+    that loads. Results name the tier that answered and, when escalated, why.
+    """
+    
+    input_side = CASCADE_INPUT_SIDE
+    
+    def __init__(self, escalation=None, min_confidence=CASCADE_MIN_CONFIDENCE):
+        escalation = escalation or os.environ.get('FACE_CASCADE_ESCALATION') or ','.join(CASCADE_ESCALATION)
+        self.escalation = [name.strip() for name in escalation.split(',') if name.strip()]
+        self.min_confidence = min_confidence
+        self.escalation_name = None
+        self.first_stage = None
+        self.first_stage_name = None
+        try:
+            # Short-range model: faces within ~2m, i.e. selfies and ID photos held to the camera
+            self.first_stage = MediaPipeFaceDetector(model_selection=0, min_detection_confidence=0.3)
+            self.first_stage_name = 'mediapipe-short'
+        except ImportError:
+            if haar_cascade() is not None:
+                self.first_stage = haar_cascade()
+                self.first_stage_name = 'haar'
+        print(f"Cascade detector: first stage {self.first_stage_name or 'none'}, "
+              f"escalating to {', '.join(self.escalation)}", file=sys.stderr)
+    
+    def detect(self, image_path):
+        """Detect faces with the first stage, escalating to a CNN detector when it is not sure"""
+        timer = StageTimer()
+        first = None
+        reason = 'no first-stage detector available'
+        try:
+            if self.first_stage is not None:
+                with timer.stage('first_stage'):
+                    img, scale = self.prepare(image_path)
+                    if img is None:
+                        return {'face_count': 0, 'faces': [], 'model': 'cascade', 'error': 'Could not read image'}
+                    first = self._detect_first_stage(img)
+                reason = self._escalation_reason(first)
+                if reason is None:
+                    first.update({'model': 'cascade', 'tier': self.first_stage_name, 'escalated': False,
+                                  'timings_ms': timer.timings_ms})
+                    return rescale_detections(first, scale)
+                first = rescale_detections(first, scale)
+            
+            with timer.stage('escalation'):
+                detector, name = self._escalation_detector()
+                if detector is None:
+                    if first is None:
+                        return {'face_count': 0, 'faces': [], 'model': 'cascade',
+                                'error': 'No cascade stage could be loaded', 'timings_ms': timer.timings_ms}
+                    # Nothing to escalate to; the first stage's answer is the best available
+                    first.update({'model': 'cascade', 'tier': self.first_stage_name, 'escalated': False,
+                                  'escalation_reason': reason, 'warning': 'No escalation detector could be loaded',
+                                  'timings_ms': timer.timings_ms})
+                    return first
+                # The full image, so small faces (e.g. the photo on an ID card) survive
+                result = detector.detect(image_path)
+            result.update({'model': 'cascade', 'tier': name, 'escalated': True, 'escalation_reason': reason,
+                           'timings_ms': timer.timings_ms})
+            return result
+        except Exception as e:
+            print(f"ERROR in cascade detection: {e}", file=sys.stderr)
+            return {'face_count': 0, 'faces': [], 'model': 'cascade', 'error': str(e), 'timings_ms': timer.timings_ms}
+    
+    def _detect_first_stage(self, img):
+        if isinstance(self.first_stage, FaceDetector):
+            return self.first_stage.detect(img)
+        
+        # Haar: detectMultiScale3 exposes the final stage's level weight as a confidence signal
+        gray = cv2.equalizeHist(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        with timed('inference'):
+            rects, _, weights = self.first_stage.detectMultiScale3(
+                gray, scaleFactor=1.1, minNeighbors=5, minSize=(CASCADE_MIN_FACE_PX, CASCADE_MIN_FACE_PX),
+                outputRejectLevels=True
+            )
+        faces = []
+        for (x, y, w, h), weight in zip(rects, np.ravel(weights) if len(rects) else []):
+            faces.append({
+                'bounding_box': {
+                    'x1': float(x),
+                    'y1': float(y),
+                    'x2': float(x + w),
+                    'y2': float(y + h),
+                    'width': float(w),
+                    'height': float(h)
+                },
+                'confidence': float(1.0 / (1.0 + np.exp(HAAR_WEIGHT_MIDPOINT - weight))),
+                'level_weight': float(weight),
+                'model': 'haar'
+            })
+        return {'face_count': len(faces), 'faces': faces}
+    
+    def _escalation_reason(self, result):
+        """Why the first stage's answer can't stand on its own, or None when it can"""
+        faces = result.get('faces', [])
+        if result.get('error'):
+            return f"first stage failed: {result['error']}"
+        if not faces:
+            return 'no face found'
+        if len(faces) > 1:
+            return f'{len(faces)} faces found'
+        face = faces[0]
+        if face['confidence'] < self.min_confidence:
+            return f"confidence {face['confidence']:.2f} below {self.min_confidence:.2f}"
+        box = face['bounding_box']
+        if min(box['width'], box['height']) < CASCADE_MIN_FACE_PX:
+            return 'face too small to trust'
+        return None
+    
+    def _escalation_detector(self):
+        """First escalation detector that loads (from the shared registry), as (detector, name)"""
+        # Once one has loaded, go straight to it instead of retrying the unavailable ones first
+        names = [self.escalation_name] if self.escalation_name else []
+        for name in names + [name for name in self.escalation if name != self.escalation_name]:
             try:
-                from deepface import DeepFace
-                result = DeepFace.verify(
-                    img1_path=id_image_path,
-                    img2_path=selfie_image_path,
-                    model_name='VGG-Face',  # Can use: VGG-Face, Facenet, OpenFace, DeepFace, DeepID, Dlib, ArcFace
-                    enforce_detection=False,
-                    silent=True
-                )
-                
+                detector = get_cached_detector(name)
+            except Exception as e:
+                print(f"Cascade escalation to {name} unavailable: {e}", file=sys.stderr)
+                continue
+            if isinstance(detector, YOLOv8FaceDetector) and detector.model is None:
+                continue  # its Haar fallback would be no better than the first stage
+            self.escalation_name = name
+            return detector, name
+        return None, None
+
+
+DEFAULT_DET_SIZE = (640, 640)
+DEFAULT_PROVIDER = 'CPUExecutionProvider'
+
+
+# Every accepted model name -> (detector family, model size). Names must match exactly, so a
+# typo is rejected instead of silently loading some other backend's stack.
+MODEL_ALIASES = {
+    'yolov8-face': ('yolov8', 'n'),
+    'yolov8n-face': ('yolov8', 'n'),
+    'yolov8s-face': ('yolov8', 's'),
+    'yolov8m-face': ('yolov8', 'm'),
+    'yolov8l-face': ('yolov8', 'l'),
+    'yolov8': ('yolov8', 'n'),
+    'yolov8n': ('yolov8', 'n'),
+    'yolov8s': ('yolov8', 's'),
+    'yolov8m': ('yolov8', 'm'),
+    'yolov8l': ('yolov8', 'l'),
+    'deepface': ('deepface', None),
+    'insightface': ('insightface', None),
+    'mediapipe': ('mediapipe', None),
+    'onnx': ('onnx', 'n'),
+    'yolov8-face-onnx': ('onnx', 'n'),
+    'yolov8n-face-onnx': ('onnx', 'n'),
+    'yolov8s-face-onnx': ('onnx', 's'),
+    'yolov8m-face-onnx': ('onnx', 'm'),
+    'cascade': ('cascade', None),
+    # compare and embed pick their own backends for 'auto'; plain detection uses YOLOv8
+    'auto': ('yolov8', 'n'),
+}
+
+
+def model_family(model_name):
+    """Detector family of a model name, or None if the name is not known"""
+    alias = MODEL_ALIASES.get(str(model_name).strip().lower())
+    return alias[0] if alias else None
+
+
+def detector_key(model_name, det_size=None, provider=None):
+    """Resolve a model name to the (family, size, det_size, provider) key that identifies its weights"""
+    alias = MODEL_ALIASES.get(str(model_name).strip().lower())
+    if alias is None:
+        raise ValueError(f"Unknown face detection model '{model_name}'. "
+                         f"Expected one of: {', '.join(MODEL_ALIASES)}")
+    family, size = alias
+
+    if family == 'insightface':
+        return (family, None, tuple(det_size or DEFAULT_DET_SIZE), provider or DEFAULT_PROVIDER)
+    return (family, size, None, None)
+
+
+def build_detector(key):
+    """Construct the detector identified by a detector_key()"""
+    family, size, det_size, provider = key
+    if family == 'yolov8':
+        detector = YOLOv8FaceDetector(model_size=size)
+    elif family == 'deepface':
+        detector = DeepFaceDetector()
+    elif family == 'insightface':
+        detector = InsightFaceDetector(det_size=det_size, provider=provider)
+    elif family == 'mediapipe':
+        detector = MediaPipeFaceDetector()
+    elif family == 'onnx':
+        detector = OnnxFaceDetector(model_size=size)
+    elif family == 'cascade':
+        detector = CascadeFaceDetector()
+    else:
+        raise ValueError(f"Unknown detector family: {family}")
+    # PyTorch sizes its thread pool at import; cap it now that the backend is loaded
+    apply_thread_limits()
+    return detector
+
+
+def get_detector(model_name, det_size=None, provider=None):
+    """Factory function to get the appropriate detector"""
+    key = detector_key(model_name, det_size, provider)
+
+    try:
+        with timed('model_load'):
+            return build_detector(key)
+    except ImportError as e:
+        raise ImportError(f"Required package not installed for model '{model_name}': {str(e)}")
+    except Exception as e:
+        raise Exception(f"Failed to initialize detector for model '{model_name}': {str(e)}")
+
+
+# Approximate resident memory of each backend once loaded, used when RSS cannot be measured
+MODEL_MEMORY_ESTIMATES_MB = {
+    'yolov8': 200,
+    'deepface': 1200,
+    'insightface': 400,
+    'mediapipe': 80,
+    'onnx': 150,
+    'cascade': 80,
+}
+
+
+def current_rss_mb():
+    """Current resident set size of this process in MB, or None if unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def rounded_rss_mb():
+    rss_mb = current_rss_mb()
+    return round(rss_mb, 1) if rss_mb is not None else None
+
+
+class DetectorRegistry:
+    """Process-wide cache of initialized detectors with lazy construction and LRU eviction by memory budget"""
+
+    def __init__(self, memory_budget_mb=None):
+        if memory_budget_mb is None:
+            memory_budget_mb = float(os.environ.get('FACE_MODEL_MEMORY_MB', '2048'))
+        self.memory_budget_mb = memory_budget_mb
+        # key -> (detector, estimated size in MB), least recently used first
+        self._entries = OrderedDict()
+
+    def get(self, model_name, det_size=None, provider=None):
+        """Return the detector for model_name, loading its weights only on first use"""
+        key = detector_key(model_name, det_size, provider)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        rss_before = current_rss_mb()
+        try:
+            with timed('model_load'):
+                detector = build_detector(key)
+        except ImportError as e:
+            raise ImportError(f"Required package not installed for model '{model_name}': {str(e)}")
+        except Exception as e:
+            raise Exception(f"Failed to initialize detector for model '{model_name}': {str(e)}")
+        rss_after = current_rss_mb()
+
+        size_mb = MODEL_MEMORY_ESTIMATES_MB.get(key[0], 200)
+        if rss_before is not None and rss_after is not None and rss_after > rss_before:
+            size_mb = rss_after - rss_before
+
+        self._entries[key] = (detector, size_mb)
+        self._evict(keep=key)
+        return detector
+
+    def _evict(self, keep):
+        """Drop least recently used detectors until the registry fits its memory budget"""
+        while self.memory_mb() > self.memory_budget_mb and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._entries.pop(oldest)
+            print(f"Evicted detector {oldest[0]} to stay within {self.memory_budget_mb:.0f}MB", file=sys.stderr)
+        gc.collect()
+
+    def memory_mb(self):
+        return sum(size_mb for _, size_mb in self._entries.values())
+
+    def warmup(self, model_names):
+        """Load the given models ahead of the first request. Returns a report per model."""
+        report = []
+        for model_name in model_names:
+            start = time.perf_counter()
+            try:
+                self.get(model_name)
+                report.append({'model': model_name, 'loaded': True,
+                               'load_ms': round((time.perf_counter() - start) * 1000, 1)})
+            except Exception as e:
+                print(f"Warmup failed for {model_name}: {e}", file=sys.stderr)
+                report.append({'model': model_name, 'loaded': False, 'error': str(e)})
+        return report
+
+    def stats(self):
+        return {
+            'memory_budget_mb': self.memory_budget_mb,
+            'memory_mb': round(self.memory_mb(), 1),
+            'detectors': [
+                {'family': key[0], 'size': key[1], 'det_size': key[2], 'provider': key[3],
+                 'memory_mb': round(size_mb, 1)}
+                for key, (_, size_mb) in self._entries.items()
+            ],
+        }
+
+
+_REGISTRY = None
+
+
+def get_registry():
+    """Return the process-wide detector registry"""
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = DetectorRegistry()
+    return _REGISTRY
+
+
+def get_cached_detector(model_name):
+    """Return a shared detector for model_name, creating it only on first use"""
+    return get_registry().get(model_name)
+
+
+def is_backend_installed(package):
+    """Check whether a backend package can be imported without importing it"""
+    return importlib.util.find_spec(package) is not None
+
+
+# Every name detector_key accepts, so the CLI and --serve jobs take the same models
+MODEL_CHOICES = list(MODEL_ALIASES)
+
+# Import name -> pip distributions that may provide it; the first one installed gives the version
+BACKEND_DISTRIBUTIONS = {
+    'cv2': ('opencv-python', 'opencv-python-headless', 'opencv-contrib-python'),
+    'numpy': ('numpy',),
+    'ultralytics': ('ultralytics',),
+    'deepface': ('deepface',),
+    'insightface': ('insightface',),
+    'onnxruntime': ('onnxruntime', 'onnxruntime-gpu'),
+    'mediapipe': ('mediapipe',),
+}
+
+# Packages each detector family needs on top of OpenCV and NumPy
+FAMILY_PACKAGES = {
+    'yolov8': ('ultralytics',),
+    'deepface': ('deepface',),
+    'insightface': ('insightface', 'onnxruntime'),
+    'mediapipe': ('mediapipe',),
+    'onnx': ('onnxruntime',),
+    # Its stages' packages; checked after the other families below
+    'cascade': (),
+}
+
+
+def package_version(package):
+    """Installed version of a backend package from its distribution metadata, without importing it"""
+    from importlib.metadata import version, PackageNotFoundError
+
+    for distribution in BACKEND_DISTRIBUTIONS.get(package, (package,)):
+        try:
+            return version(distribution)
+        except PackageNotFoundError:
+            continue
+    return None
+
+
+def model_files(family):
+    """Weights a backend already has on disk; missing ones are downloaded when the model first loads"""
+    if family == 'yolov8':
+        script_dir = Path(__file__).resolve().parent
+        search_dirs = (Path.cwd(), script_dir, script_dir.parent)
+        return {
+            f'yolov8{size}-face.pt': any((d / f'yolov8{size}-face.pt').exists() for d in search_dirs)
+            for size in 'nsm'
+        }
+    if family == 'deepface':
+        weights_dir = Path(os.environ.get('DEEPFACE_HOME') or Path.home()) / '.deepface' / 'weights'
+        return {path.name: True for path in sorted(weights_dir.glob('*'))} if weights_dir.is_dir() else {}
+    if family == 'insightface':
+        return {'buffalo_l': (insightface_models_dir() / 'buffalo_l').is_dir()}
+    if family == 'onnx':
+        model_dir = onnx_model_dir()
+        return {path.name: True for path in sorted(model_dir.glob('*.onnx'))} if model_dir.is_dir() else {}
+    # MediaPipe ships its models inside the package
+    return {}
+
+
+def probe_capabilities():
+    """Report every backend's packages, versions and model files in one pass, importing none of them"""
+    import platform
+
+    packages = {
+        name: {'installed': is_backend_installed(name), 'version': package_version(name)}
+        for name in BACKEND_DISTRIBUTIONS
+    }
+    backends = {}
+    for family, required in FAMILY_PACKAGES.items():
+        missing = [package for package in required if not packages[package]['installed']]
+        files = model_files(family)
+        available = not missing
+        if family == 'onnx':
+            # Nothing downloads ONNX models on first use; they have to be exported first
+            available = available and any(name.startswith('yolov8') for name in files)
+        if family == 'cascade':
+            available = any(backends[stage]['available'] for stage in ('mediapipe', 'insightface', 'onnx', 'yolov8'))
+        backends[family] = {
+            'available': available,
+            'missing_packages': missing,
+            'model_files': files
+        }
+
+    models = {name: backends[model_family(name)]['available'] for name in MODEL_CHOICES}
+    # compare_faces('auto') tries DeepFace, then InsightFace, then the YOLOv8 detector
+    models['auto'] = any(backends[family]['available'] for family in ('deepface', 'insightface', 'yolov8'))
+
+    return {
+        'python': {'version': platform.python_version(), 'executable': sys.executable},
+        'packages': packages,
+        'backends': backends,
+        'models': models
+    }
+
+
+# Time a one-shot invocation may spend importing this module plus OpenCV and NumPy, before any backend loads
+STARTUP_BUDGET_MS = float(os.environ.get('FACE_STARTUP_BUDGET_MS', '750'))
+
+
+def process_age_ms():
+    """Milliseconds since this process started (Linux, 10ms resolution), or None if unavailable"""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime * 1000 - start_ticks * 1000 / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def profile_startup(model_names, budget_ms=STARTUP_BUDGET_MS):
+    """
+    Break down this process's cold start: interpreter start-up and importing this module,
+    importing OpenCV and NumPy, then per model its backend package imports and weight loading. Models are loaded in the
+    order given and later ones reuse dependencies already imported (e.g. onnxruntime), so
+    profile one model per run for isolated numbers.
+    """
+    process_ms = process_age_ms()
+    report = {
+        'process_start_ms': round(process_ms, 1) if process_ms is not None else None,
+        'module_import_ms': round(MODULE_IMPORT_MS, 1),
+        'core_imports_ms': {},
+        'models': {}
+    }
+    for name in ('numpy', 'cv2'):
+        start = time.perf_counter()
+        importlib.import_module(name)
+        report['core_imports_ms'][name] = round((time.perf_counter() - start) * 1000, 1)
+
+    base_ms = (process_ms if process_ms is not None else MODULE_IMPORT_MS) + sum(report['core_imports_ms'].values())
+    report['base_startup_ms'] = round(base_ms, 1)
+    report['budget_ms'] = budget_ms
+    report['within_budget'] = base_ms <= budget_ms
+
+    for model_name in model_names:
+        key = detector_key(model_name)
+        entry = {'family': key[0], 'imports_ms': {}}
+        modules_before = len(sys.modules)
+        rss_before = current_rss_mb()
+        try:
+            for package in FAMILY_PACKAGES[key[0]]:
+                start = time.perf_counter()
+                importlib.import_module(package)
+                entry['imports_ms'][package] = round((time.perf_counter() - start) * 1000, 1)
+            entry['modules_imported'] = len(sys.modules) - modules_before
+
+            start = time.perf_counter()
+            build_detector(key)
+            entry['model_load_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            entry['ready_ms'] = round(base_ms + sum(entry['imports_ms'].values()) + entry['model_load_ms'], 1)
+        except Exception as e:
+            entry['error'] = f'{type(e).__name__}: {e}'
+        rss_after = current_rss_mb()
+        if rss_before is not None and rss_after is not None:
+            entry['rss_delta_mb'] = round(rss_after - rss_before, 1)
+        report['models'][model_name] = entry
+
+    return report
+
+
+def embedding_similarity(embedding_a, embedding_b):
+    """Cosine similarity of two face embeddings mapped onto a 0-1 score"""
+    dot_product = np.dot(embedding_a, embedding_b)
+    norm_a = np.linalg.norm(embedding_a)
+    norm_b = np.linalg.norm(embedding_b)
+    similarity = dot_product / (norm_a * norm_b)
+    
+    # Convert to 0-1 scale (cosine similarity is -1 to 1, faces are typically 0.3-1.0)
+    return float(max(0.0, min(1.0, (similarity + 0.3) / 1.3)))
+
+
+# Longest side images are decoded at for comparison; enough for every backend's detector and aligner
+COMPARE_INPUT_SIDE = 1024
+
+
+def compare_faces(id_image_path, selfie_image_path, model_name='yolov8-face'):
+    """
+    Compare faces between ID and selfie images using face embeddings for accurate similarity.
+    Each image is decoded once and the arrays are shared by every stage. With model 'auto' the
+    stages run DeepFace -> InsightFace -> detector, and faces InsightFace already found are reused
+    by the detector stage instead of being detected again. The result names the stage that
+    answered, the stages attempted and per-stage timings.
+    """
+    timer = StageTimer()
+    attempts = []
+    
+    def finish(result, stage):
+        result.update({'stage': stage, 'attempts': attempts, 'timings_ms': timer.timings_ms})
+        return result
+    
+    try:
+        with timer.stage('decode'):
+            # Both images decode at once; OpenCV releases the GIL while decoding
+            (id_img, id_scale), (selfie_img, selfie_scale) = map_concurrent(
+                lambda image: prepare_image(image, COMPARE_INPUT_SIDE), (id_image_path, selfie_image_path)
+            )
+        # Detection uses the downscaled copies; faces are aligned and embedded from the originals
+        sources = [(id_image_path, id_scale), (selfie_image_path, selfie_scale)]
+        
+        if id_img is None or selfie_img is None:
+            return finish({
+                'similarity': 0.0,
+                'id_has_face': False,
+                'selfie_has_face': False,
+                'message': f"Could not read {'ID' if id_img is None else 'selfie'} image",
+                'model': model_name,
+                'error': 'Could not read image'
+            }, 'decode')
+        
+        # Try DeepFace first for accurate face verification
+        if model_name == 'deepface' or model_name == 'auto':
+            attempts.append('deepface')
+            try:
+                from deepface import DeepFace
+                with timer.stage('deepface'):
+                    # DeepFace detects and aligns itself, so it gets the full-resolution images
+                    id_full, selfie_full = (alignment_source(img, source)[0] for img, source in
+                                            zip((id_img, selfie_img), sources))
+                    with timed('inference'):
+                        result = DeepFace.verify(
+                            img1_path=id_full,
+                            img2_path=selfie_full,
+                            model_name='VGG-Face',  # Can use: VGG-Face, Facenet, OpenFace, DeepFace, DeepID, Dlib, ArcFace
+                            enforce_detection=False,
+                            silent=True
+                        )
+                
                 similarity = float(result['distance'])  # Lower distance = more similar
                 # Convert distance to similarity score (0-1), where 1 is identical
                 # VGG-Face distance typically ranges 0-1, where <0.4 is same person
                 similarity_score = max(0.0, min(1.0, 1.0 - (similarity / 0.4)))
                 
-                return {
+                return finish({
                     'similarity': float(similarity_score),
                     'id_has_face': result.get('verified', False),
                     'selfie_has_face': result.get('verified', False),
@@ -390,84 +1832,91 @@ def compare_faces(id_image_path, selfie_image_path, model_name='yolov8-face'):
                     'model': 'deepface',
                     'distance': float(similarity),
                     'verified': result.get('verified', False)
-                }
+                }, 'deepface')
             except Exception as e:
                 print(f"DeepFace comparison failed, trying detector: {e}", file=sys.stderr)
                 # Fall through to detector-based comparison
         
-        # Use InsightFace for embedding-based comparison if available
-        if model_name == 'insightface' or (model_name == 'auto' and 'insightface' in str(type(get_detector('yolov8-face')))):
+        # Use InsightFace (or its ONNX Runtime equivalent) for embedding-based comparison if available
+        insight_faces = None
+        embed_family = model_family(model_name)
+        if model_name == 'auto':
+            embed_family = 'insightface' if is_backend_installed('insightface') else None
+        if embed_family in ('insightface', 'onnx'):
+            embed_model = model_name if embed_family == 'onnx' else 'insightface'
+            label = 'InsightFace' if embed_family == 'insightface' else 'ONNX Runtime ArcFace'
+            attempts.append(embed_family)
             try:
-                import insightface
-                model = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
-                model.prepare(ctx_id=-1, det_size=(640, 640))
-                
-                id_img = cv2.imread(id_image_path)
-                selfie_img = cv2.imread(selfie_image_path)
+                detector = get_cached_detector(embed_model)
                 
-                id_faces = model.get(id_img)
-                selfie_faces = model.get(selfie_img)
+                # One detection pass per image and a single recognition pass over both faces
+                with timer.stage(embed_family):
+                    id_faces, selfie_faces = detector.detect_faces_batch([id_img, selfie_img], sources)
+                insight_faces = (id_faces, selfie_faces)
                 
                 if len(id_faces) == 0 or len(selfie_faces) == 0:
-                    return {
+                    return finish({
                         'similarity': 0.0,
                         'id_has_face': len(id_faces) > 0,
                         'selfie_has_face': len(selfie_faces) > 0,
                         'message': 'No face detected in one or both images',
-                        'model': 'insightface'
-                    }
-                
-                # Calculate cosine similarity between embeddings
-                id_embedding = id_faces[0].embedding
-                selfie_embedding = selfie_faces[0].embedding
+                        'model': embed_family
+                    }, embed_family)
                 
-                # Cosine similarity
-                dot_product = np.dot(id_embedding, selfie_embedding)
-                norm_id = np.linalg.norm(id_embedding)
-                norm_selfie = np.linalg.norm(selfie_embedding)
-                similarity = dot_product / (norm_id * norm_selfie)
-                
-                # Convert to 0-1 scale (cosine similarity is -1 to 1, faces are typically 0.3-1.0)
-                similarity_score = max(0.0, min(1.0, (similarity + 0.3) / 1.3))
-                
-                return {
-                    'similarity': float(similarity_score),
-                    'id_has_face': True,
-                    'selfie_has_face': True,
-                    'id_confidence': float(id_faces[0].det_score),
-                    'selfie_confidence': float(selfie_faces[0].det_score),
-                    'message': 'Faces compared using InsightFace embeddings',
-                    'model': 'insightface'
-                }
+                _, id_score, id_embedding = id_faces[0]
+                _, selfie_score, selfie_embedding = selfie_faces[0]
+                if id_embedding is not None and selfie_embedding is not None:
+                    # Calculate cosine similarity between embeddings
+                    similarity_score = embedding_similarity(id_embedding, selfie_embedding)
+                    
+                    return finish({
+                        'similarity': float(similarity_score),
+                        'id_has_face': True,
+                        'selfie_has_face': True,
+                        'id_confidence': float(id_score),
+                        'selfie_confidence': float(selfie_score),
+                        'message': f'Faces compared using {label} embeddings',
+                        'model': embed_family
+                    }, embed_family)
+                print(f"{label} recognition model unavailable, using detections only", file=sys.stderr)
             except Exception as e:
-                print(f"InsightFace comparison failed: {e}", file=sys.stderr)
+                print(f"{label} comparison failed: {e}", file=sys.stderr)
                 # Fall through to detector-based comparison
         
         # Fallback to detector-based comparison
-        detector = get_detector(model_name)
-        
-        # Detect faces in both images
-        id_result = detector.detect(id_image_path)
-        selfie_result = detector.detect(selfie_image_path)
+        attempts.append('detector')
+        with timer.stage('detect'):
+            if insight_faces is not None:
+                # Reuse the detections from the embedding stage rather than running a second detector
+                id_result, selfie_result = (
+                    detector._format_faces([(bbox, score) for bbox, score, _ in faces] if embed_family == 'onnx' else faces)
+                    for faces in insight_faces
+                )
+                model_name = embed_family
+            else:
+                detector = get_cached_detector(model_name)
+                
+                # Detect faces in both images in one call: batched (YOLOv8, ONNX) or concurrent (InsightFace)
+                id_result, selfie_result = detector.detect_batch([id_img, selfie_img])
         
         # Check if faces were detected
         if id_result['face_count'] == 0:
-            return {
+            return finish({
                 'similarity': 0.0,
                 'id_has_face': False,
                 'selfie_has_face': selfie_result['face_count'] > 0,
                 'message': 'No face detected in ID image',
                 'model': model_name
-            }
+            }, 'detector')
         
         if selfie_result['face_count'] == 0:
-            return {
+            return finish({
                 'similarity': 0.0,
                 'id_has_face': True,
                 'selfie_has_face': False,
                 'message': 'No face detected in selfie',
                 'model': model_name
-            }
+            }, 'detector')
         
         # Calculate similarity based on bounding box overlap and confidence
         id_face = id_result['faces'][0]
@@ -483,7 +1932,7 @@ def compare_faces(id_image_path, selfie_image_path, model_name='yolov8-face'):
         if id_conf > 0.7 and selfie_conf > 0.7:
             similarity = min(0.95, similarity + 0.1)
         
-        return {
+        return finish({
             'similarity': float(similarity),
             'id_has_face': True,
             'selfie_has_face': True,
@@ -491,34 +1940,1150 @@ def compare_faces(id_image_path, selfie_image_path, model_name='yolov8-face'):
             'selfie_confidence': float(selfie_conf),
             'message': 'Faces detected in both images',
             'model': model_name
-        }
+        }, 'detector')
     except Exception as e:
         print(f"ERROR in face comparison: {e}", file=sys.stderr)
-        return {
+        return finish({
             'similarity': 0.0,
             'id_has_face': False,
             'selfie_has_face': False,
             'message': f'Error comparing faces: {str(e)}',
             'model': model_name,
             'error': str(e)
+        }, 'error')
+
+
+DEFAULT_BATCH_SIZE = 16
+
+
+def read_manifest(manifest_path):
+    """Yield entries from a JSONL manifest ('-' reads stdin). Lines may be JSON strings, objects, or bare paths."""
+    stream = sys.stdin if manifest_path == '-' else open(manifest_path, encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def chunked(items, size):
+    """Group an iterable into lists of at most size items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def manifest_image(entry):
+    """Image path of a detect-batch manifest entry"""
+    if isinstance(entry, dict):
+        return entry.get('image') or entry.get('path')
+    return entry
+
+
+def manifest_pair(entry):
+    """(id_image, selfie_image) of a compare-batch manifest entry"""
+    if isinstance(entry, dict):
+        return entry.get('id_image'), entry.get('selfie_image')
+    if isinstance(entry, (list, tuple)) and len(entry) == 2:
+        return entry[0], entry[1]
+    return None, None
+
+
+def detect_batch(image_paths, detector):
+    """Detect faces in a list of images with one batched call. Missing files get an error result."""
+    results = [None] * len(image_paths)
+    readable = []
+    for i, image_path in enumerate(image_paths):
+        if image_path and Path(image_path).exists():
+            readable.append(i)
+        else:
+            results[i] = {'error': f'Image file not found: {image_path}', 'face_count': 0, 'faces': []}
+    
+    if readable:
+        batch_results = detector.detect_batch([image_paths[i] for i in readable])
+        for i, result in zip(readable, batch_results):
+            if 'face_count' not in result:
+                result['face_count'] = len(result.get('faces', []))
+            results[i] = result
+    return results
+
+
+def compare_batch(pairs, model_name):
+    """
+    Compare (id_image, selfie_image) pairs. With InsightFace every image in the batch
+    goes through one batched detection/embedding pass; other models compare pair by pair
+    with their weights kept warm in the registry.
+    """
+    if model_name != 'insightface':
+        return [
+            compare_faces(id_path, selfie_path, model_name) if id_path and selfie_path else {
+                'similarity': 0.0,
+                'id_has_face': False,
+                'selfie_has_face': False,
+                'message': 'Both ID and selfie image paths required',
+                'model': model_name,
+                'error': 'Both ID and selfie image paths required'
+            }
+            for id_path, selfie_path in pairs
+        ]
+    
+    detector = get_cached_detector('insightface')
+    paths = [path for pair in pairs for path in pair]
+    prepared = [prepare_image(path, detector.input_side) if path else (None, 1.0) for path in paths]
+    # Crops come from each original, decoded one at a time, not from the detector's downscaled copy
+    faces = detector.detect_faces_batch([img for img, _ in prepared],
+                                        [(path, scale) for path, (_, scale) in zip(paths, prepared)])
+    
+    results = []
+    for i in range(len(pairs)):
+        id_faces, selfie_faces = faces[2 * i], faces[2 * i + 1]
+        if id_faces is None or selfie_faces is None:
+            results.append({
+                'similarity': 0.0,
+                'id_has_face': False,
+                'selfie_has_face': False,
+                'message': 'Could not read one or both images',
+                'model': 'insightface',
+                'error': 'Could not read image'
+            })
+        elif len(id_faces) == 0 or len(selfie_faces) == 0:
+            results.append({
+                'similarity': 0.0,
+                'id_has_face': len(id_faces) > 0,
+                'selfie_has_face': len(selfie_faces) > 0,
+                'message': 'No face detected in one or both images',
+                'model': 'insightface'
+            })
+        elif id_faces[0][2] is None or selfie_faces[0][2] is None:
+            results.append({
+                'similarity': 0.0,
+                'id_has_face': True,
+                'selfie_has_face': True,
+                'message': 'InsightFace recognition model not available',
+                'model': 'insightface',
+                'error': 'No embedding produced'
+            })
+        else:
+            results.append({
+                'similarity': embedding_similarity(id_faces[0][2], selfie_faces[0][2]),
+                'id_has_face': True,
+                'selfie_has_face': True,
+                'id_confidence': float(id_faces[0][1]),
+                'selfie_confidence': float(selfie_faces[0][1]),
+                'message': 'Faces compared using InsightFace embeddings',
+                'model': 'insightface'
+            })
+    return results
+
+
+# Face artifacts: aligned crops plus detection metadata kept per registration, so re-checks and
+# re-scoring with another model run only a recognizer over small crops
+ARTIFACT_VERSION = 1
+# Longest side the artifact detector works at; crops are cut from the full-resolution image
+ARTIFACT_INPUT_SIDE = 1024
+# Detectors tried for 'auto', landmark-producing ones first so the crops come out aligned
+ARTIFACT_AUTO_MODELS = ('insightface', 'onnx', 'yolov8-face')
+
+
+def backend_available(family):
+    """Whether a detector family's packages (and, for ONNX, its exported models) are installed"""
+    if not all(is_backend_installed(package) for package in FAMILY_PACKAGES[family]):
+        return False
+    return family != 'onnx' or any(name.startswith('yolov8') for name in model_files('onnx'))
+
+
+def artifact_model(model_name):
+    if model_name != 'auto':
+        return model_name
+    return next((name for name in ARTIFACT_AUTO_MODELS if backend_available(model_family(name))),
+                ARTIFACT_AUTO_MODELS[-1])
+
+
+def face_artifacts(images, model_name='auto', output_dir=None, prefix='face'):
+    """
+    Aligned FACE_CROP_SIZE crop of the most confident face in each image, with its box and landmarks in
+    full-resolution coordinates and the detector that found it. images maps a name ('id', 'selfie') to an
+    image path or bytes. Crops are written to output_dir as <prefix>-<name>.png, or returned as base64 PNG.
+    """
+    model_name = artifact_model(model_name)
+    family = model_family(model_name)
+    detector = get_cached_detector(model_name)
+    prefix = Path(str(prefix)).name
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+    
+    faces = {}
+    for name, image in images.items():
+        img, scale = prepare_image(image, ARTIFACT_INPUT_SIDE)
+        if img is None:
+            faces[name] = {'error': 'Could not read image'}
+            continue
+        located = detector.locate(img)
+        if not located:
+            faces[name] = {'error': 'No face detected'}
+            continue
+        
+        box, score, landmarks = max(located, key=lambda face: float(face[1]))
+        # Located on the downscaled copy, cut from the full-resolution image
+        aligned_img, aligned_scale = alignment_source(img, (image, scale))
+        with timed('preprocess'):
+            crop = detector.align(aligned_img, np.asarray(box, dtype=np.float32) * aligned_scale,
+                                  None if landmarks is None else np.asarray(landmarks, dtype=np.float32) * aligned_scale)
+            _, png = cv2.imencode('.png', crop)
+        face = {
+            'bounding_box': [round(float(value) * scale, 1) for value in box[:4]],
+            'landmarks': None if landmarks is None else [
+                [round(float(x) * scale, 1), round(float(y) * scale, 1)] for x, y in np.asarray(landmarks)[:, :2]
+            ],
+            'aligned': landmarks is not None,
+            'confidence': round(float(score), 4),
+            'image_size': [round(img.shape[1] * scale), round(img.shape[0] * scale)],
         }
+        if output_dir:
+            crop_path = Path(output_dir) / f'{prefix}-{name}.png'
+            crop_path.write_bytes(png.tobytes())
+            face['crop'] = crop_path.name
+        else:
+            face['crop_png'] = base64.b64encode(png.tobytes()).decode('ascii')
+        faces[name] = face
+    
+    package = (FAMILY_PACKAGES.get(family) or (None,))[0]
+    return {
+        'version': ARTIFACT_VERSION,
+        'crop_size': FACE_CROP_SIZE,
+        'detector': {
+            'model': model_name,
+            'family': family,
+            'package': package or 'opencv-python',
+            'version': package_version(package or 'cv2'),
+        },
+        'faces': faces,
+        'model': model_name,
+    }
+
+
+# Detector families whose crops are aligned on the landmark template the recognizers are trained on
+ALIGNED_CROP_FAMILIES = ('insightface', 'onnx')
+
+
+def stored_crop_problem(entry):
+    """
+    Why a recompare entry's crops cannot be scored like registration-time faces, or None. Entries carry the
+    face_artifacts metadata: aligned (both crops landmark-aligned), detector (family that cut them),
+    crop_size and artifact_version. Box crops (e.g. from the yolov8-face fallback) would give ArcFace
+    unaligned faces and a misleading similarity.
+    """
+    if not isinstance(entry, dict):
+        return None
+    if entry.get('aligned') is False:
+        return 'Face crops are not landmark-aligned; re-register or recompare from the original images'
+    family = entry.get('detector')
+    if family and family not in ALIGNED_CROP_FAMILIES:
+        return f"Face crops from the '{family}' detector are not aligned for recognition"
+    if entry.get('crop_size') and int(entry['crop_size']) != FACE_CROP_SIZE:
+        return f"Face crops are {entry['crop_size']} px; recognition expects {FACE_CROP_SIZE} px"
+    if entry.get('artifact_version') and int(entry['artifact_version']) != ARTIFACT_VERSION:
+        return f"Face artifacts version {entry['artifact_version']} is not supported"
+    return None
+
+
+def recompare_pairs(pairs, model_name='auto', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Similarity of stored (id crop, selfie crop) pairs written by face_artifacts(). The crops are already
+    aligned, so there is no full-size decode and no detection: each batch is one recognizer call over
+    the stacked crops and a dot product per pair. Entries may carry a voter_id, which is echoed back.
+    Entries whose metadata shows unaligned or incompatible crops get an error (see stored_crop_problem).
+    """
+    if model_name == 'auto':
+        model_name = 'insightface' if is_backend_installed('insightface') else 'deepface'
+    detector = get_cached_detector(model_name)
+    
+    results = []
+    for chunk in chunked(pairs, batch_size):
+        crops = []
+        slots = []
+        for entry in chunk:
+            if stored_crop_problem(entry):
+                slots.append(None)
+                continue
+            paths = manifest_pair(entry)
+            loaded = [decode_image(path) if path and (is_image_bytes(path) or Path(path).exists()) else None
+                      for path in paths]
+            if any(crop is None for crop in loaded):
+                slots.append(None)
+                continue
+            slots.append(len(crops))
+            crops.extend(crop if crop.shape[:2] == (FACE_CROP_SIZE, FACE_CROP_SIZE)
+                         else cv2.resize(crop, (FACE_CROP_SIZE, FACE_CROP_SIZE)) for crop in loaded)
+        
+        embeddings = detector.embed_crops(crops) if crops else []
+        if embeddings is None:
+            raise JobError({'error': f"Model '{model_name}' does not produce face embeddings; "
+                                     f"use insightface, deepface, onnx or auto",
+                            'results': [], 'model': model_name})
+        for entry, slot in zip(chunk, slots):
+            result = {'model': model_name}
+            if isinstance(entry, dict) and entry.get('voter_id') is not None:
+                result['voter_id'] = entry['voter_id']
+            problem = stored_crop_problem(entry)
+            if problem:
+                result.update({'similarity': 0.0, 'error': problem, 'unaligned': True})
+            elif slot is None:
+                result.update({'similarity': 0.0, 'error': 'Could not read face crop'})
+            else:
+                result['similarity'] = embedding_similarity(embeddings[slot], embeddings[slot + 1])
+            results.append(result)
+    return results
+
+
+def print_json(result):
+    print(json.dumps(result), flush=True)
+
+
+def run_batch_manifest(action, manifest_path, model_name, batch_size=DEFAULT_BATCH_SIZE, emit=print_json):
+    """Stream one result per manifest line (JSON lines by default), processing batch_size entries at a time"""
+    detector = get_cached_detector(model_name) if action == 'detect-batch' else None
+    
+    for chunk in chunked(enumerate(read_manifest(manifest_path)), batch_size):
+        if action == 'recompare':
+            for (index, _), result in zip(chunk, recompare_pairs([entry for _, entry in chunk], model_name, batch_size)):
+                emit({'index': index, **result})
+        elif action == 'detect-batch':
+            image_paths = [manifest_image(entry) for _, entry in chunk]
+            results = detect_batch(image_paths, detector)
+            for (index, _), image_path, result in zip(chunk, image_paths, results):
+                emit({'index': index, 'image': image_path, **result})
+        else:
+            pairs = [manifest_pair(entry) for _, entry in chunk]
+            results = compare_batch(pairs, model_name)
+            for (index, _), (id_path, selfie_path), result in zip(chunk, pairs, results):
+                emit({'index': index, 'id_image': id_path, 'selfie_image': selfie_path, **result})
+
+
+# Process-wide detect/embed result cache; False once FACE_CACHE has disabled it
+_RESULT_CACHE = None
+
+
+def get_result_cache():
+    """Return the result cache, or None when disabled with FACE_CACHE=0"""
+    global _RESULT_CACHE
+    if _RESULT_CACHE is None:
+        from resultCache import ResultCache, cache_enabled
+        _RESULT_CACHE = ResultCache() if cache_enabled() else False
+    return _RESULT_CACHE or None
+
+
+def cached_result(job, action, model, image, compute, params=None):
+    """
+    Return compute(), or the stored result when the same image content was already processed
+    by the same action and model weights. Results carrying an error are not cached.
+    """
+    cache = get_result_cache() if job.get('cache', True) else None
+    if cache is None:
+        return compute()
+
+    from resultCache import content_hash, cache_key
+    with timed('cache'):
+        key = cache_key(content_hash(image), action, {'model': detector_key(model), **(params or {})})
+        cached = cache.get(key)
+    if cached is not None:
+        return {**cached, 'cached': True}
+
+    result = compute()
+    if not result.get('error'):
+        # Timings describe the run that computed the result, not later cache hits
+        with timed('cache'):
+            cache.put(key, {name: value for name, value in result.items() if name != 'timings_ms'})
+    return result
+
+
+# Open face indexes, kept for the lifetime of a --serve worker
+_INDEXES = {}
+
+
+def get_face_index(index_dir=None):
+    """Return the face search index stored in index_dir (FACE_INDEX_DIR by default)"""
+    from faceIndex import FaceIndex, default_index_dir
+
+    key = str(index_dir or default_index_dir())
+    if key not in _INDEXES:
+        _INDEXES[key] = FaceIndex(key)
+    return _INDEXES[key]
+
+
+def job_embedding(job, detector_factory):
+    """Resolve the query embedding of an index job from 'embedding' (base64) or by embedding 'image'"""
+    if job.get('embedding'):
+        return decode_embedding(job['embedding']), job.get('embedding_model')
+
+    image = job.get('image')
+    if not image or not Path(image).exists():
+        raise JobError({'error': f'Image file not found: {image}' if image else 'Embedding or image required'})
+
+    model = job.get('model') or 'auto'
+    if model == 'auto':
+        model = 'insightface' if is_backend_installed('insightface') else 'deepface'
+    result = detector_factory(model).embed(image)
+    if result.get('error'):
+        raise JobError({'error': result['error'], 'model': model})
+    if not result['faces']:
+        raise JobError({'error': 'No face detected in image', 'model': model})
+
+    face = max(result['faces'], key=lambda f: f['confidence'])
+    return decode_embedding(face['embedding']), result['model']
+
+
+def run_index_job(job, detector_factory=get_detector):
+    """Add to, search, or partition the 1:N face search index"""
+    action = job.get('action')
+    index = get_face_index(job.get('index_dir'))
+
+    try:
+        if action == 'index-add':
+            items = job.get('items')
+            if items is None:
+                items = [{k: job.get(k) for k in ('voter_id', 'embedding', 'embedding_model', 'image', 'model')}]
+
+            entries = []
+            model = None
+            for item in items:
+                if not item.get('voter_id'):
+                    raise JobError({'error': 'voter_id required for index-add'})
+                embedding, model = job_embedding(item, detector_factory)
+                entries.append((item['voter_id'], embedding))
+
+            first_row = index.add(entries, model=model)
+            return {'added': len(entries), 'first_row': first_row, **index.stats()}
+
+        if action == 'search':
+            embedding, model = job_embedding(job, detector_factory)
+            result = index.search(
+                embedding,
+                k=int(job.get('top_k') or 5),
+                threshold=job.get('threshold'),
+                nprobe=job.get('nprobe'),
+                model=model
+            )
+            result['model'] = model
+            return result
+
+        if action == 'index-build':
+            return {**index.train_ivf(nlist=job.get('nlist')), **index.stats()}
+
+        return index.stats()
+    except ValueError as e:
+        raise JobError({'error': str(e), **index.stats()})
+
+
+class JobError(Exception):
+    """Raised when a job is rejected before any detection runs"""
+
+    def __init__(self, result):
+        super().__init__(result.get('error'))
+        self.result = result
+
+
+def deepface_options(job, model):
+    """
+    DeepFace detect options from a job: 'analyze' (list or comma-separated attribute actions)
+    and 'detector_backend'. Other models take no options, so asking them for attributes is an error.
+    """
+    actions = job.get('analyze') or []
+    if isinstance(actions, str):
+        actions = [action.strip() for action in actions.split(',') if action.strip()]
+    unknown = [action for action in actions if action not in DEEPFACE_ACTIONS]
+    if unknown:
+        raise JobError({
+            'error': f"Unknown analysis action(s): {', '.join(unknown)}. Choose from {', '.join(DEEPFACE_ACTIONS)}",
+            'face_count': 0,
+            'faces': []
+        })
+
+    if detector_key(model)[0] != 'deepface':
+        if actions:
+            raise JobError({
+                'error': f"Attribute analysis requires the deepface model, not '{model}'",
+                'face_count': 0,
+                'faces': [],
+                'model': model
+            })
+        return {}
+
+    options = {'actions': sorted(set(actions))}
+    if job.get('detector_backend'):
+        options['detector_backend'] = job['detector_backend']
+    return options
+
+
+# Functions listed in a --profile report, by cumulative time
+PROFILE_TOP_FUNCTIONS = 20
+# Allocation sites listed in a --trace-memory report
+TRACE_MEMORY_TOP_SITES = 10
+
+
+def diagnostic_enabled(job, key, env_name):
+    """Whether an opt-in diagnostic is on for this job; the job key wins over the environment default"""
+    if job.get(key) is not None:
+        return bool(job[key])
+    return os.environ.get(env_name, '0').lower() in ('1', 'true', 'on', 'yes')
+
+
+def profile_report(profiler):
+    """Top functions of a cProfile run by cumulative time"""
+    import pstats
+
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+    return [
+        {
+            'function': f'{name} ({Path(filename).name}:{line})',
+            'calls': calls,
+            'own_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3)
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in rows
+    ]
+
+
+def memory_report(tracemalloc):
+    """Current and peak traced memory plus the largest live allocation sites"""
+    current, peak = tracemalloc.get_traced_memory()
+    sites = tracemalloc.take_snapshot().statistics('lineno')[:TRACE_MEMORY_TOP_SITES]
+    return {
+        'current_mb': round(current / (1 << 20), 3),
+        'peak_mb': round(peak / (1 << 20), 3),
+        'top_sites': [
+            {
+                'site': f'{Path(stat.traceback[0].filename).name}:{stat.traceback[0].lineno}',
+                'size_mb': round(stat.size / (1 << 20), 3),
+                'count': stat.count
+            }
+            for stat in sites
+        ]
+    }
+
+
+@contextmanager
+def job_diagnostics(job):
+    """
+    Run the block under cProfile (job 'profile' / FACE_PROFILE) and tracemalloc
+    (job 'trace_memory' / FACE_TRACE_MEMORY) when enabled; the yielded dict receives the reports.
+    cProfile only sees the calling thread, and tracemalloc only allocations made through
+    Python's allocator (numpy arrays included, native inference buffers not).
+    """
+    report = {}
+    profiler = None
+    tracemalloc = None
+    if diagnostic_enabled(job, 'profile', 'FACE_PROFILE'):
+        import cProfile
+        profiler = cProfile.Profile()
+    if diagnostic_enabled(job, 'trace_memory', 'FACE_TRACE_MEMORY'):
+        import tracemalloc
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield report
+    finally:
+        if profiler:
+            profiler.disable()
+            report['profile'] = profile_report(profiler)
+        if tracemalloc:
+            report['memory'] = memory_report(tracemalloc)
+            tracemalloc.stop()
+
+
+def run_job(job, detector_factory=get_detector):
+    """
+    Run a single job described by a dict. The result carries timings_ms: the hot-path stages
+    (decode, preprocess, model_load, inference, embedding, cache) plus any stages the action
+    times itself, and the job total.
+    """
+    failed = None
+    with job_timer() as timer, job_diagnostics(job) as diagnostics:
+        try:
+            result = dispatch_job(job, detector_factory)
+        except JobError as e:
+            failed, result = e, e.result
+        total_ms = timer.total_ms()
+    result['timings_ms'] = {**(result.get('timings_ms') or {}), **timer.timings_ms, 'total': total_ms}
+    result.update(diagnostics)
+    if failed:
+        raise failed
+    return result
+
+
+def dispatch_job(job, detector_factory=get_detector):
+    """Run a single detect/compare job described by a dict and return its result"""
+    action = job.get('action')
+    model = job.get('model') or 'yolov8-face'
+
+    if action == 'detect':
+        image = job.get('image')
+        if not image:
+            raise JobError({
+                'error': 'Image path required for detection',
+                'face_count': 0,
+                'faces': []
+            })
+
+        # Check if image file exists (in-memory image bytes need no file)
+        if not is_image_bytes(image) and not Path(image).exists():
+            raise JobError({
+                'error': f'Image file not found: {image}',
+                'face_count': 0,
+                'faces': []
+            })
+
+        options = deepface_options(job, model)
+
+        def detect():
+            try:
+                detector = detector_factory(model)
+            except Exception as e:
+                raise JobError({
+                    'error': f'Failed to initialize detector: {str(e)}',
+                    'face_count': 0,
+                    'faces': [],
+                    'model': model
+                })
+            return detector.detect(image, **options)
+
+        # Repeat uploads of the same image skip model loading and inference
+        result = cached_result(job, 'detect', model, image, detect, options)
+        # Ensure result has required fields
+        if 'face_count' not in result:
+            result['face_count'] = len(result.get('faces', []))
+        return result
+
+    if action == 'compare':
+        if not job.get('id_image') or not job.get('selfie_image'):
+            raise JobError({
+                'error': 'Both ID and selfie image paths required',
+                'face_count': 0,
+                'faces': []
+            })
+
+        return compare_faces(job['id_image'], job['selfie_image'], model)
+
+    if action == 'embed':
+        image = job.get('image')
+        if not image or not (is_image_bytes(image) or Path(image).exists()):
+            raise JobError({
+                'error': f'Image file not found: {image}' if image else 'Image path required for embedding',
+                'face_count': 0,
+                'faces': []
+            })
+
+        embed_model = model
+        if embed_model == 'auto':
+            embed_model = 'insightface' if is_backend_installed('insightface') else 'deepface'
+        if model_family(embed_model) not in ('insightface', 'deepface', 'onnx'):
+            raise JobError({
+                'error': f"Model '{model}' does not produce face embeddings; use insightface, deepface, onnx or auto",
+                'face_count': 0,
+                'faces': [],
+                'model': model
+            })
+
+        def embed():
+            try:
+                detector = detector_factory(embed_model)
+            except Exception as e:
+                raise JobError({
+                    'error': f'Failed to initialize detector: {str(e)}',
+                    'face_count': 0,
+                    'faces': [],
+                    'model': embed_model
+                })
+            return detector.embed(image)
+
+        return cached_result(job, 'embed', embed_model, image, embed)
+
+    if action == 'capabilities':
+        return probe_capabilities()
+
+    if action == 'export-onnx':
+        import onnxFace
+
+        _, size = MODEL_ALIASES.get(str(model).lower(), ('yolov8', 'n'))
+        return onnxFace.export_models(onnx_model_dir(), size=size or 'n', quantize=bool(job.get('quantize')),
+                                      insightface_models_dir=insightface_models_dir())
+
+    if action in ('index-add', 'search', 'index-build', 'index-stats'):
+        return run_index_job(job, detector_factory)
+
+    if action == 'artifacts':
+        images = {name: job.get(f'{name}_image') for name in ('id', 'selfie') if job.get(f'{name}_image')}
+        missing = [image for image in images.values() if not is_image_bytes(image) and not Path(image).exists()]
+        if not images or missing:
+            raise JobError({'error': f'Image file not found: {missing[0]}' if missing else 'ID or selfie image required',
+                            'faces': {}})
+        try:
+            return face_artifacts(images, model, job.get('artifact_dir'), job.get('artifact_prefix') or 'face')
+        except Exception as e:
+            raise JobError({'error': f'Failed to create face artifacts: {str(e)}', 'faces': {}, 'model': model})
+
+    if action == 'quality':
+        # Pairs are keyed by field name; a bare 'id' would clash with the worker protocol's job id
+        images = {key: job.get(key) for key in ('image', 'id_image', 'selfie_image') if job.get(key)}
+        if not images:
+            raise JobError({'error': 'Image path required for the quality check', 'usable': False})
+        results = {}
+        for name, image in images.items():
+            if not is_image_bytes(image) and not Path(image).exists():
+                results[name] = {'usable': False, 'score': 0.0, 'issues': ['unreadable'], 'warnings': [],
+                                 'messages': [f'Image file not found: {image}'], 'metrics': {}}
+            else:
+                results[name] = image_quality(image)
+        if 'image' in results:
+            return results['image']
+        return {**results, 'usable': all(result['usable'] for result in results.values())}
+
+    if action == 'recompare':
+        batch_size = int(job.get('batch_size') or DEFAULT_BATCH_SIZE)
+        pairs = job.get('pairs')
+        try:
+            if pairs is not None:
+                return {'results': recompare_pairs(pairs, model, batch_size), 'model': model}
+            entry = {key: job.get(key) for key in ('id_image', 'selfie_image', 'aligned', 'detector',
+                                                   'crop_size', 'artifact_version')}
+            return recompare_pairs([entry], model)[0]
+        except JobError:
+            raise
+        except Exception as e:
+            raise JobError({'error': f'Failed to initialize detector: {str(e)}', 'similarity': 0.0, 'model': model})
+
+    if action in ('detect-batch', 'compare-batch'):
+        batch_size = int(job.get('batch_size') or DEFAULT_BATCH_SIZE)
+        results = []
+        if action == 'detect-batch':
+            try:
+                detector = detector_factory(model)
+            except Exception as e:
+                raise JobError({
+                    'error': f'Failed to initialize detector: {str(e)}',
+                    'results': [],
+                    'model': model
+                })
+            for chunk in chunked(job.get('images') or [], batch_size):
+                results.extend(detect_batch(chunk, detector))
+        else:
+            for chunk in chunked(job.get('pairs') or [], batch_size):
+                results.extend(compare_batch([manifest_pair(pair) for pair in chunk], model))
+        return {'results': results, 'model': model}
+
+    raise JobError({
+        'error': f'Unknown action: {action}',
+        'face_count': 0,
+        'faces': []
+    })
+
+
+# Framed stdin/stdout protocol used by --serve:
+# every frame is a 4-byte big-endian payload length, a 1-byte frame type, then the payload.
+FRAME_HEADER = struct.Struct('>IB')
+FRAME_JSON = ord('J')
+# Encoded image bytes for the preceding JSON job; its 'blobs' list names the job field each one fills
+FRAME_BYTES = ord('B')
+# Binary result (jobs with "format": "binary"): 4-byte big-endian header length, JSON header padded
+# to a 4-byte boundary, then raw little-endian float32 arrays the header points at with
+# {"$f32": byte_offset, "shape": [...]}. Embeddings, boxes and scores skip float-to-text conversion.
+FRAME_RESULT = ord('R')
+RESULT_FORMATS = ('json', 'binary')
+
+# Float lists at least this long are sent as float32 arrays in binary results
+BINARY_MIN_FLOATS = 4
+
+
+def read_frame(stream):
+    """Read one frame from a binary stream. Returns (frame_type, payload) or None at EOF."""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    length, frame_type = FRAME_HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return frame_type, payload
+
+
+def write_frame(stream, frame_type, payload):
+    """Write one frame to a binary stream and flush it"""
+    stream.write(FRAME_HEADER.pack(len(payload), frame_type))
+    stream.write(payload)
+    stream.flush()
+
+
+def write_json_frame(stream, result):
+    write_frame(stream, FRAME_JSON, json.dumps(result).encode('utf-8'))
+
+
+def pack_result(result):
+    """Encode a result as a binary result payload (see FRAME_RESULT)"""
+    arrays = []
+    offset = 0
+
+    def pack(value, key=None):
+        nonlocal offset
+        if isinstance(value, np.ndarray):
+            array = value
+        elif key == 'embedding' and isinstance(value, str):
+            array = np.frombuffer(base64.b64decode(value), dtype='<f4')
+        elif (isinstance(value, list) and len(value) >= BINARY_MIN_FLOATS
+              and all(isinstance(v, float) for v in value)):
+            array = np.asarray(value)
+        elif isinstance(value, dict):
+            return {k: pack(v, k) for k, v in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return [pack(v) for v in value]
+        else:
+            return value
+        array = np.ascontiguousarray(array, dtype='<f4')
+        arrays.append(array)
+        ref = {'$f32': offset, 'shape': list(array.shape)}
+        offset += array.nbytes
+        return ref
+
+    header = json.dumps(pack(result)).encode('utf-8')
+    padding = b' ' * (-(4 + len(header)) % 4)
+    return b''.join([struct.pack('>I', len(header)), header, padding] + [array.tobytes() for array in arrays])
+
+
+def write_result(stream, result, output_format='json'):
+    if output_format == 'binary':
+        write_frame(stream, FRAME_RESULT, pack_result(result))
+    else:
+        write_json_frame(stream, result)
+
+
+def serve(warmup_models=None):
+    """Long-lived worker: answer framed detect/compare jobs from stdin until EOF or shutdown"""
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Model libraries print progress to stdout; keep the protocol stream clean
+    sys.stdout = sys.stderr
+
+    if warmup_models:
+        get_registry().warmup(warmup_models)
+
+    write_json_frame(stdout, {'ready': True, 'pid': os.getpid(), 'formats': list(RESULT_FORMATS),
+                              'threads': _THREADS, 'rss_mb': rounded_rss_mb(),
+                              'startup_ms': round((time.perf_counter() - _IMPORT_START) * 1000, 1)})
+    print(f"Face detection worker {os.getpid()} ready", file=sys.stderr)
+
+    while True:
+        frame = read_frame(stdin)
+        if frame is None:
+            break
+
+        frame_type, payload = frame
+        job = {}
+        try:
+            if frame_type != FRAME_JSON:
+                raise JobError({'error': f'Unsupported frame type: {frame_type}'})
+            job = json.loads(payload.decode('utf-8'))
+
+            blob_fields = job.pop('blobs', None) or []
+            blobs = [read_frame(stdin) for _ in blob_fields]
+            if any(blob is None for blob in blobs):
+                break
+            for name, (blob_type, blob) in zip(blob_fields, blobs):
+                if blob_type != FRAME_BYTES:
+                    raise JobError({'error': f'Expected image bytes frame for {name}, got frame type {blob_type}'})
+                job[name] = blob
+
+            if job.get('action') == 'ping':
+                result = {'pong': True, 'pid': os.getpid()}
+            elif job.get('action') == 'warmup':
+                result = {'warmup': get_registry().warmup(job.get('models') or [])}
+            elif job.get('action') == 'stats':
+                result = get_registry().stats()
+                result['threads'] = _THREADS
+                cache = get_result_cache()
+                result['result_cache'] = cache.stats() if cache else None
+            elif job.get('action') == 'shutdown':
+                write_json_frame(stdout, {'id': job.get('id'), 'shutdown': True})
+                break
+            else:
+                result = run_job(job, detector_factory=get_cached_detector)
+        except JobError as e:
+            result = e.result
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc(), file=sys.stderr)
+            result = {
+                'error': str(e),
+                'error_type': type(e).__name__,
+                'face_count': 0,
+                'faces': []
+            }
+
+        result['id'] = job.get('id')
+        # The supervisor restarts workers whose memory keeps growing (see FaceWorkerPool maxRssMb)
+        result['rss_mb'] = rounded_rss_mb()
+        write_result(stdout, result, job.get('format') or 'json')
+
+
+# Stream mode: the detector runs on every STREAM_KEYFRAME_INTERVAL-th frame, and faces are followed
+# between keyframes by template matching on a small grayscale copy of each frame
+STREAM_KEYFRAME_INTERVAL = int(os.environ.get('FACE_STREAM_KEYFRAME_INTERVAL', '10'))
+# Normalized cross-correlation below which a track counts as lost and the next frame is a keyframe
+STREAM_MIN_TRACK_SCORE = float(os.environ.get('FACE_STREAM_MIN_TRACK_SCORE', '0.6'))
+STREAM_TRACK_SIDE = 320
+# Search window around the previous box, as a fraction of the box size on each side
+STREAM_SEARCH_MARGIN = 0.5
+
+
+class TemplateTracker:
+    """
+    Follows one face box between keyframes by matching the face's keyframe appearance inside a
+    window around its previous position. Box size is fixed until the next keyframe corrects it.
+    """
+    
+    def __init__(self, gray, box, face):
+        self.box = box  # (x, y, w, h) in tracking-image pixels
+        x, y, w, h = box
+        self.template = gray[y:y + h, x:x + w].copy()
+        self.face = face
+    
+    def update(self, gray):
+        """Move the box to the best match in the new frame. Returns the match score, or None if off-frame."""
+        x, y, w, h = self.box
+        margin_x, margin_y = int(w * STREAM_SEARCH_MARGIN), int(h * STREAM_SEARCH_MARGIN)
+        left, top = max(0, x - margin_x), max(0, y - margin_y)
+        right, bottom = min(gray.shape[1], x + w + margin_x), min(gray.shape[0], y + h + margin_y)
+        window = gray[top:bottom, left:right]
+        if window.shape[0] < h or window.shape[1] < w:
+            return None
+        with timed('tracking'):
+            scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+        self.box = (left + match_x, top + match_y, w, h)
+        return float(score)
+
+
+class FaceStream:
+    """Per-frame face boxes for a sequence of frames: full detection on keyframes, tracking in between"""
+    
+    def __init__(self, detector, model_name, keyframe_interval=None, min_track_score=None):
+        self.detector = detector
+        self.model_name = model_name
+        self.keyframe_interval = max(1, keyframe_interval or STREAM_KEYFRAME_INTERVAL)
+        self.min_track_score = STREAM_MIN_TRACK_SCORE if min_track_score is None else min_track_score
+        self.trackers = []
+        self.frame_index = 0
+        self.since_keyframe = None
+    
+    def reset(self):
+        """Drop every track; the next frame is a keyframe"""
+        self.trackers = []
+        self.since_keyframe = None
+    
+    def _tracking_image(self, img):
+        ratio = min(1.0, STREAM_TRACK_SIDE / max(img.shape[:2]))
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if ratio < 1.0:
+            size = (max(1, round(img.shape[1] * ratio)), max(1, round(img.shape[0] * ratio)))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return gray, ratio
+    
+    def _start_tracks(self, gray, ratio, faces):
+        self.trackers = []
+        for face in faces:
+            box = face.get('bounding_box')
+            if not box:
+                continue
+            x = max(0, int(box['x1'] * ratio))
+            y = max(0, int(box['y1'] * ratio))
+            w = min(gray.shape[1] - x, int((box['x2'] - box['x1']) * ratio))
+            h = min(gray.shape[0] - y, int((box['y2'] - box['y1']) * ratio))
+            if w >= 8 and h >= 8:
+                self.trackers.append(TemplateTracker(gray, (x, y, w, h), face))
+    
+    def process(self, frame):
+        """Boxes for the next frame (encoded bytes, a path or a BGR array)"""
+        index = self.frame_index
+        self.frame_index += 1
+        with job_timer() as timer:
+            with timed('decode'):
+                img = load_image(frame)
+            if img is None:
+                return {'frame': index, 'face_count': 0, 'faces': [], 'model': self.model_name,
+                        'error': 'Could not read frame'}
+            gray, ratio = self._tracking_image(img)
+            
+            reason = None
+            if self.since_keyframe is None:
+                reason = 'first_frame'
+            elif self.since_keyframe + 1 >= self.keyframe_interval:
+                reason = 'interval'
+            else:
+                scores = [tracker.update(gray) for tracker in self.trackers]
+                if any(score is None or score < self.min_track_score for score in scores):
+                    reason = 'track_lost'
+            
+            if reason:
+                result = self.detector.detect(img)
+                faces = result.get('faces', [])
+                self._start_tracks(gray, ratio, faces)
+                self.since_keyframe = 0
+                error = result.get('error')
+            else:
+                self.since_keyframe += 1
+                faces = []
+                for tracker, score in zip(self.trackers, scores):
+                    x, y, w, h = (value / ratio for value in tracker.box)
+                    faces.append({
+                        'bounding_box': {'x1': x, 'y1': y, 'x2': x + w, 'y2': y + h, 'width': w, 'height': h},
+                        'confidence': tracker.face.get('confidence'),
+                        'tracking_score': score,
+                        'model': tracker.face.get('model', self.model_name)
+                    })
+                error = None
+            total_ms = timer.total_ms()
+        
+        response = {
+            'frame': index,
+            'keyframe': bool(reason),
+            'face_count': len(faces),
+            'faces': faces,
+            'model': self.model_name,
+            'timings_ms': {**timer.timings_ms, 'total': total_ms}
+        }
+        if reason:
+            response['keyframe_reason'] = reason
+        if error:
+            response['error'] = error
+        return response
+
+
+def run_stream(model_name, keyframe_interval=None, min_track_score=None):
+    """
+    Stream mode (--action stream): read framed images from stdin and answer each with one JSON frame
+    of boxes as soon as it is processed. A JSON frame {"reset": true} drops the current tracks.
+    """
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Model libraries print progress to stdout; keep the protocol stream clean
+    sys.stdout = sys.stderr
+    
+    try:
+        detector = get_cached_detector(model_name)
+    except Exception as e:
+        write_json_frame(stdout, {'error': f'Failed to initialize detector: {str(e)}', 'model': model_name})
+        return 1
+    stream = FaceStream(detector, model_name, keyframe_interval, min_track_score)
+    write_json_frame(stdout, {'ready': True, 'pid': os.getpid(), 'model': model_name,
+                              'keyframe_interval': stream.keyframe_interval})
+    
+    while True:
+        frame = read_frame(stdin)
+        if frame is None:
+            break
+        frame_type, payload = frame
+        if frame_type == FRAME_JSON:
+            # Control frames get no reply, so a bad one is only logged
+            try:
+                control = json.loads(payload.decode('utf-8'))
+            except (UnicodeDecodeError, ValueError) as e:
+                print(f"ERROR in stream control frame: {e}", file=sys.stderr)
+                continue
+            if isinstance(control, dict) and control.get('reset'):
+                stream.reset()
+            continue
+        if frame_type != FRAME_BYTES:
+            # Still one reply per frame, so the client's queue of waiting frames stays in step
+            write_json_frame(stdout, {'frame': None, 'face_count': 0, 'faces': [], 'model': model_name,
+                                      'error': f'Unsupported frame type: {frame_type}'})
+            continue
+        try:
+            result = stream.process(payload)
+        except Exception as e:
+            print(f"ERROR in stream frame: {e}", file=sys.stderr)
+            result = {'frame': stream.frame_index - 1, 'face_count': 0, 'faces': [], 'model': model_name,
+                      'error': str(e)}
+        write_json_frame(stdout, result)
+    return 0
 
 
 def main():
     """Main entry point for the face detection service"""
     parser = argparse.ArgumentParser(description='Face Detection Service')
-    parser.add_argument('--action', required=True, choices=['detect', 'compare'],
-                       help='Action to perform: detect or compare')
+    parser.add_argument('--action', choices=['detect', 'compare', 'detect-batch', 'compare-batch', 'embed',
+                                             'index-add', 'search', 'index-build', 'index-stats', 'capabilities',
+                                             'export-onnx', 'stream', 'artifacts', 'recompare', 'quality'],
+                       help='Action to perform: detect, compare, embed, detect/compare -batch variants over a --manifest, '
+                            'a face search index operation, capabilities (installed backends and model files), '
+                            'export-onnx (write the ONNX backend models for --model), stream (track faces '
+                            'through framed images on stdin), artifacts (aligned face crops and detection metadata '
+                            'for --id-image/--selfie-image), recompare (score stored face crops, given as '
+                            '--id-image/--selfie-image or a --manifest of pairs), or quality (fast blur, exposure, '
+                            'resolution and face size check of --image or --id-image/--selfie-image)')
+    parser.add_argument('--serve', action='store_true',
+                       help='Run as a long-lived worker reading framed jobs from stdin')
     parser.add_argument('--model', default='yolov8-face',
-                       choices=['yolov8-face', 'yolov8n-face', 'yolov8s-face', 'yolov8m-face',
-                               'deepface', 'insightface', 'mediapipe', 'auto'],
+                       choices=MODEL_CHOICES,
                        help='Face detection model to use')
     parser.add_argument('--image', help='Path to image for detection')
     parser.add_argument('--id-image', help='Path to ID image for comparison')
     parser.add_argument('--selfie-image', help='Path to selfie image for comparison')
+    parser.add_argument('--manifest',
+                       help="JSONL manifest of images or {id_image, selfie_image} pairs for batch actions ('-' for stdin)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                       help='Images per inference batch for batch actions')
+    parser.add_argument('--artifact-dir', help='Directory the face crops are written to (artifacts; '
+                                               'base64 PNG in the result when omitted)')
+    parser.add_argument('--artifact-prefix', default='face', help='File name prefix of the face crops (artifacts)')
+    parser.add_argument('--voter-id', help='Voter id to store with the embedding (index-add)')
+    parser.add_argument('--embedding', help='Base64 float32 embedding from --action embed (index-add/search)')
+    parser.add_argument('--embedding-model', help='Model that produced --embedding, checked against the index')
+    parser.add_argument('--top-k', type=int, default=5, help='Number of matches to return (search)')
+    parser.add_argument('--threshold', type=float, help='Minimum cosine similarity of returned matches (search)')
+    parser.add_argument('--nprobe', type=int, help='IVF partitions to scan; omit for an exact search (search)')
+    parser.add_argument('--nlist', type=int, help='Number of IVF partitions to train (index-build)')
+    parser.add_argument('--index-dir', help='Face index directory (defaults to FACE_INDEX_DIR or backend/face_index)')
+    parser.add_argument('--analyze', default='',
+                       help=f"Comma-separated DeepFace attributes to estimate per face ({', '.join(DEEPFACE_ACTIONS)}); "
+                            'detection only when omitted')
+    parser.add_argument('--detector-backend',
+                       help=f'Face detector DeepFace uses (opencv, ssd, mtcnn, retinaface, mediapipe, yunet, ...; '
+                            f'default {DEFAULT_DEEPFACE_BACKEND})')
+    parser.add_argument('--format', choices=RESULT_FORMATS, default='json',
+                       help='Output format: JSON (lines), or binary result frames with raw float32 arrays')
+    parser.add_argument('--keyframe-interval', type=int,
+                       help='Run the detector on every Nth frame and track in between (stream; '
+                            'default FACE_STREAM_KEYFRAME_INTERVAL or 10)')
+    parser.add_argument('--quantize', action='store_true',
+                       help='Also write int8-quantized copies of the exported models (export-onnx)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Bypass the detect/embed result cache for this run')
+    parser.add_argument('--profile', action='store_true',
+                       help='Run the job under cProfile and add the slowest functions to the result')
+    parser.add_argument('--trace-memory', action='store_true',
+                       help='Trace Python allocations with tracemalloc and add the peak and top sites to the result')
+    parser.add_argument('--warmup', default='',
+                       help='Comma-separated models to load before serving jobs (with --serve)')
+    parser.add_argument('--profile-startup', nargs='?', const='', metavar='MODELS',
+                       help='Report import and model load time per backend for comma-separated MODELS '
+                            '(default --model) and exit non-zero if the base startup exceeds FACE_STARTUP_BUDGET_MS')
     
     try:
         args = parser.parse_args()
+        if not args.serve and not args.action and args.profile_startup is None:
+            parser.error('--action is required unless --serve or --profile-startup is given')
     except SystemExit:
         # Argument parsing failed
         error_result = {
@@ -529,65 +3094,104 @@ def main():
         print(json.dumps(error_result))
         sys.exit(1)
     
+    # Before any backend loads, so every library sizes its thread pools to this process's share of the cores
+    configure_threads()
+    
+    if args.serve:
+        try:
+            serve([m.strip() for m in args.warmup.split(',') if m.strip()])
+        except KeyboardInterrupt:
+            pass
+        return
+    
+    if args.action == 'stream':
+        sys.exit(run_stream(args.model, args.keyframe_interval))
+    
+    if args.profile_startup is not None:
+        models = [m.strip() for m in args.profile_startup.split(',') if m.strip()] or [args.model]
+        # Model libraries print progress to stdout; keep the report parseable
+        sys.stdout = sys.stderr
+        try:
+            report = profile_startup(models)
+        except ValueError as e:
+            report = {'error': str(e), 'within_budget': False}
+        sys.stdout = sys.__stdout__
+        print_json(report)
+        sys.exit(0 if report['within_budget'] else 1)
+    
+    output = sys.stdout.buffer
+    if args.format == 'binary':
+        # Model libraries print progress to stdout; keep the binary stream clean
+        sys.stdout = sys.stderr
+
+    def emit(result):
+        if args.format == 'binary':
+            write_result(output, result, 'binary')
+        else:
+            print_json(result)
+    
+    if args.action == 'index-add' and args.manifest:
+        # Bulk load: one {"voter_id": ..., "embedding": ..., "embedding_model": ...} object per line
+        try:
+            total = 0
+            # An empty manifest adds nothing and still reports the index
+            result = run_index_job({'action': 'index-add', 'items': [], 'index_dir': args.index_dir})
+            for chunk in chunked(read_manifest(args.manifest), 1024):
+                result = run_index_job({'action': 'index-add', 'items': chunk, 'index_dir': args.index_dir})
+                total += result['added']
+            emit({**result, 'added': total})
+        except JobError as e:
+            emit(e.result)
+            sys.exit(1)
+        return
+    
+    if args.action in ('detect-batch', 'compare-batch') or (args.action == 'recompare' and args.manifest):
+        if not args.manifest:
+            emit({'error': 'Manifest path required for batch actions', 'face_count': 0, 'faces': []})
+            sys.exit(1)
+        try:
+            run_batch_manifest(args.action, args.manifest, args.model, max(1, args.batch_size), emit)
+        except Exception as e:
+            emit({'error': str(e), 'error_type': type(e).__name__, 'model': args.model})
+            sys.exit(1)
+        return
+    
     try:
-        if args.action == 'detect':
-            if not args.image:
-                error_result = {
-                    'error': 'Image path required for detection',
-                    'face_count': 0,
-                    'faces': []
-                }
-                print(json.dumps(error_result))
-                sys.exit(1)
-            
-            # Check if image file exists
-            if not Path(args.image).exists():
-                error_result = {
-                    'error': f'Image file not found: {args.image}',
-                    'face_count': 0,
-                    'faces': []
-                }
-                print(json.dumps(error_result))
-                sys.exit(1)
-            
-            try:
-                detector = get_detector(args.model)
-            except Exception as e:
-                error_result = {
-                    'error': f'Failed to initialize detector: {str(e)}',
-                    'face_count': 0,
-                    'faces': [],
-                    'model': args.model
-                }
-                print(json.dumps(error_result))
-                sys.exit(1)
-            
-            result = detector.detect(args.image)
-            # Ensure result has required fields
-            if 'face_count' not in result:
-                result['face_count'] = len(result.get('faces', []))
-            print(json.dumps(result))
-        
-        elif args.action == 'compare':
-            if not args.id_image or not args.selfie_image:
-                error_result = {
-                    'error': 'Both ID and selfie image paths required',
-                    'face_count': 0,
-                    'faces': []
-                }
-                print(json.dumps(error_result))
-                sys.exit(1)
-            
-            result = compare_faces(args.id_image, args.selfie_image, args.model)
-            print(json.dumps(result))
+        result = run_job({
+            'action': args.action,
+            'model': args.model,
+            'image': args.image,
+            'id_image': args.id_image,
+            'selfie_image': args.selfie_image,
+            'artifact_dir': args.artifact_dir,
+            'artifact_prefix': args.artifact_prefix,
+            'analyze': args.analyze,
+            'detector_backend': args.detector_backend,
+            'voter_id': args.voter_id,
+            'embedding': args.embedding,
+            'embedding_model': args.embedding_model,
+            'top_k': args.top_k,
+            'threshold': args.threshold,
+            'nprobe': args.nprobe,
+            'nlist': args.nlist,
+            'index_dir': args.index_dir,
+            'cache': not args.no_cache,
+            'quantize': args.quantize,
+            'profile': args.profile or None,
+            'trace_memory': args.trace_memory or None,
+        })
+        emit(result)
     
+    except JobError as e:
+        emit(e.result)
+        sys.exit(1)
     except KeyboardInterrupt:
         error_result = {
             'error': 'Process interrupted by user',
             'face_count': 0,
             'faces': []
         }
-        print(json.dumps(error_result))
+        emit(error_result)
         sys.exit(1)
     except Exception as e:
         import traceback
@@ -598,10 +3202,12 @@ def main():
             'faces': [],
             'traceback': traceback.format_exc()
         }
-        print(json.dumps(error_result))
+        emit(error_result)
         sys.exit(1)
 
 
+MODULE_IMPORT_MS = (time.perf_counter() - _IMPORT_START) * 1000
+
+
 if __name__ == '__main__':
     main()
-
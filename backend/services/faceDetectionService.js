@@ -1,8 +1,13 @@
 // Face Detection Service - Node.js wrapper for Python face detection models
 import { spawn } from 'child_process'
+import fs from 'fs/promises'
+import os from 'os'
 import path from 'path'
 import { fileURLToPath } from 'url'
 import { dirname } from 'path'
+import { FaceWorkerSupervisor, decodeResultFrames } from './faceWorkerPool.js'
+import { recordFaceJob } from './metrics.js'
+import { FaceStream } from './faceStream.js'
 
 const __filename = fileURLToPath(import.meta.url)
 const __dirname = dirname(__filename)
@@ -19,6 +24,7 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'ultralytics',
+    backend: 'yolov8',
   },
   'yolov8n-face': {
     name: 'YOLOv8 Nano Face',
@@ -26,6 +32,7 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'ultralytics',
+    backend: 'yolov8',
   },
   'yolov8s-face': {
     name: 'YOLOv8 Small Face',
@@ -33,6 +40,7 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'ultralytics',
+    backend: 'yolov8',
   },
   'deepface': {
     name: 'DeepFace (Recommended)',
@@ -40,6 +48,7 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'deepface',
+    backend: 'deepface',
   },
   'insightface': {
     name: 'InsightFace',
@@ -47,6 +56,7 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'insightface',
+    backend: 'insightface',
   },
   'mediapipe': {
     name: 'MediaPipe Face Detection',
@@ -54,6 +64,23 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'mediapipe',
+    backend: 'mediapipe',
+  },
+  'onnx': {
+    name: 'ONNX Runtime (CPU)',
+    description: 'YOLOv8-face and ArcFace on ONNX Runtime. Fastest on CPU-only servers; models are exported with --action export-onnx.',
+    requiresApiKey: false,
+    requiresPython: true,
+    pythonPackage: 'onnxruntime',
+    backend: 'onnx',
+  },
+  'cascade': {
+    name: 'Cascade (Fast First Pass)',
+    description: 'MediaPipe short-range or Haar first pass; escalates to InsightFace/ONNX/YOLOv8 only when unsure.',
+    requiresApiKey: false,
+    requiresPython: true,
+    pythonPackage: 'mediapipe',
+    backend: 'cascade',
   },
   'auto': {
     name: 'Auto (Best Available)',
@@ -61,23 +88,43 @@ export const FACE_DETECTION_MODELS = {
     requiresApiKey: false,
     requiresPython: true,
     pythonPackage: 'deepface',
+    // Detection; compare and embed pick their backends per stage (see backendFor)
+    backend: 'yolov8',
   },
 }
 
 // Store the working Python command globally
 let WORKING_PYTHON = null
 
+// How long capability probes (and a failed Python lookup) are trusted before checking again
+const FACE_CAPABILITIES_TTL_MS = parseInt(process.env.FACE_CAPABILITIES_TTL_MS || '300000', 10)
+let failedPythonLookup = null
+let capabilitiesCache = null
+
 /**
  * Check if Python is available and has required packages
+ * A successful lookup is kept for the life of the process; a failed one for FACE_CAPABILITIES_TTL_MS,
+ * so requests made while Python is missing don't each spawn interpreters.
  */
 const checkPythonAvailable = () => {
+  if (WORKING_PYTHON) {
+    return Promise.resolve(true)
+  }
+  if (failedPythonLookup && failedPythonLookup.expiresAt > Date.now()) {
+    return failedPythonLookup.promise
+  }
+  
+  const promise = findWorkingPython()
+  // Concurrent callers share the lookup in flight
+  failedPythonLookup = { promise, expiresAt: Infinity }
+  promise.then((found) => {
+    failedPythonLookup = found ? null : { promise, expiresAt: Date.now() + FACE_CAPABILITIES_TTL_MS }
+  })
+  return promise
+}
+
+const findWorkingPython = () => {
   return new Promise((resolve) => {
-    // If we already found a working Python, use it
-    if (WORKING_PYTHON) {
-      resolve(true)
-      return
-    }
-    
     // Try multiple Python commands in order of preference
     // On Windows, also try common Python installation paths
     const pythonCommands = process.platform === 'win32' 
@@ -126,19 +173,6 @@ const checkPythonAvailable = () => {
               WORKING_PYTHON = python
               const pythonPath = importOutput.trim() || python
               console.log(`✅ Found working Python: ${python} at ${pythonPath}`)
-              
-              // Also check if DeepFace is available (optional, but log it)
-              const deepfaceCheck = spawn(python, ['-c', 'import deepface'], {
-                stdio: 'pipe',
-              })
-              deepfaceCheck.on('close', (dfCode) => {
-                if (dfCode === 0) {
-                  console.log(`✅ DeepFace is available in this Python environment`)
-                } else {
-                  console.log(`⚠️ DeepFace not available in this Python (optional)`)
-                }
-              })
-              
               resolve(true)
             } else {
               console.log(`⚠️ Python ${python} found but cannot import cv2/numpy, trying next...`)
@@ -164,73 +198,43 @@ const checkPythonAvailable = () => {
 }
 
 /**
- * Check if required Python package is installed
- * Maps pip package names to their actual import names
+ * Probe installed backends, their versions and model files in one Python call
+ * (`faceDetection.py --action capabilities`). Results are cached for FACE_CAPABILITIES_TTL_MS;
+ * pass { refresh: true } to re-probe. Resolves to null when Python is unavailable.
  */
-const checkPythonPackage = async (packageName) => {
-  return new Promise((resolve) => {
-    // Use the working Python command if available, otherwise try default
-    const python = WORKING_PYTHON || (process.platform === 'win32' ? 'python' : 'python3')
-    
-    // Map pip package names to import names
-    const importNameMap = {
-      'opencv-python': 'cv2',
-      'ultralytics': 'ultralytics',
-      'deepface': 'deepface',
-      'insightface': 'insightface',
-      'mediapipe': 'mediapipe',
-      'numpy': 'numpy',
-      'scipy': 'scipy',
+export const getCapabilities = ({ refresh = false } = {}) => {
+  const now = Date.now()
+  if (!refresh && capabilitiesCache && capabilitiesCache.expiresAt > now) {
+    return capabilitiesCache.promise
+  }
+  
+  const promise = (async () => {
+    if (!(await checkPythonAvailable())) {
+      return null
     }
-    
-    const importName = importNameMap[packageName] || packageName
-    
-    // Use pip show to check if package is installed (more reliable)
-    const check = spawn(python, ['-m', 'pip', 'show', packageName], {
-      stdio: 'pipe',
-    })
-    
-    let stdout = ''
-    let stderr = ''
-    
-    check.stdout.on('data', (data) => {
-      stdout += data.toString()
-    })
-    
-    check.stderr.on('data', (data) => {
-      stderr += data.toString()
-    })
-    
-    check.on('close', (code) => {
-      // pip show returns 0 if package is found
-      if (code === 0 && stdout.includes('Name:')) {
-        resolve(true)
-      } else {
-        // Fallback: try importing the package
-        const importCheck = spawn(python, ['-c', `import ${importName}`], {
-          stdio: 'pipe',
-        })
-        
-        importCheck.on('close', (importCode) => {
-          resolve(importCode === 0)
-        })
-        
-        importCheck.on('error', () => {
-          resolve(false)
-        })
-      }
-    })
-    
-    check.on('error', () => {
-      resolve(false)
-    })
+    const result = await runFaceJob({ action: 'capabilities' }, ['--action', 'capabilities'])
+    if (result.error) {
+      throw new Error(result.error)
+    }
+    return result
+  })().catch((error) => {
+    console.error('Face capability probe failed:', error.message)
+    return null
   })
+  
+  capabilitiesCache = { promise, expiresAt: now + FACE_CAPABILITIES_TTL_MS }
+  return promise
 }
 
+// One-off Python processes currently running; each is told how many share the cores
+let activeScripts = 0
+
 /**
  * Run Python face detection script
+ * Options: input - text written to the script's stdin; jsonLines - parse stdout as one JSON result per line;
+ * format - 'binary' to read `--format binary` result frames (float arrays become Float32Arrays)
  */
-const runPythonScript = (args) => {
+const runPythonScript = (args, { input, jsonLines = false, format = 'json' } = {}) => {
   return new Promise((resolve, reject) => {
     // Use the working Python command if available, otherwise try default
     const python = WORKING_PYTHON || (process.platform === 'win32' ? 'python' : 'python3')
@@ -240,15 +244,33 @@ const runPythonScript = (args) => {
       return
     }
     
+    activeScripts++
     const script = spawn(python, [PYTHON_SCRIPT, ...args], {
       stdio: ['pipe', 'pipe', 'pipe'],
+      env: {
+        ...process.env,
+        FACE_CONCURRENT_JOBS: String(Math.max(activeScripts, parseInt(process.env.FACE_CONCURRENT_JOBS || '1'))),
+      },
     })
+    let running = true
+    const finished = () => {
+      if (running) {
+        running = false
+        activeScripts--
+      }
+    }
+    script.once('close', finished)
+    script.once('error', finished)
     
-    let stdout = ''
+    const stdoutChunks = []
     let stderr = ''
     
+    if (input !== undefined) {
+      script.stdin.end(input)
+    }
+    
     script.stdout.on('data', (data) => {
-      stdout += data.toString()
+      stdoutChunks.push(data)
     })
     
     script.stderr.on('data', (data) => {
@@ -256,6 +278,22 @@ const runPythonScript = (args) => {
     })
     
     script.on('close', (code) => {
+      const stdoutBuffer = Buffer.concat(stdoutChunks)
+      const stdout = stdoutBuffer.toString()
+      
+      if (format === 'binary' && stdoutBuffer.length > 0) {
+        // Binary result frames; errors raised before the format was parsed still arrive as JSON text
+        try {
+          const results = decodeResultFrames(stdoutBuffer)
+          if (results.length > 0) {
+            resolve(jsonLines ? results : results[0])
+            return
+          }
+        } catch {
+          // Fall through to the JSON handling below
+        }
+      }
+      
       if (code === 0) {
         try {
           // Try to parse stdout as JSON
@@ -273,6 +311,8 @@ const runPythonScript = (args) => {
             } else {
               reject(new Error('Python script returned empty output'))
             }
+          } else if (jsonLines) {
+            resolve(output.split('\n').filter(line => line.trim()).map(line => JSON.parse(line)))
           } else {
             const result = JSON.parse(output)
             resolve(result)
@@ -307,10 +347,159 @@ const runPythonScript = (args) => {
   })
 }
 
+// Warm workers for detect/compare calls, one pool per backend (FACE_WORKERS=0 disables them)
+// Every setting below can be overridden per backend, e.g. FACE_WORKERS_DEEPFACE=1
+const FACE_WORKERS = parseInt(process.env.FACE_WORKERS ?? '2')
+const FACE_WORKER_TIMEOUT_MS = parseInt(process.env.FACE_WORKER_TIMEOUT_MS || '120000')
+// Comma-separated models loaded before taking jobs, e.g. "yolov8-face,insightface"; each backend's
+// workers load only their own
+const FACE_WORKER_WARMUP = process.env.FACE_WORKER_WARMUP || ''
+// Resident memory after which a worker is restarted, and idle time after which it exits (0 = never)
+const FACE_WORKER_MAX_RSS_MB = parseInt(process.env.FACE_WORKER_MAX_RSS_MB || '0')
+const FACE_WORKER_IDLE_MS = parseInt(process.env.FACE_WORKER_IDLE_MS || '600000')
+// Memory shared by all backends' workers; idle workers of other backends make room (0 = no limit)
+const FACE_MEMORY_BUDGET_MB = parseInt(process.env.FACE_MEMORY_BUDGET_MB || '0')
+
+// Rough RSS of a worker with one backend loaded (interpreter, OpenCV and NumPy included), used for
+// the memory budget until that backend's first worker reports its real size
+const BACKEND_RSS_ESTIMATES_MB = {
+  yolov8: 700,
+  deepface: 1500,
+  insightface: 600,
+  mediapipe: 250,
+  onnx: 300,
+  cascade: 400,
+  auto: 2500,
+  core: 150,
+}
+
+const backendSetting = (name, backend, fallback) => {
+  const value = process.env[`${name}_${backend.toUpperCase()}`]
+  return value !== undefined && value !== '' ? parseInt(value) : fallback
+}
+
+const workersFor = (backend) => backendSetting('FACE_WORKERS', backend, FACE_WORKERS)
+
+// Unknown models are refused rather than routed to some backend's workers
+const backendOfModel = (model) => {
+  const backend = FACE_DETECTION_MODELS[model]?.backend
+  if (!backend) {
+    throw new Error(`Unknown face detection model: ${model}`)
+  }
+  return backend
+}
+
+let workerSupervisor = null
+
+const getWorkerSupervisor = () => {
+  if (!WORKING_PYTHON) {
+    return null
+  }
+  if (!workerSupervisor) {
+    workerSupervisor = new FaceWorkerSupervisor({
+      python: WORKING_PYTHON,
+      script: PYTHON_SCRIPT,
+      memoryBudgetMb: FACE_MEMORY_BUDGET_MB,
+      poolOptions: (backend) => {
+        const warmup = FACE_WORKER_WARMUP.split(',')
+          .map(model => model.trim())
+          .filter(model => model && backendOfModel(model) === backend)
+        return {
+          size: workersFor(backend),
+          timeoutMs: FACE_WORKER_TIMEOUT_MS,
+          maxRssMb: backendSetting('FACE_WORKER_MAX_RSS_MB', backend, FACE_WORKER_MAX_RSS_MB),
+          idleTimeoutMs: backendSetting('FACE_WORKER_IDLE_MS', backend, FACE_WORKER_IDLE_MS),
+          estimatedRssMb: BACKEND_RSS_ESTIMATES_MB[backend] || 500,
+          args: warmup.length > 0 ? ['--warmup', warmup.join(',')] : [],
+          env: process.env.FACE_CONCURRENT_JOBS ? { FACE_CONCURRENT_JOBS: process.env.FACE_CONCURRENT_JOBS } : {},
+        }
+      },
+    })
+    process.once('exit', () => workerSupervisor.shutdown())
+  }
+  return workerSupervisor
+}
+
+/**
+ * The backend whose workers run a job. Jobs that load no model (capabilities, quality checks, index
+ * jobs given an embedding) share the light 'core' workers. 'auto' embeddings resolve the way faceDetection.py
+ * does; 'auto' comparisons may need every backend, so they get workers of their own ('auto').
+ */
+const backendFor = async (job) => {
+  if (job.action === 'quality' || (!job.model && !job.image)) {
+    return 'core'
+  }
+  const model = job.model || 'auto'
+  if (model !== 'auto') {
+    return backendOfModel(model)
+  }
+  if (job.action === 'compare' || job.action === 'compare-batch') {
+    return 'auto'
+  }
+  if (job.action === 'detect' || job.action === 'detect-batch') {
+    return backendOfModel(model)
+  }
+  const capabilities = await getCapabilities()
+  return capabilities?.packages?.insightface?.installed ? 'insightface' : 'deepface'
+}
+
+/**
+ * Memory and restart figures for every backend's workers, or null before any worker has started
+ */
+export const getFaceWorkerStats = () => workerSupervisor?.stats() ?? null
+
+/**
+ * Time a face job and record its stage timings in the metrics registry
+ */
+const measured = async (job, runner, run) => {
+  const start = performance.now()
+  try {
+    const result = await run()
+    recordFaceJob({ job, result, runner, elapsedMs: performance.now() - start })
+    return result
+  } catch (error) {
+    recordFaceJob({ job, error, runner, elapsedMs: performance.now() - start })
+    throw error
+  }
+}
+
+/**
+ * Run a face job on a warm worker, falling back to a one-off Python process
+ */
+const runFaceJob = async (job, args, options) => {
+  const supervisor = getWorkerSupervisor()
+  const backend = supervisor ? await backendFor(job) : null
+  if (supervisor && workersFor(backend) > 0) {
+    try {
+      return await measured(job, 'worker', () => supervisor.run(backend, job))
+    } catch (error) {
+      console.warn(`⚠️ ${backend} face worker failed, running one-off Python process: ${error.message}`)
+    }
+  }
+  
+  // One-off processes take image paths on the command line; spill in-memory images to temp files
+  const tempFiles = []
+  const fileArgs = await Promise.all(args.map(async (arg) => {
+    if (!Buffer.isBuffer(arg)) return arg
+    const tempFile = path.join(os.tmpdir(), `face-${process.pid}-${Date.now()}-${Math.round(Math.random() * 1e9)}`)
+    tempFiles.push(tempFile)
+    await fs.writeFile(tempFile, arg)
+    return tempFile
+  }))
+  try {
+    return await measured(job, 'process', () => runPythonScript(fileArgs, options))
+  } finally {
+    await Promise.all(tempFiles.map(file => fs.unlink(file).catch(() => {})))
+  }
+}
+
 /**
- * Detect faces in an image
+ * Detect faces in an image, given as a file path or a Buffer of encoded image bytes
+ * With the deepface model, options.analyze lists attributes to estimate per face
+ * (age, gender, race, emotion) and options.detectorBackend picks DeepFace's detector;
+ * without analyze only the detector runs.
  */
-export const detectFaces = async (imagePath, model = 'yolov8-face') => {
+export const detectFaces = async (imagePath, model = 'yolov8-face', options = {}) => {
   try {
     // Validate model
     if (!FACE_DETECTION_MODELS[model]) {
@@ -328,12 +517,22 @@ export const detectFaces = async (imagePath, model = 'yolov8-face') => {
       }
     }
     
+    const analyze = Array.isArray(options.analyze)
+      ? options.analyze
+      : String(options.analyze || '').split(',').map(a => a.trim()).filter(Boolean)
+    const job = { action: 'detect', model, image: imagePath }
+    const args = ['--action', 'detect', '--model', model, '--image', imagePath]
+    if (analyze.length > 0) {
+      job.analyze = analyze
+      args.push('--analyze', analyze.join(','))
+    }
+    if (options.detectorBackend) {
+      job.detector_backend = options.detectorBackend
+      args.push('--detector-backend', options.detectorBackend)
+    }
+    
     // Run detection
-    const result = await runPythonScript([
-      '--action', 'detect',
-      '--model', model,
-      '--image', imagePath,
-    ])
+    const result = await runFaceJob(job, args)
     
     // If result has an error, return it gracefully
     if (result.error) {
@@ -368,8 +567,48 @@ export const detectFaces = async (imagePath, model = 'yolov8-face') => {
   }
 }
 
+const runCompareJob = (idImagePath, selfieImagePath, model) => runFaceJob({
+  action: 'compare',
+  model,
+  id_image: idImagePath,
+  selfie_image: selfieImagePath,
+}, [
+  '--action', 'compare',
+  '--model', model,
+  '--id-image', idImagePath,
+  '--selfie-image', selfieImagePath,
+])
+
+// The stages of compare_faces('auto'). Run in one process they would hold TensorFlow, ONNX Runtime
+// and PyTorch at once; with backend workers each stage runs on its own backend's workers instead.
+const AUTO_COMPARE_STAGES = [
+  // DeepFace's verification must answer; its detector-only fallback is left to the later stages
+  { model: 'deepface', package: 'deepface', answered: result => result.stage === 'deepface' },
+  { model: 'insightface', package: 'insightface', answered: result => !result.error },
+  // compare_faces('auto') falls back to the YOLOv8 nano detector
+  { model: 'yolov8n-face', package: null, answered: () => true },
+]
+
+const compareFacesAcrossBackends = async (idImagePath, selfieImagePath) => {
+  const capabilities = await getCapabilities()
+  const attempts = []
+  let result = null
+  for (const stage of AUTO_COMPARE_STAGES) {
+    if (stage.package && capabilities && !capabilities.packages?.[stage.package]?.installed) {
+      continue
+    }
+    result = await runCompareJob(idImagePath, selfieImagePath, stage.model)
+    attempts.push(...(result.attempts || [stage.model]))
+    if (stage.answered(result)) {
+      break
+    }
+  }
+  return { ...result, attempts }
+}
+
 /**
- * Compare faces between ID and selfie images
+ * Compare faces between ID and selfie images (file paths or Buffers of encoded image bytes)
+ * With warm workers, 'auto' runs each of its stages on that backend's workers
  */
 export const compareFaces = async (idImagePath, selfieImagePath, model = 'yolov8-face') => {
   try {
@@ -384,15 +623,13 @@ export const compareFaces = async (idImagePath, selfieImagePath, model = 'yolov8
       throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
     }
     
-    // Run comparison
-    const result = await runPythonScript([
-      '--action', 'compare',
-      '--model', model,
-      '--id-image', idImagePath,
-      '--selfie-image', selfieImagePath,
-    ])
+    const splitAuto = model === 'auto' &&
+      AUTO_COMPARE_STAGES.some(stage => workersFor(backendOfModel(stage.model)) > 0)
     
-    return result
+    // Run comparison
+    return splitAuto
+      ? await compareFacesAcrossBackends(idImagePath, selfieImagePath)
+      : await runCompareJob(idImagePath, selfieImagePath, model)
   } catch (error) {
     console.error('Face comparison error:', error)
     return {
@@ -407,54 +644,302 @@ export const compareFaces = async (idImagePath, selfieImagePath, model = 'yolov8
 }
 
 /**
- * Check if a face detection model is available
+ * Decode a base64 little-endian float32 embedding (as produced by `--action embed`) into numbers
  */
-export const isModelAvailable = async (model) => {
+export const decodeEmbedding = (base64) => {
+  if (base64 instanceof Float32Array) {
+    // Binary results already carry the raw float32 values
+    return Array.from(base64)
+  }
+  const buffer = Buffer.from(base64, 'base64')
+  const values = new Array(buffer.length / 4)
+  for (let i = 0; i < values.length; i++) {
+    values[i] = buffer.readFloatLE(i * 4)
+  }
+  return values
+}
+
+/**
+ * Extract a face embedding from an image (file path or Buffer)
+ * Returns { embedding, faceHash, confidence, model } for the most confident face, or null if no face was found
+ */
+export const extractFaceEmbedding = async (imagePath, model = 'auto') => {
   if (!FACE_DETECTION_MODELS[model]) {
-    return false
+    throw new Error(`Unknown face detection model: ${model}`)
   }
   
-  const modelInfo = FACE_DETECTION_MODELS[model]
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  const result = await runFaceJob({ action: 'embed', model, image: imagePath, format: 'binary' }, [
+    '--action', 'embed',
+    '--model', model,
+    '--image', imagePath,
+    '--format', 'binary',
+  ], { format: 'binary' })
   
-  // Check Python
+  if (result.error) {
+    throw new Error(result.error)
+  }
+  if (!result.faces || result.faces.length === 0) {
+    return null
+  }
+  
+  const face = result.faces.reduce((best, f) => (f.confidence > best.confidence ? f : best))
+  const embeddingBase64 = face.embedding instanceof Float32Array
+    ? Buffer.from(face.embedding.buffer, face.embedding.byteOffset, face.embedding.byteLength).toString('base64')
+    : face.embedding
+  return {
+    embedding: decodeEmbedding(face.embedding),
+    embeddingBase64,
+    faceHash: face.face_hash,
+    confidence: face.confidence,
+    model: result.model,
+  }
+}
+
+/**
+ * Search the 1:N face index for voters whose stored embedding resembles this one
+ * Returns { matches: [{ id, score }], count, search_ms }
+ */
+export const searchFaceIndex = async (embeddingBase64, embeddingModel, { topK = 5, threshold = null, nprobe = null } = {}) => {
   const pythonAvailable = await checkPythonAvailable()
   if (!pythonAvailable) {
-    return false
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
   }
   
-  // Check Python package
-  if (modelInfo.requiresPython && modelInfo.pythonPackage) {
-    const packageAvailable = await checkPythonPackage(modelInfo.pythonPackage)
-    if (!packageAvailable) {
-      return false
-    }
-    
-    // YOLOv8 models also require opencv-python and numpy
-    if (model === 'yolov8-face' || model.startsWith('yolov8')) {
-      const opencvAvailable = await checkPythonPackage('opencv-python')
-      const numpyAvailable = await checkPythonPackage('numpy')
-      return opencvAvailable && numpyAvailable
-    }
-    
-    // DeepFace also requires opencv-python and numpy
-    if (model === 'deepface' || model.includes('deepface')) {
-      const opencvAvailable = await checkPythonPackage('opencv-python')
-      const numpyAvailable = await checkPythonPackage('numpy')
-      return opencvAvailable && numpyAvailable && packageAvailable
-    }
-    
-    return packageAvailable
+  const args = ['--action', 'search', '--embedding', embeddingBase64, '--top-k', String(topK)]
+  if (embeddingModel) args.push('--embedding-model', embeddingModel)
+  if (threshold !== null) args.push('--threshold', String(threshold))
+  if (nprobe !== null) args.push('--nprobe', String(nprobe))
+  
+  const result = await runFaceJob({
+    action: 'search',
+    embedding: embeddingBase64,
+    embedding_model: embeddingModel,
+    top_k: topK,
+    threshold,
+    nprobe,
+  }, args)
+  
+  if (result.error) {
+    throw new Error(result.error)
+  }
+  return result
+}
+
+/**
+ * Append a voter's embedding to the 1:N face index
+ */
+export const addToFaceIndex = async (voterId, embeddingBase64, embeddingModel) => {
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
   }
   
-  return true
+  const result = await runFaceJob({
+    action: 'index-add',
+    voter_id: voterId,
+    embedding: embeddingBase64,
+    embedding_model: embeddingModel,
+  }, [
+    '--action', 'index-add',
+    '--voter-id', voterId,
+    '--embedding', embeddingBase64,
+    ...(embeddingModel ? ['--embedding-model', embeddingModel] : []),
+  ])
+  
+  if (result.error) {
+    throw new Error(result.error)
+  }
+  return result
+}
+
+/**
+ * Detect faces in many images with batched inference
+ * Returns one result per image, in input order
+ */
+export const detectFacesBatch = async (imagePaths, model = 'yolov8-face', batchSize = 16) => {
+  if (!FACE_DETECTION_MODELS[model]) {
+    throw new Error(`Unknown face detection model: ${model}`)
+  }
+  
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  // Binary results: per-face embeddings arrive as Float32Arrays instead of JSON number lists
+  const result = await runFaceJob(
+    { action: 'detect-batch', model, images: imagePaths, batch_size: batchSize, format: 'binary' },
+    ['--action', 'detect-batch', '--model', model, '--manifest', '-', '--batch-size', String(batchSize), '--format', 'binary'],
+    { input: imagePaths.map(p => JSON.stringify(p)).join('\n'), jsonLines: true, format: 'binary' },
+  )
+  
+  if (!Array.isArray(result) && result.error) {
+    throw new Error(result.error)
+  }
+  return Array.isArray(result) ? result : result.results
+}
+
+/**
+ * Compare many { idImage, selfieImage } pairs in one invocation
+ * Returns one comparison result per pair, in input order
+ */
+export const compareFacesBatch = async (pairs, model = 'insightface', batchSize = 16) => {
+  if (!FACE_DETECTION_MODELS[model]) {
+    throw new Error(`Unknown face detection model: ${model}`)
+  }
+  
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  const manifestPairs = pairs.map(pair => ({ id_image: pair.idImage, selfie_image: pair.selfieImage }))
+  const result = await runFaceJob(
+    { action: 'compare-batch', model, pairs: manifestPairs, batch_size: batchSize },
+    ['--action', 'compare-batch', '--model', model, '--manifest', '-', '--batch-size', String(batchSize)],
+    { input: manifestPairs.map(p => JSON.stringify(p)).join('\n'), jsonLines: true },
+  )
+  
+  if (!Array.isArray(result) && result.error) {
+    throw new Error(result.error)
+  }
+  return Array.isArray(result) ? result : result.results
+}
+
+// Detectors tried for 'auto' face artifacts, landmark-producing ones first (see artifact_model())
+const ARTIFACT_AUTO_MODELS = ['insightface', 'onnx', 'yolov8-face']
+
+/**
+ * Create the face artifacts of a registration: an aligned 112x112 crop of the main face in the ID and
+ * selfie images (file paths or Buffers), written to outputDir as <prefix>-id.png and <prefix>-selfie.png,
+ * with the boxes, landmarks, confidence and detector name/version they came from
+ * model 'auto' (or FACE_ARTIFACT_MODEL) uses the first available of ARTIFACT_AUTO_MODELS
+ */
+export const createFaceArtifacts = async (idImage, selfieImage, { outputDir, prefix, model = process.env.FACE_ARTIFACT_MODEL || 'auto' }) => {
+  if (!FACE_DETECTION_MODELS[model]) {
+    throw new Error(`Unknown face detection model: ${model}`)
+  }
+  
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  if (model === 'auto') {
+    // Resolved here rather than in Python so the job goes to that backend's workers
+    const capabilities = await getCapabilities()
+    model = ARTIFACT_AUTO_MODELS.find(name => capabilities?.models?.[name]) || ARTIFACT_AUTO_MODELS.at(-1)
+  }
+  
+  const result = await runFaceJob({
+    action: 'artifacts',
+    model,
+    id_image: idImage,
+    selfie_image: selfieImage,
+    artifact_dir: outputDir,
+    artifact_prefix: prefix,
+  }, [
+    '--action', 'artifacts',
+    '--model', model,
+    '--id-image', idImage,
+    '--selfie-image', selfieImage,
+    '--artifact-dir', outputDir,
+    '--artifact-prefix', prefix,
+  ])
+  
+  if (result.error) {
+    throw new Error(result.error)
+  }
+  return result
+}
+
+/**
+ * Re-score stored face crops (from createFaceArtifacts) with a recognition model: no detection runs,
+ * only embeddings of the aligned crops. pairs are { voterId, idCrop, selfieCrop } with crop file paths,
+ * plus the stored aligned/detector/cropSize/version metadata; unaligned or incompatible crops are refused.
+ * Returns one { voter_id, similarity, model } (or { error }) per pair, in input order
+ */
+export const recompareFaces = async (pairs, model = 'auto', batchSize = 64) => {
+  if (!FACE_DETECTION_MODELS[model]) {
+    throw new Error(`Unknown face detection model: ${model}`)
+  }
+  
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  const manifestPairs = pairs.map(pair => ({
+    voter_id: pair.voterId,
+    id_image: pair.idCrop,
+    selfie_image: pair.selfieCrop,
+    aligned: pair.aligned,
+    detector: pair.detector,
+    crop_size: pair.cropSize,
+    artifact_version: pair.version,
+  }))
+  const result = await runFaceJob(
+    { action: 'recompare', model, pairs: manifestPairs, batch_size: batchSize },
+    ['--action', 'recompare', '--model', model, '--manifest', '-', '--batch-size', String(batchSize)],
+    { input: manifestPairs.map(p => JSON.stringify(p)).join('\n'), jsonLines: true },
+  )
+  
+  if (!Array.isArray(result) && result.error) {
+    throw new Error(result.error)
+  }
+  return Array.isArray(result) ? result : result.results
+}
+
+/**
+ * Fast quality check of an image before OCR or face models run on it: resolution, blank frames,
+ * exposure, blur and the size of the largest face, measured on a downscaled decode in a few milliseconds.
+ * images is one image (file path or Buffer), giving { usable, score, issues, warnings, messages, metrics },
+ * or { id, selfie } images, giving { usable, id_image: {...}, selfie_image: {...} }
+ */
+export const assessImageQuality = async (images) => {
+  const pythonAvailable = await checkPythonAvailable()
+  if (!pythonAvailable) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  const single = typeof images === 'string' || Buffer.isBuffer(images)
+  const job = single
+    ? { action: 'quality', image: images }
+    : { action: 'quality', id_image: images.id, selfie_image: images.selfie }
+  const args = single
+    ? ['--action', 'quality', '--image', images]
+    : ['--action', 'quality', '--id-image', images.id, '--selfie-image', images.selfie]
+  const result = await runFaceJob(job, args)
+  
+  if (result.error) {
+    throw new Error(result.error)
+  }
+  return result
+}
+
+/**
+ * Check if a face detection model is available
+ */
+export const isModelAvailable = async (model) => {
+  if (!FACE_DETECTION_MODELS[model]) {
+    return false
+  }
+  
+  const capabilities = await getCapabilities()
+  return Boolean(capabilities?.models?.[model])
 }
 
 /**
  * Get available face detection models
  * Filters out duplicate YOLOv8 variants and only shows the main one
  */
-export const getAvailableModels = async () => {
-  const pythonAvailable = await checkPythonAvailable()
+export const getAvailableModels = async ({ refresh = false } = {}) => {
+  const capabilities = await getCapabilities({ refresh })
   
   // Filter models - only show main YOLOv8 model, hide variants unless specifically needed
   const modelsToShow = Object.entries(FACE_DETECTION_MODELS)
@@ -474,22 +959,11 @@ export const getAvailableModels = async () => {
       requiresPython: info.requiresPython,
     }))
   
-  // Check availability for each model
-  const availableModels = []
-  for (const model of modelsToShow) {
-    if (pythonAvailable) {
-      const available = await isModelAvailable(model.id)
-      availableModels.push({
-        ...model,
-        isAvailable: available,
-      })
-    } else {
-      availableModels.push({
-        ...model,
-        isAvailable: false,
-      })
-    }
-  }
+  // Availability of every model comes from the one cached capability probe
+  const availableModels = modelsToShow.map(model => ({
+    ...model,
+    isAvailable: Boolean(capabilities?.models?.[model.id]),
+  }))
   
   // Sort models: available first, then by name
   availableModels.sort((a, b) => {
@@ -501,11 +975,45 @@ export const getAvailableModels = async () => {
   return availableModels
 }
 
+/**
+ * Open a live face tracking stream for a camera: push() encoded frames and get per-frame boxes back
+ * The detector runs every keyframeInterval frames (or when a track is lost) and faces are tracked
+ * in between, so frames are answered at camera rate on CPU. close() the stream when done.
+ */
+export const openFaceStream = async (model = 'mediapipe', { keyframeInterval = null } = {}) => {
+  if (!FACE_DETECTION_MODELS[model]) {
+    throw new Error(`Unknown face detection model: ${model}`)
+  }
+  if (!(await checkPythonAvailable())) {
+    throw new Error('Python is not available. Please install Python 3.8+ to use face detection models.')
+  }
+  
+  const stream = new FaceStream({ python: WORKING_PYTHON, script: PYTHON_SCRIPT, model, keyframeInterval })
+  try {
+    await stream.ready()
+  } catch (error) {
+    stream.close()
+    throw error
+  }
+  return stream
+}
+
 export default {
   detectFaces,
   compareFaces,
+  detectFacesBatch,
+  compareFacesBatch,
+  createFaceArtifacts,
+  recompareFaces,
+  assessImageQuality,
+  extractFaceEmbedding,
+  searchFaceIndex,
+  addToFaceIndex,
   isModelAvailable,
   getAvailableModels,
+  getCapabilities,
+  getFaceWorkerStats,
+  openFaceStream,
   FACE_DETECTION_MODELS,
 }
 
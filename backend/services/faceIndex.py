@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Face Search Index
+Append-only, memory-mapped matrix of normalized face embeddings for 1:N duplicate screening
+"""
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are serialized by the single Node process instead
+    fcntl = None
+
+
+DEFAULT_INDEX_DIR = Path(__file__).resolve().parent.parent / 'face_index'
+
+# Rows scored per matrix multiply; keeps peak memory bounded on very large indexes
+SEARCH_CHUNK_ROWS = 65536
+
+
+def default_index_dir():
+    return Path(os.environ.get('FACE_INDEX_DIR') or DEFAULT_INDEX_DIR)
+
+
+class FaceIndex:
+    """
+    On-disk face index.
+    - embeddings.f32: row-major little-endian float32 matrix, one L2-normalized embedding per row
+    - ids.txt: one item id (voter id) per row
+    - meta.json: embedding dimension and the model that produced the embeddings
+    - ivf_centroids.npy / ivf_assign.i32: optional IVF partitioning built by train_ivf()
+    """
+
+    def __init__(self, index_dir=None):
+        self.index_dir = Path(index_dir or default_index_dir())
+        self.embeddings_path = self.index_dir / 'embeddings.f32'
+        self.ids_path = self.index_dir / 'ids.txt'
+        self.meta_path = self.index_dir / 'meta.json'
+        self.centroids_path = self.index_dir / 'ivf_centroids.npy'
+        self.assign_path = self.index_dir / 'ivf_assign.i32'
+        self.meta = self._load_meta()
+        self._ids = None
+        self._ids_mtime = None
+
+    def _load_meta(self):
+        if self.meta_path.exists():
+            with open(self.meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_meta(self):
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across worker processes"""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.index_dir / '.lock', 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def dim(self):
+        return self.meta.get('dim')
+
+    def count(self):
+        """Number of complete rows on disk"""
+        if not self.dim or not self.embeddings_path.exists():
+            return 0
+        return self.embeddings_path.stat().st_size // (self.dim * 4)
+
+    def ids(self):
+        """Item ids by row, reloaded when another process has appended"""
+        if not self.ids_path.exists():
+            return []
+        mtime = self.ids_path.stat().st_mtime_ns
+        if self._ids is None or mtime != self._ids_mtime:
+            with open(self.ids_path, encoding='utf-8') as f:
+                self._ids = f.read().splitlines()
+            self._ids_mtime = mtime
+        return self._ids
+
+    def matrix(self):
+        """Memory-mapped (count, dim) view of the stored embeddings"""
+        count = self.count()
+        if count == 0:
+            return np.zeros((0, self.dim or 0), dtype='<f4')
+        return np.memmap(self.embeddings_path, dtype='<f4', mode='r', shape=(count, self.dim))
+
+    def _check_model(self, dim, model):
+        if self.dim and self.dim != dim:
+            raise ValueError(f'Embedding dimension {dim} does not match index dimension {self.dim}')
+        if model and self.meta.get('model') and self.meta['model'] != model:
+            raise ValueError(f"Embeddings from '{model}' cannot be compared with index built from '{self.meta['model']}'")
+
+    def _repair(self):
+        """
+        Cut embeddings.f32, ids.txt and ivf_assign.i32 back to the rows present in all of them, so an
+        append interrupted between the files cannot shift later ids onto other voters' vectors.
+        Called with the lock held; returns the number of intact rows.
+        """
+        ids_text = self.ids_path.read_text(encoding='utf-8') if self.ids_path.exists() else ''
+        ids = ids_text.split('\n')[:-1]  # A trailing fragment without its newline was never completed
+        rows = min(self.count(), len(ids))
+
+        if self.embeddings_path.exists() and self.embeddings_path.stat().st_size != rows * self.dim * 4:
+            with open(self.embeddings_path, 'r+b') as f:
+                f.truncate(rows * self.dim * 4)
+        if len(ids_text) != sum(len(item_id) + 1 for item_id in ids[:rows]):
+            tmp_path = self.ids_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+                f.writelines(f'{item_id}\n' for item_id in ids[:rows])
+            os.replace(tmp_path, self.ids_path)
+
+        if self.centroids_path.exists():
+            assigned = self.assign_path.stat().st_size // 4 if self.assign_path.exists() else 0
+            if assigned != rows:
+                # Rows whose partition was never written are assigned again
+                keep = min(assigned, rows)
+                missing = np.asarray(self.matrix()[keep:rows])
+                assignments = np.argmax(missing @ np.load(self.centroids_path).T, axis=1).astype('<i4')
+                with open(self.assign_path, 'r+b' if self.assign_path.exists() else 'wb') as f:
+                    f.truncate(keep * 4)
+                    f.seek(keep * 4)
+                    f.write(assignments.tobytes())
+        return rows
+
+    def add(self, items, model=None):
+        """Append (item_id, embedding) pairs. Returns the row number of the first appended item."""
+        items = list(items)
+        if not items:
+            return self.count()
+
+        vectors = np.stack([np.asarray(embedding, dtype=np.float32) for _, embedding in items])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.where(norms > 0, norms, 1.0)).astype('<f4')
+
+        with self._locked():
+            self.meta = self._load_meta()
+            self._check_model(vectors.shape[1], model)
+            if not self.dim:
+                self.meta.update({'dim': int(vectors.shape[1]), 'model': model})
+                self._save_meta()
+
+            # Drop whatever an interrupted append left in some of the files but not the others
+            first_row = self._repair()
+            with open(self.embeddings_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.ids_path, 'a', encoding='utf-8', newline='\n') as f:
+                f.writelines(f'{item_id}\n' for item_id, _ in items)
+
+            if self.centroids_path.exists():
+                centroids = np.load(self.centroids_path)
+                assignments = np.argmax(vectors @ centroids.T, axis=1).astype('<i4')
+                with open(self.assign_path, 'ab') as f:
+                    f.write(assignments.tobytes())
+
+        return first_row
+
+    def search(self, embedding, k=5, threshold=None, nprobe=None, model=None):
+        """
+        Top-k most similar stored embeddings by cosine similarity.
+        With an IVF partition and nprobe set, only rows in the nprobe closest partitions are scored.
+        """
+        start = time.perf_counter()
+        if not self.meta:
+            # Another worker may have created the index since this one was opened
+            self.meta = self._load_meta()
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        self._check_model(query.shape[0], model)
+
+        matrix = self.matrix()
+        ids = self.ids()
+        count = min(matrix.shape[0], len(ids))
+        scanned = count
+
+        if count == 0:
+            scores, rows = np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        elif nprobe and self.centroids_path.exists() and self.assign_path.exists():
+            centroids = np.load(self.centroids_path)
+            probe = np.argsort(-(centroids @ query))[:nprobe]
+            assignments = np.fromfile(self.assign_path, dtype='<i4')[:count]
+            candidates = np.flatnonzero(np.isin(assignments, probe))
+            scanned = len(candidates)
+            candidate_scores = matrix[candidates] @ query if scanned else np.zeros(0, dtype=np.float32)
+            scores, rows = self._top_k(candidate_scores, k)
+            rows = candidates[rows]
+        else:
+            best_scores = []
+            best_rows = []
+            for chunk_start in range(0, count, SEARCH_CHUNK_ROWS):
+                chunk = matrix[chunk_start:min(count, chunk_start + SEARCH_CHUNK_ROWS)]
+                chunk_scores, chunk_rows = self._top_k(chunk @ query, k)
+                best_scores.append(chunk_scores)
+                best_rows.append(chunk_rows + chunk_start)
+            scores, order = self._top_k(np.concatenate(best_scores), k)
+            rows = np.concatenate(best_rows)[order]
+
+        matches = [
+            {'id': ids[row], 'row': int(row), 'score': float(score)}
+            for score, row in zip(scores, rows)
+            if threshold is None or score >= threshold
+        ]
+        return {
+            'matches': matches,
+            'count': count,
+            'scanned': int(scanned),
+            'search_ms': round((time.perf_counter() - start) * 1000, 3)
+        }
+
+    @staticmethod
+    def _top_k(scores, k):
+        """Indices of the k largest scores, best first"""
+        if len(scores) <= k:
+            order = np.argsort(-scores)
+        else:
+            part = np.argpartition(-scores, k)[:k]
+            order = part[np.argsort(-scores[part])]
+        return scores[order], order
+
+    def train_ivf(self, nlist=None, iterations=10, sample_size=100000, seed=0):
+        """Partition stored embeddings with spherical k-means so searches can probe a few partitions"""
+        with self._locked():
+            matrix = self.matrix()
+            count = matrix.shape[0]
+            if count == 0:
+                raise ValueError('Cannot train IVF partitions on an empty index')
+
+            nlist = int(nlist or max(1, int(np.sqrt(count))))
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(matrix[np.sort(rng.choice(count, min(count, sample_size), replace=False))])
+            nlist = min(nlist, len(sample))
+
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroid = members.sum(axis=0)
+                        centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+            assignments = np.empty(count, dtype='<i4')
+            for chunk_start in range(0, count, SEARCH_CHUNK_ROWS):
+                chunk = matrix[chunk_start:chunk_start + SEARCH_CHUNK_ROWS]
+                assignments[chunk_start:chunk_start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+
+            np.save(self.centroids_path, centroids.astype(np.float32))
+            assignments.tofile(self.assign_path)
+
+        print(f"Trained IVF index with {nlist} partitions over {count} embeddings", file=sys.stderr)
+        return {'nlist': nlist, 'count': count}
+
+    def stats(self):
+        return {
+            'index_dir': str(self.index_dir),
+            'count': min(self.count(), len(self.ids())),
+            'dim': self.dim,
+            'model': self.meta.get('model'),
+            'ivf': self.centroids_path.exists()
+        }
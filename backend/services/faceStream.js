@@ -0,0 +1,131 @@
+// Face Stream - live face tracking over `faceDetection.py --action stream`
+// Each stream owns one Python process holding the detector and that camera's face tracks.
+// Frames go in as 'B' frames; each is answered, in order, by one JSON frame of boxes. The detector
+// only runs on keyframes, so tracked frames come back in a few milliseconds.
+
+import { spawn } from 'child_process'
+import { EventEmitter } from 'events'
+import { FrameReader, encodeFrame, FRAME_BYTES, FRAME_JSON } from './faceWorkerPool.js'
+
+// Frames awaiting boxes before new frames are dropped, so a slow keyframe never builds up latency
+const FACE_STREAM_MAX_PENDING = parseInt(process.env.FACE_STREAM_MAX_PENDING || '2')
+
+export class FaceStream extends EventEmitter {
+  constructor({ python, script, model, keyframeInterval = null, maxPending = FACE_STREAM_MAX_PENDING }) {
+    super()
+    this.model = model
+    this.maxPending = Math.max(1, maxPending)
+    this.pending = []
+    this.closed = false
+    this.exited = false
+    this.frames = { sent: 0, dropped: 0 }
+
+    const args = [script, '--action', 'stream', '--model', model]
+    if (keyframeInterval) {
+      args.push('--keyframe-interval', String(keyframeInterval))
+    }
+    this.proc = spawn(python, args, {
+      stdio: ['pipe', 'pipe', 'pipe'],
+      // One stream is one camera; a single inference thread keeps several streams from contending
+      env: { ...process.env, FACE_CONCURRENT_JOBS: process.env.FACE_CONCURRENT_JOBS || '1' },
+    })
+
+    this.readyPromise = new Promise((resolve, reject) => {
+      this.resolveReady = resolve
+      this.rejectReady = reject
+    })
+    this.readyPromise.catch(() => {})
+
+    this.reader = new FrameReader((type, payload) => this.handleFrame(type, payload))
+    this.proc.stdin.on('error', () => {}) // Exit is reported through 'close'
+    this.proc.stdout.on('data', (data) => this.reader.push(data))
+    this.proc.stderr.on('data', (data) => {
+      if (process.env.FACE_WORKER_DEBUG) {
+        process.stderr.write(`[face-stream ${this.proc.pid}] ${data}`)
+      }
+    })
+    this.proc.on('error', (error) => this.handleExit(error))
+    this.proc.on('close', (code) => this.handleExit(new Error(`Face stream exited with code ${code}`)))
+  }
+
+  handleFrame(type, payload) {
+    if (type !== FRAME_JSON) return
+    let message
+    try {
+      message = JSON.parse(payload.toString('utf8'))
+    } catch (error) {
+      this.pending.shift()?.reject(new Error(`Failed to parse face stream output: ${error.message}`))
+      return
+    }
+
+    if (message.ready) {
+      this.info = message
+      this.resolveReady(this)
+      return
+    }
+    if (!this.info) {
+      // Start-up failure (e.g. the detector could not be loaded)
+      this.rejectReady(new Error(message.error || 'Face stream failed to start'))
+      return
+    }
+
+    const waiter = this.pending.shift()
+    if (waiter) waiter.resolve(message)
+    this.emit('result', message)
+  }
+
+  handleExit(error) {
+    if (this.exited) return
+    this.exited = true
+    this.closed = true
+    this.rejectReady(error)
+    this.pending.splice(0).forEach(({ reject }) => reject(error))
+    this.emit('close')
+  }
+
+  /**
+   * Resolves once the detector is loaded and frames are being answered
+   */
+  ready() {
+    return this.readyPromise
+  }
+
+  /**
+   * Send one encoded frame (JPEG/PNG Buffer). Resolves with its boxes:
+   * { frame, keyframe, face_count, faces, timings_ms }, or { dropped: true } when maxPending
+   * frames are still being processed.
+   */
+  push(frame) {
+    if (this.closed) {
+      return Promise.reject(new Error('Face stream is closed'))
+    }
+    if (this.pending.length >= this.maxPending) {
+      this.frames.dropped++
+      return Promise.resolve({ dropped: true, face_count: 0, faces: [], model: this.model })
+    }
+    this.frames.sent++
+    return new Promise((resolve, reject) => {
+      this.pending.push({ resolve, reject })
+      this.proc.stdin.write(encodeFrame(FRAME_BYTES, frame))
+    })
+  }
+
+  /**
+   * Forget the current face tracks; the next frame runs the detector
+   */
+  reset() {
+    if (!this.closed) {
+      this.proc.stdin.write(encodeFrame(FRAME_JSON, Buffer.from(JSON.stringify({ reset: true }))))
+    }
+  }
+
+  close() {
+    if (this.closed) return
+    this.closed = true
+    this.proc.stdin.end()
+    // Let the frames in flight finish, then make sure the process is gone
+    setTimeout(() => this.proc.kill(), 5000).unref()
+  }
+}
+
+export default FaceStream
@@ -0,0 +1,502 @@
+// Face Worker Pool - keeps long-lived `faceDetection.py --serve` processes warm
+// Jobs are exchanged over stdin/stdout using length-prefixed frames:
+// 4-byte big-endian payload length, 1-byte frame type ('J' = JSON, 'B' = image bytes), payload
+// Job fields holding a Buffer are sent as 'B' frames right after the job's JSON frame,
+// which lists their field names in `blobs`, so uploads never touch the disk.
+// Jobs with format: 'binary' are answered with an 'R' frame (see decodeResultPayload).
+// Every answer also reports the worker's resident memory, which the pool uses to restart workers
+// that outgrow maxRssMb; FaceWorkerSupervisor runs one pool per backend within a memory budget.
+
+import { spawn } from 'child_process'
+
+const FRAME_HEADER_SIZE = 5
+export const FRAME_JSON = 'J'.charCodeAt(0)
+export const FRAME_BYTES = 'B'.charCodeAt(0)
+export const FRAME_RESULT = 'R'.charCodeAt(0)
+
+/**
+ * Encode a JSON job as a protocol frame
+ */
+export const encodeFrame = (type, payload) => {
+  const header = Buffer.alloc(FRAME_HEADER_SIZE)
+  header.writeUInt32BE(payload.length, 0)
+  header.writeUInt8(type, 4)
+  return Buffer.concat([header, payload])
+}
+
+/**
+ * Decode a binary result payload: 4-byte big-endian header length, JSON header padded to a
+ * 4-byte boundary, then raw little-endian float32 data. Header values of the form
+ * { $f32: byteOffset, shape } become Float32Arrays over that data.
+ */
+export const decodeResultPayload = (payload) => {
+  const headerLength = payload.readUInt32BE(0)
+  const header = payload.toString('utf8', 4, 4 + headerLength)
+  const dataStart = 4 + headerLength + ((4 - ((4 + headerLength) % 4)) % 4)
+  // One aligned copy of the float data; every array is a view into it
+  const data = new Uint8Array(payload.subarray(dataStart)).buffer
+  
+  return JSON.parse(header, (key, value) => {
+    if (value && typeof value === 'object' && '$f32' in value) {
+      const length = value.shape.reduce((total, dim) => total * dim, 1)
+      return new Float32Array(data, value.$f32, length)
+    }
+    return value
+  })
+}
+
+/**
+ * Decode a buffer holding a sequence of result frames (one-off `--format binary` output)
+ */
+export const decodeResultFrames = (buffer) => {
+  const results = []
+  let offset = 0
+  while (offset + FRAME_HEADER_SIZE <= buffer.length) {
+    const length = buffer.readUInt32BE(offset)
+    const type = buffer.readUInt8(offset + 4)
+    const payload = buffer.subarray(offset + FRAME_HEADER_SIZE, offset + FRAME_HEADER_SIZE + length)
+    if (payload.length < length) {
+      throw new Error('Truncated face detection result frame')
+    }
+    results.push(type === FRAME_RESULT ? decodeResultPayload(payload) : JSON.parse(payload.toString('utf8')))
+    offset += FRAME_HEADER_SIZE + length
+  }
+  return results
+}
+
+/**
+ * Splits a byte stream into protocol frames, calling onFrame(type, payload) for each complete one
+ */
+export class FrameReader {
+  constructor(onFrame) {
+    this.buffer = Buffer.alloc(0)
+    this.onFrame = onFrame
+  }
+
+  push(data) {
+    this.buffer = Buffer.concat([this.buffer, data])
+
+    while (this.buffer.length >= FRAME_HEADER_SIZE) {
+      const length = this.buffer.readUInt32BE(0)
+      if (this.buffer.length < FRAME_HEADER_SIZE + length) break
+
+      const type = this.buffer.readUInt8(4)
+      const payload = this.buffer.subarray(FRAME_HEADER_SIZE, FRAME_HEADER_SIZE + length)
+      this.buffer = this.buffer.subarray(FRAME_HEADER_SIZE + length)
+      this.onFrame(type, payload)
+    }
+  }
+}
+
+/**
+ * A single Python worker process
+ */
+class FaceWorker {
+  constructor(python, script, args, env, onExit) {
+    this.reader = new FrameReader((type, payload) => this.handleFrame(type, payload))
+    this.ready = false
+    this.wasReady = false
+    this.current = null
+    this.readyWaiters = []
+    this.exited = false
+    this.retiring = false
+    this.formats = ['json']
+    this.rssMb = null
+    this.jobs = 0
+    this.idleSince = null
+    this.idleTimer = null
+
+    this.proc = spawn(python, [script, '--serve', ...args], {
+      stdio: ['pipe', 'pipe', 'pipe'],
+      env: { ...process.env, ...env },
+    })
+
+    this.proc.stdin.on('error', () => {}) // Exit is reported through 'close'
+    this.proc.stdout.on('data', (data) => this.reader.push(data))
+    this.proc.stderr.on('data', (data) => {
+      // Worker logs go to stderr; surface them only when debugging
+      if (process.env.FACE_WORKER_DEBUG) {
+        process.stderr.write(`[face-worker ${this.proc.pid}] ${data}`)
+      }
+    })
+    this.proc.on('error', (error) => this.handleExit(error))
+    this.proc.on('close', (code) => this.handleExit(new Error(`Face worker exited with code ${code}`)))
+    this.onExit = onExit
+  }
+
+  handleFrame(type, payload) {
+    if (type !== FRAME_JSON && type !== FRAME_RESULT) {
+      this.failCurrent(new Error(`Unexpected frame type from face worker: ${type}`))
+      return
+    }
+
+    let message
+    try {
+      message = type === FRAME_RESULT ? decodeResultPayload(payload) : JSON.parse(payload.toString('utf8'))
+    } catch (error) {
+      this.failCurrent(new Error(`Failed to parse face worker output: ${error.message}`))
+      return
+    }
+
+    if (message.rss_mb !== undefined) {
+      this.rssMb = message.rss_mb
+      delete message.rss_mb
+    }
+
+    if (message.ready) {
+      this.ready = true
+      this.wasReady = true
+      this.formats = message.formats || ['json']
+      this.readyWaiters.splice(0).forEach(({ resolve }) => resolve(this))
+      return
+    }
+
+    const current = this.current
+    if (current && message.id === current.id) {
+      clearTimeout(current.timer)
+      this.current = null
+      this.jobs++
+      delete message.id
+      current.resolve(message)
+    }
+  }
+
+  failCurrent(error) {
+    const current = this.current
+    if (current) {
+      clearTimeout(current.timer)
+      this.current = null
+      current.reject(error)
+    }
+  }
+
+  handleExit(error) {
+    if (this.exited) return
+    this.exited = true
+    this.ready = false
+    this.readyWaiters.splice(0).forEach(({ reject }) => reject(error))
+    this.failCurrent(error)
+    this.onExit(this)
+  }
+
+  waitUntilReady() {
+    if (this.ready) return Promise.resolve(this)
+    if (this.exited) return Promise.reject(new Error('Face worker has exited'))
+    return new Promise((resolve, reject) => this.readyWaiters.push({ resolve, reject }))
+  }
+
+  send(job, timeoutMs) {
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.failCurrent(new Error(`Face worker timed out after ${timeoutMs}ms`))
+        this.kill()
+      }, timeoutMs)
+
+      this.current = { id: job.id, resolve, reject, timer }
+      const blobs = Object.keys(job).filter(key => Buffer.isBuffer(job[key]))
+      const header = { ...job }
+      blobs.forEach(key => delete header[key])
+      if (header.format && !this.formats.includes(header.format)) {
+        // Older worker script: fall back to JSON results
+        delete header.format
+      }
+      if (blobs.length > 0) {
+        header.blobs = blobs
+      }
+      this.proc.stdin.write(encodeFrame(FRAME_JSON, Buffer.from(JSON.stringify(header))))
+      blobs.forEach(key => this.proc.stdin.write(encodeFrame(FRAME_BYTES, job[key])))
+    })
+  }
+
+  /**
+   * Let the worker finish and exit by closing its stdin; kill it if it has not gone within 5s
+   */
+  retire() {
+    if (this.exited || this.retiring) return
+    this.retiring = true
+    this.proc.stdin.end()
+    setTimeout(() => this.kill(), 5000).unref()
+  }
+
+  kill() {
+    if (!this.exited) {
+      this.proc.kill()
+    }
+  }
+}
+
+/**
+ * Pool of warm face detection workers
+ * Each worker handles one job at a time; extra jobs wait in a FIFO queue.
+ * A worker whose resident memory exceeds maxRssMb after a job is restarted, and one left idle for
+ * idleTimeoutMs exits so its models' memory goes back to the OS (0 disables either).
+ * admit(pool) may refuse to start another worker while the pool already has one (memory budget);
+ * onRelease() is called whenever a worker frees up or exits.
+ */
+export class FaceWorkerPool {
+  constructor({
+    python, script, name = 'default', size = 2, timeoutMs = 120000, args = [], env = {},
+    maxRssMb = 0, idleTimeoutMs = 0, estimatedRssMb = 0, admit = null, onRelease = null,
+  }) {
+    this.python = python
+    this.script = script
+    this.name = name
+    this.size = Math.max(1, size)
+    this.timeoutMs = timeoutMs
+    this.args = args
+    // Workers split the machine's cores between them (see thread_budget() in faceDetection.py)
+    this.env = { FACE_CONCURRENT_JOBS: String(this.size), ...env }
+    this.maxRssMb = maxRssMb
+    this.idleTimeoutMs = idleTimeoutMs
+    this.estimatedRssMb = estimatedRssMb
+    this.admit = admit
+    this.onRelease = onRelease
+    this.workers = []
+    this.idle = []
+    this.queue = []
+    this.nextId = 1
+    this.peakRssMb = 0
+    this.lastUsed = 0
+    this.restarts = { memory: 0, crash: 0 }
+    this.unloaded = 0
+  }
+
+  spawnWorker() {
+    const worker = new FaceWorker(this.python, this.script, this.args, this.env, (exited) => {
+      this.workers = this.workers.filter(w => w !== exited)
+      this.forgetIdle(exited)
+      if (!exited.wasReady) {
+        // The worker never started (missing Python/packages); don't respawn in a loop
+        this.queue.splice(0).forEach(({ reject }) => reject(new Error('Face worker failed to start')))
+        this.onRelease?.()
+        return
+      }
+      if (!exited.retiring) {
+        this.restarts.crash++
+      }
+      // Keep queued jobs moving on a replacement worker
+      this.dispatch()
+      this.onRelease?.()
+    })
+    this.workers.push(worker)
+    worker.waitUntilReady()
+      .then(() => {
+        this.observeRss(worker)
+        this.makeIdle(worker)
+        this.dispatch()
+      })
+      .catch(() => {})
+    return worker
+  }
+
+  observeRss(worker) {
+    if (worker.rssMb > this.peakRssMb) {
+      this.peakRssMb = worker.rssMb
+    }
+  }
+
+  makeIdle(worker) {
+    worker.idleSince = Date.now()
+    this.idle.push(worker)
+    if (this.idleTimeoutMs > 0) {
+      worker.idleTimer = setTimeout(() => {
+        this.unloaded++
+        this.retire(worker)
+      }, this.idleTimeoutMs)
+      worker.idleTimer.unref()
+    }
+  }
+
+  forgetIdle(worker) {
+    clearTimeout(worker.idleTimer)
+    worker.idleTimer = null
+    this.idle = this.idle.filter(w => w !== worker)
+  }
+
+  /**
+   * Stop handing jobs to a worker and let it exit; its slot is free for a replacement at once
+   */
+  retire(worker) {
+    this.forgetIdle(worker)
+    this.workers = this.workers.filter(w => w !== worker)
+    worker.retire()
+  }
+
+  // After a job: restart a worker that has outgrown its memory ceiling, otherwise reuse it
+  release(worker) {
+    // A worker killed for timing out is on its way out
+    if (worker.exited || worker.proc.killed) return
+    this.observeRss(worker)
+    if (this.maxRssMb > 0 && worker.rssMb > this.maxRssMb) {
+      console.warn(`♻️ ${this.name} face worker ${worker.proc.pid} uses ${Math.round(worker.rssMb)}MB ` +
+        `(limit ${this.maxRssMb}MB) after ${worker.jobs} jobs; restarting it`)
+      this.restarts.memory++
+      this.retire(worker)
+      return
+    }
+    this.makeIdle(worker)
+  }
+
+  /**
+   * Memory held by the pool's live workers: their last reported RSS, or an estimate while starting
+   */
+  memoryMb() {
+    return this.workers.reduce((total, worker) => total + (worker.rssMb ?? this.expectedRssMb()), 0)
+  }
+
+  // What another worker is likely to need: the largest RSS seen in this pool so far, else the estimate
+  expectedRssMb() {
+    return this.peakRssMb || this.estimatedRssMb
+  }
+
+  dispatch() {
+    while (this.queue.length > 0) {
+      const worker = this.idle.shift()
+      if (!worker) {
+        // Start enough workers for the backlog, up to the pool size (and whatever admit() allows)
+        let starting = this.workers.filter(w => !w.ready).length
+        while (this.workers.length < this.size && starting < this.queue.length) {
+          if (this.admit && !this.admit(this) && this.workers.length > 0) break
+          this.spawnWorker()
+          starting++
+        }
+        return
+      }
+
+      this.forgetIdle(worker)
+      this.lastUsed = Date.now()
+      const { job, resolve, reject } = this.queue.shift()
+      worker.send(job, this.timeoutMs)
+        .then(resolve, reject)
+        .finally(() => {
+          this.release(worker)
+          this.dispatch()
+          this.onRelease?.()
+        })
+    }
+  }
+
+  /**
+   * Run a job ({ action, model, ... }) on the next free worker
+   * Image fields may be file paths or Buffers of encoded image bytes
+   * With format: 'binary', float arrays in the result (embeddings, boxes) arrive as Float32Arrays
+   */
+  run(job) {
+    return new Promise((resolve, reject) => {
+      this.queue.push({ job: { ...job, id: this.nextId++ }, resolve, reject })
+      this.dispatch()
+    })
+  }
+
+  stats() {
+    return {
+      size: this.size,
+      queued: this.queue.length,
+      maxRssMb: this.maxRssMb || null,
+      idleTimeoutMs: this.idleTimeoutMs || null,
+      memoryMb: Math.round(this.memoryMb()),
+      peakRssMb: this.peakRssMb || null,
+      restarts: { ...this.restarts },
+      unloaded: this.unloaded,
+      workers: this.workers.map(worker => ({
+        pid: worker.proc.pid,
+        state: !worker.ready ? 'starting' : this.idle.includes(worker) ? 'idle' : 'busy',
+        rssMb: worker.rssMb,
+        jobs: worker.jobs,
+      })),
+    }
+  }
+
+  shutdown() {
+    this.queue.splice(0).forEach(({ reject }) => reject(new Error('Face worker pool shut down')))
+    this.workers.forEach(worker => worker.kill())
+  }
+}
+
+/**
+ * One FaceWorkerPool per backend, so TensorFlow (DeepFace), PyTorch (YOLOv8) and ONNX Runtime
+ * (InsightFace, ONNX) never share a process. Pools are created on first use with poolOptions(backend).
+ * With memoryBudgetMb set, a pool may only start a worker when the memory of all workers plus what the
+ * new one is expected to need fits the budget; idle workers of other backends, least recently used
+ * first, are retired to make room. A pool with no workers always gets one, so no backend starves.
+ */
+export class FaceWorkerSupervisor {
+  constructor({ python, script, memoryBudgetMb = 0, poolOptions = () => ({}) }) {
+    this.python = python
+    this.script = script
+    this.memoryBudgetMb = memoryBudgetMb
+    this.poolOptions = poolOptions
+    this.pools = new Map()
+    this.evicted = 0
+  }
+
+  pool(backend) {
+    let pool = this.pools.get(backend)
+    if (!pool) {
+      pool = new FaceWorkerPool({
+        python: this.python,
+        script: this.script,
+        name: backend,
+        ...this.poolOptions(backend),
+        admit: (requester) => this.admit(requester),
+        onRelease: () => this.dispatchWaiting(),
+      })
+      this.pools.set(backend, pool)
+    }
+    return pool
+  }
+
+  /**
+   * Run a job on the given backend's pool
+   */
+  run(backend, job) {
+    return this.pool(backend).run(job)
+  }
+
+  memoryMb() {
+    let total = 0
+    for (const pool of this.pools.values()) total += pool.memoryMb()
+    return total
+  }
+
+  admit(requester) {
+    if (!this.memoryBudgetMb) return true
+    const needed = requester.expectedRssMb()
+    let used = this.memoryMb()
+    if (used + needed <= this.memoryBudgetMb) return true
+
+    const idle = [...this.pools.values()]
+      .filter(pool => pool !== requester)
+      .flatMap(pool => pool.idle.map(worker => ({ pool, worker })))
+      .sort((a, b) => a.worker.idleSince - b.worker.idleSince)
+    for (const { pool, worker } of idle) {
+      if (used + needed <= this.memoryBudgetMb) break
+      used -= worker.rssMb ?? pool.expectedRssMb()
+      this.evicted++
+      pool.retire(worker)
+    }
+    return used + needed <= this.memoryBudgetMb
+  }
+
+  // A worker freed up somewhere: pools waiting for memory may be able to start one now
+  dispatchWaiting() {
+    for (const pool of this.pools.values()) {
+      if (pool.queue.length > 0) pool.dispatch()
+    }
+  }
+
+  stats() {
+    return {
+      memoryBudgetMb: this.memoryBudgetMb || null,
+      memoryMb: Math.round(this.memoryMb()),
+      evicted: this.evicted,
+      backends: Object.fromEntries([...this.pools].map(([backend, pool]) => [backend, pool.stats()])),
+    }
+  }
+
+  shutdown() {
+    this.pools.forEach(pool => pool.shutdown())
+  }
+}
+
+export default FaceWorkerPool
@@ -21,8 +21,8 @@ export const extractTextWithGoogleVision = async (imagePath) => {
       throw error
     }
 
-    // Read image file and convert to base64
-    const imageBuffer = await fs.readFile(imagePath)
+    // Read image file (unless given the bytes) and convert to base64
+    const imageBuffer = Buffer.isBuffer(imagePath) ? imagePath : await fs.readFile(imagePath)
     const base64Image = imageBuffer.toString('base64')
     
     // Call Google Vision API
@@ -93,8 +93,8 @@ export const detectFacesWithGoogleVision = async (imagePath) => {
       throw error
     }
 
-    // Read image file and convert to base64
-    const imageBuffer = await fs.readFile(imagePath)
+    // Read image file (unless the upload is already in memory) and convert to base64
+    const imageBuffer = Buffer.isBuffer(imagePath) ? imagePath : await fs.readFile(imagePath)
     const base64Image = imageBuffer.toString('base64')
     
     // Call Google Vision API for face detection
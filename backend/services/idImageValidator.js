@@ -1,21 +1,41 @@
 // ID Image Validator - Detects if uploaded image is actually an ID card vs selfie/portrait
 
-import { detectFaces } from './faceDetectionService.js'
+import { assessImageQuality, detectFaces } from './faceDetectionService.js'
 
 /**
  * Validate if uploaded image is an ID card (not a selfie/portrait)
+ * Blank, blurred, badly exposed or tiny images are turned away first (usable: false), before any
+ * face detection or OCR runs on them
  * @param {string} imagePath - Path to image file
- * @returns {Promise<Object>} Validation result with isIdCard flag and reason
+ * @returns {Promise<Object>} Validation result with usable and isIdCard flags and reason
  */
 export const validateIdImage = async (imagePath) => {
   try {
+    // Check 0: Image quality - a few milliseconds on a downscaled decode
+    let quality = null
+    try {
+      quality = await assessImageQuality(imagePath)
+    } catch (error) {
+      console.warn('Image quality check failed during validation:', error.message)
+    }
+    if (quality && !quality.usable) {
+      console.log(`🔍 ID Image Validation: unusable image (${quality.issues.join(', ')})`)
+      return {
+        usable: false,
+        isIdCard: null,
+        confidence: 1 - quality.score,
+        reason: quality.messages.join('; '),
+        quality,
+      }
+    }
+    
     let sharp
     try {
       const sharpModule = await import('sharp')
       sharp = sharpModule.default
     } catch (error) {
       console.warn('Sharp not available, skipping ID validation')
-      return { isIdCard: true, reason: 'Cannot validate (sharp not available)', confidence: 0.5 }
+      return { usable: true, isIdCard: true, reason: 'Cannot validate (sharp not available)', confidence: 0.5, quality }
     }
 
     // Get image metadata
@@ -27,13 +47,16 @@ export const validateIdImage = async (imagePath) => {
     const isLandscape = aspectRatio > 1.2 // ID cards are usually 1.3-1.6 ratio
     
     // Check 2: Face detection - ID cards have small faces, selfies have large faces
+    // The cascade model answers clear single-face images with its cheap first stage and only
+    // runs a CNN detector when that stage is unsure
     let faceInfo = null
     try {
-      const faceResult = await detectFaces(imagePath, 'yolov8-face')
+      const faceResult = await detectFaces(imagePath, 'cascade')
       if (faceResult && faceResult.face_count > 0) {
         faceInfo = {
           count: faceResult.face_count,
           faces: faceResult.faces || [],
+          tier: faceResult.tier,
         }
       }
     } catch (error) {
@@ -44,10 +67,11 @@ export const validateIdImage = async (imagePath) => {
     let faceCoverage = 0
     if (faceInfo && faceInfo.faces && faceInfo.faces.length > 0) {
       const totalFaceArea = faceInfo.faces.reduce((sum, face) => {
-        // Face object might have width/height or bbox coordinates
-        let faceWidth = face.width || (face.bbox && face.bbox[2] - face.bbox[0]) || 0
-        let faceHeight = face.height || (face.bbox && face.bbox[3] - face.bbox[1]) || 0
-        const faceArea = faceWidth * faceHeight
+        // Detections carry their size in bounding_box (in original image pixels)
+        const box = face.bounding_box || {}
+        const faceWidth = box.width ?? (box.x2 - box.x1)
+        const faceHeight = box.height ?? (box.y2 - box.y1)
+        const faceArea = (faceWidth || 0) * (faceHeight || 0)
         return sum + faceArea
       }, 0)
       const imageArea = width * height
@@ -101,21 +125,24 @@ export const validateIdImage = async (imagePath) => {
     
     console.log(`🔍 ID Image Validation:`)
     console.log(`   Dimensions: ${width}x${height} (aspect ratio: ${aspectRatio.toFixed(2)})`)
-    console.log(`   Face coverage: ${(faceCoverage * 100).toFixed(1)}%`)
+    console.log(`   Face coverage: ${(faceCoverage * 100).toFixed(1)}%${faceInfo?.tier ? ` (detected by ${faceInfo.tier})` : ''}`)
     console.log(`   File size: ${fileSizeKB.toFixed(1)} KB`)
     console.log(`   Score: ${score.toFixed(2)}`)
     console.log(`   Is ID Card: ${isIdCard} (confidence: ${(confidence * 100).toFixed(0)}%)`)
     console.log(`   Reasons: ${reasons.join('; ')}`)
     
     return {
+      usable: true,
       isIdCard,
       confidence,
       reason: reasons.join('; '),
+      quality,
       details: {
         aspectRatio,
         isLandscape,
         faceCoverage,
         faceCount: faceInfo?.count || 0,
+        faceDetectorTier: faceInfo?.tier || null,
         fileSizeKB,
         score,
       },
@@ -124,6 +151,7 @@ export const validateIdImage = async (imagePath) => {
     console.error('ID image validation error:', error)
     // Default to allowing (fail open) but warn
     return {
+      usable: true,
       isIdCard: true,
       confidence: 0.3,
       reason: `Validation failed: ${error.message}`,
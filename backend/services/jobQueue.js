@@ -0,0 +1,188 @@
+// Job Queue - in-process background jobs with bounded concurrency and load shedding
+// Accepted jobs wait in a bounded FIFO and run at most `concurrency` at a time; when the queue
+// is full, submit() throws QueueFullError so the caller can answer 503 instead of piling up work.
+// Finished jobs are kept for `ttlMs` so clients can poll their status.
+
+import { v4 as uuidv4 } from 'uuid'
+
+export class QueueFullError extends Error {
+  constructor(name, retryAfterSeconds) {
+    super(`The ${name} queue is full. Please try again shortly.`)
+    this.code = 'QUEUE_FULL'
+    this.retryAfterSeconds = retryAfterSeconds
+  }
+}
+
+/**
+ * Promise semaphore: run() calls beyond `concurrency` wait their turn in FIFO order
+ */
+export class Limiter {
+  constructor(name, concurrency) {
+    this.name = name
+    this.concurrency = Math.max(1, concurrency)
+    this.active = 0
+    this.waiting = []
+    this.completed = 0
+  }
+
+  async run(fn) {
+    if (this.active >= this.concurrency) {
+      await new Promise(resolve => this.waiting.push(resolve))
+    }
+    this.active++
+    try {
+      return await fn()
+    } finally {
+      this.active--
+      this.completed++
+      const next = this.waiting.shift()
+      if (next) next()
+    }
+  }
+
+  stats() {
+    return {
+      concurrency: this.concurrency,
+      active: this.active,
+      waiting: this.waiting.length,
+      completed: this.completed,
+    }
+  }
+}
+
+export class JobQueue {
+  constructor({ name, concurrency = 1, maxQueued = 100, ttlMs = 3600000, run }) {
+    this.name = name
+    this.limiter = new Limiter(name, concurrency)
+    this.maxQueued = maxQueued
+    this.ttlMs = ttlMs
+    this.runJob = run
+    this.jobs = new Map()
+    this.queued = []
+    this.rejected = 0
+    this.durationsMs = []
+  }
+
+  isFull() {
+    return this.queued.length >= this.maxQueued
+  }
+
+  /**
+   * Rough seconds until a queued slot frees up, from recent job durations
+   */
+  retryAfterSeconds() {
+    const recent = this.durationsMs.slice(-20)
+    const averageMs = recent.length ? recent.reduce((sum, ms) => sum + ms, 0) / recent.length : 10000
+    return Math.max(1, Math.ceil(averageMs / 1000))
+  }
+
+  /**
+   * Throw QueueFullError when maxQueued jobs are already waiting, e.g. before accepting an upload
+   */
+  checkCapacity() {
+    if (this.isFull()) {
+      this.rejected++
+      throw new QueueFullError(this.name, this.retryAfterSeconds())
+    }
+  }
+
+  /**
+   * Accept a job for background processing. Returns the job record; throws QueueFullError
+   * when maxQueued jobs are already waiting.
+   */
+  submit(params) {
+    this.purge()
+    this.checkCapacity()
+
+    const job = {
+      id: uuidv4(),
+      status: 'queued',
+      stage: null,
+      createdAt: new Date(),
+      startedAt: null,
+      finishedAt: null,
+      result: null,
+      error: null,
+      params,
+    }
+    job.done = this.execute(job)
+    this.jobs.set(job.id, job)
+    return job
+  }
+
+  async execute(job) {
+    this.queued.push(job)
+    try {
+      await this.limiter.run(async () => {
+        this.queued.splice(this.queued.indexOf(job), 1)
+        job.status = 'running'
+        job.startedAt = new Date()
+        try {
+          job.result = await this.runJob(job.params, job)
+          job.status = 'completed'
+        } catch (error) {
+          console.error(`${this.name} job ${job.id} failed:`, error)
+          job.error = error.message || String(error)
+          job.status = 'failed'
+        } finally {
+          job.finishedAt = new Date()
+          // Release uploads and other inputs as soon as they are no longer needed
+          job.params = null
+          this.durationsMs.push(job.finishedAt - job.startedAt)
+          if (this.durationsMs.length > 100) this.durationsMs.splice(0, this.durationsMs.length - 100)
+        }
+      })
+    } finally {
+      job.stage = null
+    }
+    return job
+  }
+
+  get(id) {
+    this.purge()
+    return this.jobs.get(id) || null
+  }
+
+  /**
+   * Public view of a job: status, current stage, queue position while waiting, and the outcome
+   */
+  describe(job) {
+    return {
+      jobId: job.id,
+      status: job.status,
+      stage: job.stage,
+      position: job.status === 'queued' ? this.queued.indexOf(job) + 1 : undefined,
+      createdAt: job.createdAt,
+      startedAt: job.startedAt,
+      finishedAt: job.finishedAt,
+      result: job.result || undefined,
+      error: job.error || undefined,
+    }
+  }
+
+  // Forget finished jobs older than the TTL
+  purge() {
+    const cutoff = Date.now() - this.ttlMs
+    for (const [id, job] of this.jobs) {
+      if (job.finishedAt && job.finishedAt.getTime() < cutoff) {
+        this.jobs.delete(id)
+      }
+    }
+  }
+
+  stats() {
+    return {
+      ...this.limiter.stats(),
+      queued: this.queued.length,
+      maxQueued: this.maxQueued,
+      rejected: this.rejected,
+      tracked: this.jobs.size,
+    }
+  }
+}
+
+export default {
+  JobQueue,
+  Limiter,
+  QueueFullError,
+}
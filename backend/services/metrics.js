@@ -0,0 +1,191 @@
+// In-process metrics rendered in the Prometheus text exposition format
+// Histograms and counters keyed by label values; no client library needed for the handful we export
+
+const DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+const escapeLabel = (value) => String(value).replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/"/g, '\\"')
+
+const formatLabels = (labels) => {
+  const pairs = Object.entries(labels).map(([name, value]) => `${name}="${escapeLabel(value)}"`)
+  return pairs.length ? `{${pairs.join(',')}}` : ''
+}
+
+class Metric {
+  constructor(name, help, labelNames) {
+    this.name = name
+    this.help = help
+    this.labelNames = labelNames
+    this.series = new Map()
+  }
+
+  labelsFor(labels) {
+    return Object.fromEntries(this.labelNames.map(name => [name, labels[name] ?? '']))
+  }
+
+  seriesFor(labels, create) {
+    const key = this.labelNames.map(name => labels[name] ?? '').join('\u0000')
+    let series = this.series.get(key)
+    if (!series) {
+      series = { labels: this.labelsFor(labels), ...create() }
+      this.series.set(key, series)
+    }
+    return series
+  }
+}
+
+export class Histogram extends Metric {
+  constructor(name, help, labelNames = [], buckets = DEFAULT_BUCKETS) {
+    super(name, help, labelNames)
+    this.buckets = [...buckets].sort((a, b) => a - b)
+  }
+
+  observe(labels, value) {
+    if (!Number.isFinite(value)) return
+    const series = this.seriesFor(labels, () => ({ counts: this.buckets.map(() => 0), sum: 0, count: 0 }))
+    this.buckets.forEach((bound, i) => {
+      if (value <= bound) series.counts[i]++
+    })
+    series.sum += value
+    series.count++
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`]
+    for (const { labels, counts, sum, count } of this.series.values()) {
+      this.buckets.forEach((bound, i) => {
+        lines.push(`${this.name}_bucket${formatLabels({ ...labels, le: bound })} ${counts[i]}`)
+      })
+      lines.push(`${this.name}_bucket${formatLabels({ ...labels, le: '+Inf' })} ${count}`)
+      lines.push(`${this.name}_sum${formatLabels(labels)} ${sum}`)
+      lines.push(`${this.name}_count${formatLabels(labels)} ${count}`)
+    }
+    return lines.join('\n')
+  }
+}
+
+export class Counter extends Metric {
+  inc(labels, value = 1) {
+    this.seriesFor(labels, () => ({ value: 0 })).value += value
+  }
+
+  // For totals counted elsewhere (e.g. by the face worker pools) and copied in before rendering
+  set(labels, value) {
+    this.seriesFor(labels, () => ({ value: 0 })).value = value
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} ${this.type}`]
+    for (const { labels, value } of this.series.values()) {
+      lines.push(`${this.name}${formatLabels(labels)} ${value}`)
+    }
+    return lines.join('\n')
+  }
+}
+Counter.prototype.type = 'counter'
+
+export class Gauge extends Counter {
+  // Drop every series, so label sets that no longer exist stop being reported
+  reset() {
+    this.series.clear()
+  }
+}
+Gauge.prototype.type = 'gauge'
+
+const metrics = []
+
+const register = (metric) => {
+  metrics.push(metric)
+  return metric
+}
+
+export const faceStageDuration = register(new Histogram(
+  'face_stage_duration_seconds',
+  'Face pipeline stage duration (decode, preprocess, model_load, inference, embedding, cache, serialization)',
+  ['model', 'action', 'stage']
+))
+
+export const faceJobDuration = register(new Histogram(
+  'face_job_duration_seconds',
+  'Face job round trip as seen by Node, including the Python worker or process',
+  ['model', 'action', 'outcome']
+))
+
+export const faceJobsTotal = register(new Counter(
+  'face_jobs_total',
+  'Face jobs run, by whether a warm worker or a one-off Python process answered',
+  ['model', 'action', 'runner', 'outcome']
+))
+
+export const faceWorkerMemory = register(new Gauge(
+  'face_worker_memory_mb',
+  'Resident memory of each backend\'s face workers, as last reported by the workers',
+  ['backend']
+))
+
+export const faceWorkers = register(new Gauge(
+  'face_workers',
+  'Face worker processes per backend by state (starting, idle, busy)',
+  ['backend', 'state']
+))
+
+export const faceWorkerRestarts = register(new Counter(
+  'face_worker_restarts_total',
+  'Face workers replaced per backend: over their memory ceiling, crashed, or unloaded after idling',
+  ['backend', 'reason']
+))
+
+// Stages the Python side reports that are sums of the others rather than pipeline stages
+const AGGREGATE_STAGES = new Set(['total'])
+
+/**
+ * Record one face job: the Node round trip, every stage in the result's timings_ms, and the time
+ * spent outside Python's job timer (result serialization, pipe transfer and parsing for warm
+ * workers; additionally interpreter start-up and imports for one-off processes)
+ */
+export const recordFaceJob = ({ job, result, error, runner, elapsedMs }) => {
+  const model = job.model || 'yolov8-face'
+  const action = job.action || 'unknown'
+  const outcome = error || result?.error ? 'error' : 'ok'
+  faceJobDuration.observe({ model, action, outcome }, elapsedMs / 1000)
+  faceJobsTotal.inc({ model, action, runner, outcome })
+
+  const timings = result?.timings_ms
+  if (!timings) return
+  for (const [stage, ms] of Object.entries(timings)) {
+    if (!AGGREGATE_STAGES.has(stage)) {
+      faceStageDuration.observe({ model, action, stage }, ms / 1000)
+    }
+  }
+  if (Number.isFinite(timings.total)) {
+    const stage = runner === 'worker' ? 'serialization' : 'process'
+    faceStageDuration.observe({ model, action, stage }, Math.max(0, elapsedMs - timings.total) / 1000)
+  }
+}
+
+/**
+ * Copy the face worker supervisor's figures (getFaceWorkerStats()) into the worker metrics
+ */
+export const recordWorkerStats = (stats) => {
+  faceWorkerMemory.reset()
+  faceWorkers.reset()
+  for (const [backend, pool] of Object.entries(stats?.backends || {})) {
+    faceWorkerMemory.set({ backend }, pool.memoryMb)
+    for (const state of ['starting', 'idle', 'busy']) {
+      faceWorkers.set({ backend, state }, pool.workers.filter(worker => worker.state === state).length)
+    }
+    faceWorkerRestarts.set({ backend, reason: 'memory' }, pool.restarts.memory)
+    faceWorkerRestarts.set({ backend, reason: 'crash' }, pool.restarts.crash)
+    faceWorkerRestarts.set({ backend, reason: 'idle' }, pool.unloaded)
+  }
+}
+
+export const renderMetrics = () => metrics.map(metric => metric.render()).join('\n\n') + '\n'
+
+export default {
+  Histogram,
+  Counter,
+  Gauge,
+  recordFaceJob,
+  recordWorkerStats,
+  renderMetrics,
+}
@@ -1,64 +1,36 @@
 // OCR Model Registry - Extensible system for multiple OCR providers
 
 import { extractTextWithGoogleVision } from './googleVision.js'
-import { createWorker } from 'tesseract.js'
+import { recognizeText } from './tesseractPool.js'
 import { parseKenyanID } from './idParser.js'
-import { preprocessImage, preprocessImageMultiple } from './imagePreprocessor.js'
-import fs from 'fs/promises'
+import { preprocessImageBuffer, preprocessImageMultiple } from './imagePreprocessor.js'
 
 /**
  * OCR Model Registry
  * Add new OCR models here by implementing the OCRModel interface
+ * extract(image, { preprocessed }) receives a file path or a Buffer of encoded image bytes;
+ * preprocessed is true when the image already went through imagePreprocessor
  */
 const ocrModels = {
   'tesseract': {
     name: 'Tesseract OCR',
     description: 'Free, open-source OCR engine. Works offline.',
     requiresApiKey: false,
-    extract: async (imagePath) => {
-      // Preprocess image first (rotation correction, contrast enhancement)
-      let processedImagePath = imagePath
-      try {
-        processedImagePath = await preprocessImage(imagePath)
-        console.log('✅ Image preprocessed for better OCR accuracy')
-      } catch (error) {
-        console.warn('⚠️ Image preprocessing failed, using original:', error.message)
-      }
-      
-      // Create worker with initial parameters (some can only be set during initialization)
-      const worker = await createWorker('eng', 1, {
-        logger: m => {
-          // Suppress verbose logging
-          if (m.status === 'recognizing text') {
-            // Only log progress if needed
-          }
-        }
-      })
-      
-      // Configure Tesseract for better accuracy on ID cards
-      // Note: tessedit_ocr_engine_mode must be set during createWorker, not setParameters
-      await worker.setParameters({
-        tessedit_pageseg_mode: '6', // Assume uniform block of text
-        tessedit_char_whitelist: 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<:.,/- ', // Allow only relevant characters
-        preserve_interword_spaces: '1', // Preserve spaces between words
-        tessedit_create_hocr: '0', // Don't create hOCR
-        tessedit_create_tsv: '0', // Don't create TSV
-      })
-      
-      // Recognize with better settings
-      const { data: { text } } = await worker.recognize(processedImagePath, {
-        rectangle: undefined, // Process full image
-      })
-      
-      await worker.terminate()
-      
-      // Clean up preprocessed image if it was created
-      if (processedImagePath !== imagePath) {
+    extract: async (image, { preprocessed = false } = {}) => {
+      // Preprocess image first (rotation correction, contrast enhancement), in memory
+      let processedImage = image
+      if (!preprocessed) {
         try {
-          await fs.unlink(processedImagePath).catch(() => {}) // Ignore errors
-        } catch {}
+          processedImage = (await preprocessImageBuffer(image)) || image
+          console.log('✅ Image preprocessed for better OCR accuracy')
+        } catch (error) {
+          console.warn('⚠️ Image preprocessing failed, using original:', error.message)
+        }
       }
       
+      // Warm workers from the shared pool, already configured for ID cards
+      const text = await recognizeText(processedImage)
+      
       // Log raw OCR text for debugging
       console.log('📄 Raw OCR text (first 500 chars):', text.substring(0, 500))
       
@@ -141,6 +113,8 @@ export const isModelAvailable = (modelId) => {
 
 /**
  * Extract text multiple times with different preprocessing and vote on best result
+ * The variations are rendered in memory from one decode and recognized concurrently, so with
+ * Tesseract's worker pool the runs take about as long as one
  * @param {string} imagePath - Path to image file
  * @param {string} modelId - OCR model identifier
  * @param {number} runs - Number of extraction runs (default: 3)
@@ -151,33 +125,26 @@ export const extractTextMultiple = async (imagePath, modelId = 'tesseract', runs
     console.log(`🔄 Running ${runs} OCR extractions with different preprocessing...`)
     
     // Get preprocessing variations
-    const variations = await preprocessImageMultiple(imagePath)
+    const variations = (await preprocessImageMultiple(imagePath)).slice(0, runs)
+    
+    // Run OCR on every variation at once
+    const settled = await Promise.allSettled(variations.map((variation, i) => {
+      console.log(`   Run ${i + 1}/${runs}: Using ${variation.type} preprocessing...`)
+      return extractText(variation.image, modelId, false, { preprocessed: variation.type !== 'original' })
+    }))
     
-    // Run OCR on each variation
     const results = []
-    for (let i = 0; i < Math.min(runs, variations.length); i++) {
-      try {
-        const variation = variations[i]
-        console.log(`   Run ${i + 1}/${runs}: Using ${variation.type} preprocessing...`)
-        const result = await extractText(variation.path, modelId, false)
+    settled.forEach((outcome, i) => {
+      if (outcome.status === 'fulfilled') {
         results.push({
-          ...result,
+          ...outcome.value,
           run: i + 1,
-          preprocessing: variation.type,
+          preprocessing: variations[i].type,
         })
-      } catch (error) {
-        console.warn(`   Run ${i + 1} failed:`, error.message)
-      }
-    }
-    
-    // Clean up preprocessed images
-    for (const variation of variations) {
-      if (variation.path !== imagePath) {
-        try {
-          await fs.unlink(variation.path).catch(() => {})
-        } catch {}
+      } else {
+        console.warn(`   Run ${i + 1} failed:`, outcome.reason?.message)
       }
-    }
+    })
     
     if (results.length === 0) {
       console.warn('⚠️ All OCR runs failed, falling back to single extraction')
@@ -303,37 +270,38 @@ const voteOnBestResult = (results) => {
 
 /**
  * Extract text using specified OCR model with fallback
- * @param {string} imagePath - Path to image file
+ * @param {string|Buffer} imagePath - Path to image file, or encoded image bytes
  * @param {string} modelId - OCR model identifier
  * @param {boolean} allowFallback - Whether to fallback to tesseract on error
+ * @param {Object} options - Passed to the model's extract (e.g. { preprocessed: true })
  * @returns {Promise<Object>} Extracted text and parsed data
  */
-export const extractText = async (imagePath, modelId = 'tesseract', allowFallback = true) => {
+export const extractText = async (imagePath, modelId = 'tesseract', allowFallback = true, options = {}) => {
   const model = ocrModels[modelId]
   
   if (!model) {
     console.warn(`OCR model "${modelId}" not found, falling back to tesseract`)
-    return await extractText(imagePath, 'tesseract', false)
+    return await extractText(imagePath, 'tesseract', false, options)
   }
   
   // Check if model requires API key and is configured
   if (model.requiresApiKey && model.isConfigured && !model.isConfigured()) {
     console.warn(`OCR model "${modelId}" requires API key but is not configured, falling back to tesseract`)
     if (allowFallback) {
-      return await extractText(imagePath, 'tesseract', false)
+      return await extractText(imagePath, 'tesseract', false, options)
     }
     throw new Error(`OCR model "${modelId}" requires API key. Please configure it in .env file.`)
   }
   
   try {
-    return await model.extract(imagePath)
+    return await model.extract(imagePath, options)
   } catch (error) {
     console.error(`OCR Error with model "${modelId}":`, error)
     
     // Fallback to tesseract if allowed
     if (allowFallback && modelId !== 'tesseract') {
       console.log(`Falling back to Tesseract OCR...`)
-      return await extractText(imagePath, 'tesseract', false)
+      return await extractText(imagePath, 'tesseract', false, options)
     }
     
     // Return empty result if no fallback
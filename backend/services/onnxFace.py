@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime Face Models
+CPU inference for a YOLOv8-face detector and an ArcFace recognizer exported to ONNX, with tunable
+session options and helpers to export the models and quantize them to int8
+"""
+
+import os
+import sys
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+
+DETECTOR_INPUT_SIZE = 640
+DEFAULT_CONF_THRESHOLD = 0.5
+DEFAULT_IOU_THRESHOLD = 0.45
+
+# Reference positions of the eyes, nose tip and mouth corners in a 112x112 ArcFace crop
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+# Recognizer shipped in InsightFace's buffalo_l pack, relative to its models directory
+INSIGHTFACE_RECOGNIZER = Path('buffalo_l') / 'w600k_r50.onnx'
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# Environment variables that change session options; sessions are only rebuilt when one is set
+SESSION_ENV_VARS = ('FACE_ORT_INTRA_THREADS', 'FACE_ORT_INTER_THREADS', 'FACE_ORT_OPT_LEVEL')
+
+
+def detector_filename(size, quantized=False):
+    return f"yolov8{size}-face{'.int8' if quantized else ''}.onnx"
+
+
+def recognizer_filename(quantized=False):
+    return f"arcface{'.int8' if quantized else ''}.onnx"
+
+
+def prefer_quantized():
+    return os.environ.get('FACE_ONNX_QUANTIZED', '0').lower() in ('1', 'true', 'on', 'yes')
+
+
+def find_model(model_dir, filename, quantized=None):
+    """
+    Path of a model in model_dir, or None. filename(quantized) names the float or int8 variant;
+    the preferred variant (FACE_ONNX_QUANTIZED) is used when present, otherwise the other one.
+    """
+    if quantized is None:
+        quantized = prefer_quantized()
+    for variant in (quantized, not quantized):
+        path = Path(model_dir) / filename(variant)
+        if path.exists():
+            return path
+    return None
+
+
+def session_configured():
+    return any(os.environ.get(name) for name in SESSION_ENV_VARS)
+
+
+def session_options(intra_threads=None, inter_threads=None, optimization=None):
+    """
+    ONNX Runtime session options from the arguments or FACE_ORT_INTRA_THREADS (threads per operator,
+    0 = one per core), FACE_ORT_INTER_THREADS (operators run in parallel, 0/1 = sequential) and
+    FACE_ORT_OPT_LEVEL (disable, basic, extended or all)
+    """
+    options = ort.SessionOptions()
+    intra_threads = int(intra_threads or os.environ.get('FACE_ORT_INTRA_THREADS') or 0)
+    inter_threads = int(inter_threads or os.environ.get('FACE_ORT_INTER_THREADS') or 0)
+    optimization = (optimization or os.environ.get('FACE_ORT_OPT_LEVEL') or 'all').lower()
+    if optimization not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level '{optimization}'. "
+                         f"Expected one of: {', '.join(GRAPH_OPTIMIZATION_LEVELS)}")
+
+    if intra_threads > 0:
+        options.intra_op_num_threads = intra_threads
+    if inter_threads > 1:
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.inter_op_num_threads = inter_threads
+    else:
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[optimization]
+    return options
+
+
+def create_session(model_path, provider='CPUExecutionProvider', options=None):
+    return ort.InferenceSession(str(model_path), sess_options=options or session_options(), providers=[provider])
+
+
+def run_batched(session, input_name, batch):
+    """Run a single-input model over a stacked batch, one item at a time if its batch size is fixed"""
+    if isinstance(session.get_inputs()[0].shape[0], int):
+        return np.concatenate([session.run(None, {input_name: item[None]})[0] for item in batch])
+    return session.run(None, {input_name: batch})[0]
+
+
+def letterbox(image, size):
+    """Resize keeping the aspect ratio and pad to size x size. Returns (canvas, ratio, (pad_x, pad_y))."""
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = image
+    return canvas, ratio, (pad_x, pad_y)
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression over (x1, y1, x2, y2) boxes. Returns kept indices, best first."""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores)
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        overlap = width * height
+        iou = overlap / (areas[best] + areas[rest] - overlap + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class YoloFaceOnnx:
+    """
+    YOLOv8-face exported to ONNX. Input: letterboxed RGB, NCHW float32 in 0-1. Output per image:
+    (4 + 1 + 15, anchors) rows of cx, cy, w, h, face score and five landmarks as (x, y, visibility).
+    """
+
+    def __init__(self, model_path, provider='CPUExecutionProvider', options=None,
+                 conf_threshold=DEFAULT_CONF_THRESHOLD, iou_threshold=DEFAULT_IOU_THRESHOLD):
+        self.session = create_session(model_path, provider, options)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_size = model_input.shape[2] if isinstance(model_input.shape[2], int) else DETECTOR_INPUT_SIZE
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+
+    def detect(self, images):
+        """Per image: (boxes (n, 4), scores (n,), landmarks (n, 5, 2) or None) in that image's coordinates"""
+        prepared = [letterbox(image, self.input_size) for image in images]
+        batch = np.stack([canvas[:, :, ::-1].transpose(2, 0, 1) for canvas, _, _ in prepared])
+        outputs = run_batched(self.session, self.input_name, np.ascontiguousarray(batch, dtype=np.float32) / 255.0)
+        return [
+            self._postprocess(output, ratio, pad, image.shape)
+            for output, (_, ratio, pad), image in zip(outputs, prepared, images)
+        ]
+
+    def _postprocess(self, output, ratio, pad, shape):
+        predictions = output.T
+        predictions = predictions[predictions[:, 4] >= self.conf_threshold]
+        if len(predictions) == 0:
+            return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), None
+
+        cx, cy, w, h = predictions[:, :4].T
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        keep = nms(boxes, predictions[:, 4], self.iou_threshold)
+        boxes, predictions = boxes[keep], predictions[keep]
+
+        offset = np.array(pad, dtype=np.float32)
+        boxes = (boxes - np.tile(offset, 2)) / ratio
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+
+        landmarks = None
+        if predictions.shape[1] >= 20:
+            landmarks = (predictions[:, 5:20].reshape(-1, 5, 3)[:, :, :2] - offset) / ratio
+        return boxes, predictions[:, 4], landmarks
+
+
+def align_crop(image, box, landmarks=None, size=112):
+    """size x size face crop: similarity-aligned on the five landmarks, or the box resized if there are none"""
+    if landmarks is not None:
+        matrix, _ = cv2.estimateAffinePartial2D(np.asarray(landmarks, dtype=np.float32),
+                                               ARCFACE_TEMPLATE * (size / 112.0), method=cv2.LMEDS)
+        if matrix is not None:
+            return cv2.warpAffine(image, matrix, (size, size), borderValue=0.0)
+    x1, y1, x2, y2 = np.asarray(box).astype(int)[:4]
+    face = image[max(0, y1):max(y1 + 1, y2), max(0, x1):max(x1 + 1, x2)]
+    return cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
+
+
+class ArcFaceOnnx:
+    """ArcFace recognizer exported to ONNX: aligned 112x112 RGB crops normalized to [-1, 1], NCHW"""
+
+    def __init__(self, model_path, provider='CPUExecutionProvider', options=None):
+        self.session = create_session(model_path, provider, options)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 112
+
+    def crop(self, image, box, landmarks=None):
+        """Face crop for the recognizer (see align_crop)"""
+        return align_crop(image, box, landmarks, self.input_size)
+
+    def embed(self, crops):
+        """(n, dim) embeddings for a list of BGR crops, in one inference call when the model allows it"""
+        batch = np.stack(crops)[:, :, :, ::-1].transpose(0, 3, 1, 2)
+        batch = (np.ascontiguousarray(batch, dtype=np.float32) - 127.5) / 127.5
+        return run_batched(self.session, self.input_name, batch)
+
+
+def quantize_model(source, target):
+    """Dynamic int8 quantization of weights; activations stay float, so no calibration images are needed"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+    return target
+
+
+def export_models(model_dir, size='n', quantize=False, insightface_models_dir=None):
+    """
+    Populate model_dir for the ONNX backend: YOLOv8-face exported from yolov8{size}-face.pt with Ultralytics,
+    ArcFace copied from InsightFace's buffalo_l pack, and int8 copies of both when quantize is set.
+    Returns a report of the files written (or why each one could not be).
+    """
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    report = {'model_dir': str(model_dir), 'models': {}}
+
+    detector_path = model_dir / detector_filename(size)
+    try:
+        from ultralytics import YOLO
+
+        exported = YOLO(f'yolov8{size}-face.pt').export(format='onnx', imgsz=DETECTOR_INPUT_SIZE, dynamic=True)
+        shutil.move(str(exported), detector_path)
+        report['models'][detector_path.name] = {'source': f'yolov8{size}-face.pt'}
+    except Exception as e:
+        print(f"YOLOv8-face ONNX export failed: {e}", file=sys.stderr)
+        report['models'][detector_path.name] = {'error': f'{type(e).__name__}: {e}'}
+
+    recognizer_path = model_dir / recognizer_filename()
+    source = Path(insightface_models_dir or Path.home() / '.insightface' / 'models') / INSIGHTFACE_RECOGNIZER
+    if source.exists():
+        shutil.copyfile(source, recognizer_path)
+        report['models'][recognizer_path.name] = {'source': str(source)}
+    else:
+        report['models'][recognizer_path.name] = {
+            'error': f'{source} not found; run the insightface model once to download buffalo_l'
+        }
+
+    if quantize:
+        for path, quantized_path in ((detector_path, model_dir / detector_filename(size, True)),
+                                     (recognizer_path, model_dir / recognizer_filename(True))):
+            if not path.exists():
+                continue
+            try:
+                quantize_model(path, quantized_path)
+                report['models'][quantized_path.name] = {'source': path.name}
+            except Exception as e:
+                print(f"Quantizing {path.name} failed: {e}", file=sys.stderr)
+                report['models'][quantized_path.name] = {'error': f'{type(e).__name__}: {e}'}
+
+    for name, entry in report['models'].items():
+        if 'error' not in entry:
+            entry['size_mb'] = round((model_dir / name).stat().st_size / (1024 * 1024), 2)
+    return report
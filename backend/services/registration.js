@@ -11,29 +11,39 @@ import {
 } from './googleVision.js'
 import {
   compareFaces as compareFacesLocal,
+  extractFaceEmbedding,
+  searchFaceIndex,
+  addToFaceIndex,
+  createFaceArtifacts,
+  assessImageQuality,
   isModelAvailable as isFaceModelAvailable,
 } from './faceDetectionService.js'
+import { JobQueue, Limiter } from './jobQueue.js'
+import { createAuditLog } from './audit.js'
 
 const __filename = fileURLToPath(import.meta.url)
 const __dirname = dirname(__filename)
 
 // Face similarity calculation
+// Images are file paths or Buffers of the uploaded bytes (passed to the face worker without a disk round trip)
 const calculateFaceSimilarity = async (idImagePath, selfieImagePath, ocrModel = 'tesseract', faceModel = null) => {
   try {
+    const describe = (image) => (Buffer.isBuffer(image) ? '<in-memory upload>' : image)
     console.log(`🔍 Starting face similarity calculation:`)
-    console.log(`   ID Image: ${idImagePath}`)
-    console.log(`   Selfie Image: ${selfieImagePath}`)
+    console.log(`   ID Image: ${describe(idImagePath)}`)
+    console.log(`   Selfie Image: ${describe(selfieImagePath)}`)
     console.log(`   Face Model: ${faceModel || 'auto'}`)
     
     // Check if files exist
     const fs = await import('fs/promises')
+    const imageSize = async (image) => (Buffer.isBuffer(image) ? image.length : (await fs.stat(image)).size)
     try {
-      const idStats = await fs.stat(idImagePath)
-      const selfieStats = await fs.stat(selfieImagePath)
-      console.log(`   ID Image size: ${idStats.size} bytes`)
-      console.log(`   Selfie Image size: ${selfieStats.size} bytes`)
+      const idSize = await imageSize(idImagePath)
+      const selfieSize = await imageSize(selfieImagePath)
+      console.log(`   ID Image size: ${idSize} bytes`)
+      console.log(`   Selfie Image size: ${selfieSize} bytes`)
       
-      if (idStats.size === 0 || selfieStats.size === 0) {
+      if (idSize === 0 || selfieSize === 0) {
         console.error('❌ One or both images are empty!')
         return 0.0
       }
@@ -75,52 +85,22 @@ const calculateFaceSimilarity = async (idImagePath, selfieImagePath, ocrModel =
       }
     }
     
-    // Try DeepFace for accurate face verification
+    // Single-pass local comparison: the Python 'auto' model decodes each image once and tries
+    // DeepFace -> InsightFace -> detector within one job, reusing detections between stages
     try {
-      const available = await isFaceModelAvailable('deepface')
-      if (available) {
-        console.log('✅ Trying DeepFace...')
-        const result = await compareFacesLocal(idImagePath, selfieImagePath, 'deepface')
-        console.log(`   DeepFace result: similarity=${result.similarity}, verified=${result.verified}`)
-        if (result.message) console.log(`   Message: ${result.message}`)
-        if (result.error) console.error(`   Error: ${result.error}`)
-        return result.similarity || 0
-      } else {
-        console.log('⚠️ DeepFace not available')
-      }
-    } catch (error) {
-      console.error('❌ DeepFace comparison error:', error.message)
-    }
-    
-    // Try InsightFace as fallback
-    try {
-      const available = await isFaceModelAvailable('insightface')
-      if (available) {
-        console.log('✅ Trying InsightFace...')
-        const result = await compareFacesLocal(idImagePath, selfieImagePath, 'insightface')
-        console.log(`   InsightFace result: similarity=${result.similarity}`)
-        return result.similarity || 0
+      console.log('✅ Comparing faces with best available local model...')
+      const result = await compareFacesLocal(idImagePath, selfieImagePath, 'auto')
+      console.log(`   ${result.model} result (stage=${result.stage || 'n/a'}): similarity=${result.similarity}, id_has_face=${result.id_has_face}, selfie_has_face=${result.selfie_has_face}`)
+      if (result.attempts) console.log(`   Attempts: ${result.attempts.join(' -> ')}`)
+      if (result.timings_ms) console.log(`   Timings (ms): ${JSON.stringify(result.timings_ms)}`)
+      if (result.message) console.log(`   Message: ${result.message}`)
+      if (result.error) {
+        console.error(`   Error: ${result.error}`)
       } else {
-        console.log('⚠️ InsightFace not available')
-      }
-    } catch (error) {
-      console.error('❌ InsightFace comparison error:', error.message)
-    }
-    
-    // Try YOLOv8 as final fallback
-    try {
-      const available = await isFaceModelAvailable('yolov8-face')
-      if (available) {
-        console.log('✅ Trying YOLOv8...')
-        const result = await compareFacesLocal(idImagePath, selfieImagePath, 'yolov8-face')
-        console.log(`   YOLOv8 result: similarity=${result.similarity}, id_has_face=${result.id_has_face}, selfie_has_face=${result.selfie_has_face}`)
-        if (result.message) console.log(`   Message: ${result.message}`)
         return result.similarity || 0
-      } else {
-        console.log('⚠️ YOLOv8 not available')
       }
     } catch (error) {
-      console.error('❌ YOLOv8 face comparison error:', error.message)
+      console.error('❌ Local face comparison error:', error.message)
     }
     
     // Final fallback - return 0 instead of mock similarity
@@ -562,14 +542,185 @@ const checkDuplicates = async (nationalId, phoneNumber, fullName) => {
   }
 }
 
+// Minimum cosine similarity between two selfies for them to count as the same face
+const FACE_DUPLICATE_THRESHOLD = parseFloat(process.env.FACE_DUPLICATE_THRESHOLD || '0.6')
+
+// Screen a selfie embedding against all registered voters (1:N face search)
+// Only flags matches registered under a different ID number - the same person registering twice
+const checkFaceDuplicates = async (faceEmbedding, nationalId) => {
+  try {
+    const search = await searchFaceIndex(faceEmbedding.embeddingBase64, faceEmbedding.model, {
+      topK: 5,
+      threshold: FACE_DUPLICATE_THRESHOLD,
+    })
+    console.log(`🔍 Face index search: ${search.matches.length} match(es) among ${search.count} voters in ${search.search_ms}ms`)
+    
+    if (search.matches.length === 0) {
+      return { duplicateFace: false, matches: [] }
+    }
+    
+    const scores = Object.fromEntries(search.matches.map(match => [match.id, match.score]))
+    const records = await pool.query(
+      'SELECT id, id_number, name FROM voters WHERE id = ANY($1::uuid[])',
+      [Object.keys(scores)]
+    )
+    
+    const enteredId = String(nationalId || '').replace(/\s+/g, '').trim()
+    const matches = records.rows
+      .filter(record => String(record.id_number).replace(/\s+/g, '').trim() !== enteredId)
+      .map(record => ({ ...record, score: scores[record.id] }))
+      .sort((a, b) => b.score - a.score)
+    
+    return { duplicateFace: matches.length > 0, matches }
+  } catch (error) {
+    console.error('Face duplicate check error:', error.message)
+    return { duplicateFace: false, matches: [] }
+  }
+}
+
+// Aligned face crops kept per registration (served with the uploads) so re-checks skip detection
+const FACE_CROPS_DIR = path.join(__dirname, '../uploads/faces')
+
+/**
+ * File path of a stored face crop from its URL in voters.face_artifacts
+ */
+export const faceCropPath = (cropUrl) => path.join(FACE_CROPS_DIR, path.basename(cropUrl))
+
+/**
+ * recompareFaces() pair for a voter's stored face_artifacts, with the metadata that lets the
+ * recognizer refuse unaligned or incompatible crops
+ */
+export const storedFacePair = (voterId, artifacts) => ({
+  voterId,
+  idCrop: faceCropPath(artifacts.faces.id.crop),
+  selfieCrop: faceCropPath(artifacts.faces.selfie.crop),
+  aligned: artifacts.faces.id.aligned === true && artifacts.faces.selfie.aligned === true,
+  detector: artifacts.detector?.family || null,
+  cropSize: artifacts.cropSize || null,
+  version: artifacts.version || null,
+})
+
+// Face crops plus the boxes, landmarks and detector they came from, for voters.face_artifacts
+const createRegistrationArtifacts = async (idImage, selfieImage, voterId) => {
+  try {
+    const { version, crop_size, detector, faces } = await createFaceArtifacts(idImage, selfieImage, {
+      outputDir: FACE_CROPS_DIR,
+      prefix: voterId,
+    })
+    for (const face of Object.values(faces)) {
+      if (face.crop) face.crop = `/uploads/faces/${face.crop}`
+    }
+    return { version, cropSize: crop_size, detector, faces }
+  } catch (error) {
+    console.warn('⚠️ Face artifacts could not be created:', error.message)
+    return null
+  }
+}
+
+// Quality of the ID and selfie images, or null when the check cannot run (the pipeline then carries on)
+const checkRegistrationImages = async (idImage, selfieImage) => {
+  try {
+    const quality = await assessImageQuality({ id: idImage, selfie: selfieImage })
+    console.log(`🔍 Image quality: ID ${quality.id_image.score} (${quality.id_image.issues.join(', ') || 'ok'}), selfie ${quality.selfie_image.score} (${quality.selfie_image.issues.join(', ') || 'ok'})`)
+    return quality
+  } catch (error) {
+    console.warn('⚠️ Image quality check failed:', error.message)
+    return null
+  }
+}
+
+// One validation error per problem found by the quality check
+const imageQualityErrors = (quality) => [
+  ['id_image', 'ID image'],
+  ['selfie_image', 'Selfie'],
+].flatMap(([key, label]) => (quality[key]?.usable === false ? quality[key].messages.map(message => `${label}: ${message}`) : []))
+
+const envInt = (name, fallback) => {
+  const value = parseInt(process.env[name] ?? '', 10)
+  return Number.isFinite(value) ? value : fallback
+}
+
+// Registrations share these per-stage limits, so a burst of sign-ups queues for OCR, the face
+// workers and the database instead of starting unbounded Tesseract and Python work at once
+const registrationStages = {
+  quality: new Limiter('quality', envInt('REGISTRATION_QUALITY_CONCURRENCY', 4)),
+  ocr: new Limiter('ocr', envInt('REGISTRATION_OCR_CONCURRENCY', 2)),
+  face: new Limiter('face', envInt('REGISTRATION_FACE_CONCURRENCY', Math.max(1, envInt('FACE_WORKERS', 2)))),
+  db: new Limiter('db', envInt('REGISTRATION_DB_CONCURRENCY', 4)),
+}
+
 // Process registration
-export const processRegistration = async ({ form, idImagePath, idBackImagePath, selfieImagePath, ocrModel = 'tesseract', faceModel = null }) => {
+// idImageBuffer/selfieImageBuffer optionally carry the uploaded bytes of the saved images for the face pipeline
+// onStage(name) is called as the registration enters each stage (quality, ocr, face, db)
+export const processRegistration = async ({ form, idImagePath, idBackImagePath, selfieImagePath, idImageBuffer = null, selfieImageBuffer = null, ocrModel = 'tesseract', faceModel = null, onStage = () => {} }) => {
   const { fullName, nationalId, dateOfBirth, phoneNumber, address } = form
+  const idFaceImage = idImageBuffer || idImagePath
+  const selfieFaceImage = selfieImageBuffer || selfieImagePath
+  const stage = (name, fn) => {
+    onStage(name)
+    return registrationStages[name].run(fn)
+  }
+  const voterId = uuidv4()
+  
+  // Store the registration; with no ocrResult or face results for images rejected before those stages
+  const storeVoter = ({ status, flaggedReason, ocrResult = {}, faceEmbedding = null, faceSimilarity = 0, validationErrors = [], faceArtifacts = null }) => {
+    // Generate file URLs (in production, upload to S3/MinIO)
+    const idImageUrl = `/uploads/${path.basename(idImagePath)}`
+    const idBackImageUrl = idBackImagePath ? `/uploads/${path.basename(idBackImagePath)}` : null
+    const selfieImageUrl = `/uploads/${path.basename(selfieImagePath)}`
+    
+    return stage('db', () => pool.query(
+      `INSERT INTO voters (
+        id, id_number, name, dob, phone, address,
+        id_image_url, selfie_image_url, id_ocr,
+        verification_status, flagged_reason, face_embedding, face_hash,
+        face_similarity, validation_errors, face_artifacts, face_embedding_model
+      ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17)
+      RETURNING id, verification_status, created_at`,
+      [
+        voterId,
+        nationalId,
+        fullName,
+        dateOfBirth || null,
+        phoneNumber,
+        address,
+        idImageUrl, // Store front image URL
+        selfieImageUrl,
+        JSON.stringify({ ...ocrResult, idBackImageUrl }), // Store back image URL in OCR data
+        status,
+        flaggedReason,
+        faceEmbedding ? faceEmbedding.embedding : [], // Normalized selfie embedding
+        faceEmbedding ? faceEmbedding.faceHash : null,
+        faceSimilarity,
+        validationErrors.length > 0 ? JSON.stringify(validationErrors) : null,
+        faceArtifacts ? JSON.stringify(faceArtifacts) : null,
+        faceEmbedding ? faceEmbedding.model : null,
+      ]
+    ))
+  }
   
   try {
+    // 0. Turn away blank, blurred, badly exposed or tiny images before OCR and the face models run on them
+    const imageQuality = await stage('quality', () => checkRegistrationImages(idFaceImage, selfieFaceImage))
+    if (imageQuality && !imageQuality.usable) {
+      const validationErrors = imageQualityErrors(imageQuality)
+      console.log(`❌ Unusable images (${validationErrors.join('; ')}) - test REJECTED before OCR and face comparison`)
+      const result = await storeVoter({ status: 'flagged', flaggedReason: 'poor_image_quality', validationErrors })
+      return {
+        status: 'flagged',
+        voterId: result.rows[0].id,
+        message: 'Verification flagged: the uploaded photos could not be read. Please retake them in good light and in focus.',
+        flaggedReason: 'poor_image_quality',
+        similarity: 0,
+        ocrResult: null,
+        validationErrors,
+        idValidation: null,
+      }
+    }
+    
     // 1. Run combined extraction (Docparser + OCR) on ID image for better accuracy
     console.log(`Running combined extraction (Docparser + OCR) on ID image using ${ocrModel}...`)
-    const ocrResult = await extractIDText(idImagePath, ocrModel, true)
+    const ocrResult = await stage('ocr', () => extractIDText(idImagePath, ocrModel, true))
     
     // 1.5. Post-process: If entered ID number appears in OCR text, prioritize it
     // This helps fix cases where OCR extracts wrong numbers (e.g., document numbers instead of ID)
@@ -630,7 +781,31 @@ export const processRegistration = async ({ form, idImagePath, idBackImagePath,
     // 2. Calculate face similarity - prefer DeepFace for accurate verification
     const faceDetectionModel = faceModel || (ocrModel === 'google-vision' ? 'google-vision' : 'deepface')
     console.log(`Calculating face similarity using ${faceDetectionModel}...`)
-    const faceSimilarity = await calculateFaceSimilarity(idImagePath, selfieImagePath, ocrModel, faceDetectionModel)
+    const { faceSimilarity, faceEmbedding, faceArtifacts } = await stage('face', async () => {
+      const faceSimilarity = await calculateFaceSimilarity(idFaceImage, selfieFaceImage, ocrModel, faceDetectionModel)
+      
+      // 2.5. Extract the selfie embedding so later comparisons and de-duplication can reuse it, and
+      // keep aligned face crops so re-checks and re-scoring need no detection
+      const extractSelfieEmbedding = async () => {
+        try {
+          const faceEmbedding = await extractFaceEmbedding(selfieFaceImage, 'auto')
+          if (faceEmbedding) {
+            console.log(`✅ Selfie embedding extracted (${faceEmbedding.embedding.length} dims, hash ${faceEmbedding.faceHash.substring(0, 12)}...)`)
+          } else {
+            console.warn('⚠️ No face found for selfie embedding')
+          }
+          return faceEmbedding
+        } catch (error) {
+          console.warn('⚠️ Selfie embedding extraction failed:', error.message)
+          return null
+        }
+      }
+      const [faceEmbedding, faceArtifacts] = await Promise.all([
+        extractSelfieEmbedding(),
+        createRegistrationArtifacts(idFaceImage, selfieFaceImage, voterId),
+      ])
+      return { faceSimilarity, faceEmbedding, faceArtifacts }
+    })
     
     // 3. Validate ID details match entered information
     const idValidation = validateIDDetails(ocrResult, { fullName, nationalId, dateOfBirth })
@@ -699,38 +874,31 @@ export const processRegistration = async ({ form, idImagePath, idBackImagePath,
       status = 'verified'
     }
     
-    // 5. Generate file URLs (in production, upload to S3/MinIO)
-    const idImageUrl = `/uploads/${path.basename(idImagePath)}`
-    const idBackImageUrl = idBackImagePath ? `/uploads/${path.basename(idBackImagePath)}` : null
-    const selfieImageUrl = `/uploads/${path.basename(selfieImagePath)}`
+    // 4.5. Screen the selfie against every registered voter
+    if (faceEmbedding) {
+      const faceDuplicates = await stage('face', () => checkFaceDuplicates(faceEmbedding, nationalId))
+      if (faceDuplicates.duplicateFace) {
+        const best = faceDuplicates.matches[0]
+        validationErrors.push(`Face matches an existing registration under a different ID number (${(best.score * 100).toFixed(1)}% similar)`)
+        if (status === 'verified') {
+          status = 'flagged'
+          flaggedReason = 'duplicate_face'
+        }
+        console.log(`❌ Duplicate face: matches voter ${best.id} (ID ${best.id_number})`)
+      }
+    }
     
-    // 6. Store in database
-    const voterId = uuidv4()
-    const result = await pool.query(
-      `INSERT INTO voters (
-        id, id_number, name, dob, phone, address,
-        id_image_url, selfie_image_url, id_ocr,
-        verification_status, flagged_reason, face_embedding,
-        face_similarity, validation_errors
-      ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
-      RETURNING id, verification_status, created_at`,
-      [
-        voterId,
-        nationalId,
-        fullName,
-        dateOfBirth || null,
-        phoneNumber,
-        address,
-        idImageUrl, // Store front image URL
-        selfieImageUrl,
-        JSON.stringify({ ...ocrResult, idBackImageUrl }), // Store back image URL in OCR data
-        status,
-        flaggedReason,
-        [], // Placeholder for face embedding array
-        faceSimilarity,
-        validationErrors.length > 0 ? JSON.stringify(validationErrors) : null,
-      ]
-    )
+    // 5. Store in database
+    const result = await storeVoter({ status, flaggedReason, ocrResult, faceEmbedding, faceSimilarity, validationErrors, faceArtifacts })
+    
+    // 6. Make this voter searchable for future duplicate checks
+    if (faceEmbedding) {
+      try {
+        await stage('face', () => addToFaceIndex(result.rows[0].id, faceEmbedding.embeddingBase64, faceEmbedding.model))
+      } catch (error) {
+        console.warn('⚠️ Failed to add voter to face index:', error.message)
+      }
+    }
     
     const message =
       status === 'verified'
@@ -752,3 +920,81 @@ export const processRegistration = async ({ form, idImagePath, idBackImagePath,
     throw error
   }
 }
+
+/**
+ * API response for a processed registration
+ */
+export const formatRegistrationResponse = (form, result) => {
+  const { fullName, nationalId, dateOfBirth, phoneNumber, address } = form
+  return {
+    status: result.status,
+    voterId: result.voterId,
+    message: result.message,
+    similarity: result.similarity,
+    validationErrors: result.validationErrors,
+    flaggedReason: result.flaggedReason,
+    data: {
+      fullName,
+      nationalId,
+      dateOfBirth,
+      phoneNumber,
+      address,
+    },
+    extractedData: result.ocrResult ? {
+      fullName: result.ocrResult.fullName || result.ocrResult.name || null,
+      idNumber: result.ocrResult.idNumber || null,
+      dateOfBirth: result.ocrResult.dateOfBirth || result.ocrResult.dob || null,
+      sex: result.ocrResult.sex || null,
+      districtOfBirth: result.ocrResult.districtOfBirth || null,
+      placeOfIssue: result.ocrResult.placeOfIssue || null,
+      dateOfIssue: result.ocrResult.dateOfIssue || null,
+      method: result.ocrResult.method || null,
+    } : null,
+  }
+}
+
+// Registrations run in the background: at most REGISTRATION_CONCURRENCY at once, with up to
+// REGISTRATION_QUEUE_MAX more waiting (each holding its uploads in memory) before new ones are shed
+const registrationQueue = new JobQueue({
+  name: 'registration',
+  concurrency: envInt('REGISTRATION_CONCURRENCY', 4),
+  maxQueued: envInt('REGISTRATION_QUEUE_MAX', 50),
+  ttlMs: envInt('REGISTRATION_JOB_TTL_MS', 3600000),
+  run: async (params, job) => {
+    const result = await processRegistration({ ...params, onStage: (name) => { job.stage = name } })
+    
+    await createAuditLog({
+      voterId: result.voterId,
+      action: 'registration_submitted',
+      actor: 'system',
+      details: {
+        status: result.status,
+        flaggedReason: result.flaggedReason,
+      },
+    })
+    
+    return formatRegistrationResponse(params.form, result)
+  },
+})
+
+// Throws QueueFullError when no more registrations can be accepted
+export const checkRegistrationCapacity = () => registrationQueue.checkCapacity()
+
+/**
+ * Queue a registration (same parameters as processRegistration). Returns the job record, whose
+ * `done` promise settles when it finishes; throws QueueFullError when the queue is full.
+ */
+export const submitRegistration = (params) => registrationQueue.submit(params)
+
+/**
+ * Status of a queued registration, or null when the id is unknown or expired
+ */
+export const getRegistrationJob = (jobId) => {
+  const job = registrationQueue.get(jobId)
+  return job ? registrationQueue.describe(job) : null
+}
+
+export const getRegistrationQueueStats = () => ({
+  queue: registrationQueue.stats(),
+  stages: Object.fromEntries(Object.entries(registrationStages).map(([name, limiter]) => [name, limiter.stats()])),
+})
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Face Result Cache
+Content-addressed cache of detection and embedding results: an in-memory LRU in front of a
+SQLite file shared by every worker process, both with TTL and size limits
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent / 'face_cache'
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_MEMORY_ENTRIES = 512
+DEFAULT_MAX_ROWS = 50000
+
+
+def cache_enabled():
+    return os.environ.get('FACE_CACHE', '1').lower() not in ('0', 'false', 'off', 'no')
+
+
+def content_hash(image, chunk_size=1 << 20):
+    """SHA-256 of the image contents, given a file path or the encoded image bytes"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(image).hexdigest()
+    digest = hashlib.sha256()
+    with open(image, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(digest, action, params):
+    """Key for one result: image content hash plus the action and every parameter that affects it"""
+    return f"{action}:{json.dumps(params, sort_keys=True, default=str)}:{digest}"
+
+
+class ResultCache:
+    """
+    Two-level result cache.
+    - memory: OrderedDict LRU of decoded results, bounded by entry count
+    - disk: results.sqlite3 in the cache directory, bounded by row count; survives restarts
+      and is shared between the workers of a pool and one-shot CLI runs
+    """
+
+    def __init__(self, cache_dir=None, ttl_seconds=None, memory_entries=None, max_rows=None):
+        self.cache_dir = Path(cache_dir or os.environ.get('FACE_CACHE_DIR') or DEFAULT_CACHE_DIR)
+        self.ttl_seconds = float(ttl_seconds or os.environ.get('FACE_CACHE_TTL_S') or DEFAULT_TTL_SECONDS)
+        self.memory_entries = int(memory_entries or os.environ.get('FACE_CACHE_MEMORY_ENTRIES') or DEFAULT_MEMORY_ENTRIES)
+        self.max_rows = int(max_rows or os.environ.get('FACE_CACHE_MAX_ROWS') or DEFAULT_MAX_ROWS)
+        self.memory = OrderedDict()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._db = None
+        self._writes = 0
+
+    def _connect(self):
+        if self._db is None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.cache_dir / 'results.sqlite3'), timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY,'
+                ' value TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' accessed_at REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS idx_results_accessed_at ON results (accessed_at)')
+            self._db = db
+        return self._db
+
+    def get(self, key):
+        """Cached result for key, or None when missing or expired"""
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None:
+            created_at, value = entry
+            if now - created_at <= self.ttl_seconds:
+                self.memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return value
+            del self.memory[key]
+
+        try:
+            db = self._connect()
+            row = db.execute('SELECT value, created_at FROM results WHERE key = ?', (key,)).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                db.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+                value = json.loads(row[0])
+                self._remember(key, row[1], value)
+                self.hits['disk'] += 1
+                return value
+        except sqlite3.Error as e:
+            print(f"Result cache read failed: {e}", file=sys.stderr)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        now = time.time()
+        self._remember(key, now, value)
+        try:
+            db = self._connect()
+            db.execute(
+                'INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            print(f"Result cache write failed: {e}", file=sys.stderr)
+
+    def _remember(self, key, created_at, value):
+        self.memory[key] = (created_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        """Drop expired rows, then the least recently used rows beyond max_rows"""
+        db = self._connect()
+        db.execute('DELETE FROM results WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+        db.execute(
+            'DELETE FROM results WHERE key IN ('
+            ' SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_rows,)
+        )
+
+    def stats(self):
+        rows = None
+        try:
+            rows = self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        except sqlite3.Error:
+            pass
+        return {
+            'cache_dir': str(self.cache_dir),
+            'memory_entries': len(self.memory),
+            'disk_rows': rows,
+            'hits': dict(self.hits),
+            'misses': self.misses,
+            'ttl_seconds': self.ttl_seconds
+        }
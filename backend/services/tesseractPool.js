@@ -0,0 +1,87 @@
+// Tesseract Worker Pool - keeps initialized tesseract.js workers warm behind a scheduler
+// Creating a worker loads the WASM core and the language data, which costs far more than
+// recognizing one ID card; the pool pays that once per process and queues jobs across workers.
+
+import os from 'os'
+import { createScheduler, createWorker } from 'tesseract.js'
+
+// Workers in the pool (TESSERACT_WORKERS=0 creates a throwaway worker per job instead)
+// Unset, empty or non-numeric values fall back to the default rather than a NaN-sized pool
+const configuredWorkers = parseInt(process.env.TESSERACT_WORKERS ?? '', 10)
+const TESSERACT_WORKERS = Number.isFinite(configuredWorkers) ? configuredWorkers : Math.min(3, os.cpus().length || 1)
+
+// Tuned for ID cards; tessedit_ocr_engine_mode can only be set in createWorker, not here
+export const ID_CARD_PARAMETERS = {
+  tessedit_pageseg_mode: '6', // Assume uniform block of text
+  tessedit_char_whitelist: 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<:.,/- ', // Allow only relevant characters
+  preserve_interword_spaces: '1', // Preserve spaces between words
+}
+
+// Only the text is used; skipping hOCR, TSV and layout blocks saves work per job
+const TEXT_ONLY_OUTPUT = { text: true, blocks: false, hocr: false, tsv: false }
+
+let schedulerPromise = null
+
+const createIdCardWorker = async () => {
+  const worker = await createWorker('eng', 1, { logger: () => {} })
+  await worker.setParameters(ID_CARD_PARAMETERS)
+  return worker
+}
+
+const getScheduler = () => {
+  if (!schedulerPromise) {
+    schedulerPromise = (async () => {
+      const scheduler = createScheduler()
+      try {
+        const workers = await Promise.all(Array.from({ length: TESSERACT_WORKERS }, createIdCardWorker))
+        workers.forEach(worker => scheduler.addWorker(worker))
+      } catch (error) {
+        await scheduler.terminate().catch(() => {})
+        throw error
+      }
+      console.log(`✅ Tesseract pool ready with ${TESSERACT_WORKERS} worker(s)`)
+      return scheduler
+    })()
+    // Let the next call retry a failed start-up (e.g. language data download)
+    schedulerPromise.catch(() => { schedulerPromise = null })
+  }
+  return schedulerPromise
+}
+
+/**
+ * Recognize text in an image (file path or Buffer of encoded image bytes) with ID card parameters
+ * Jobs beyond the pool size wait in the scheduler's queue, so concurrent calls never create workers
+ * @returns {Promise<string>} Recognized text
+ */
+export const recognizeText = async (image) => {
+  if (TESSERACT_WORKERS <= 0) {
+    const worker = await createIdCardWorker()
+    try {
+      const { data: { text } } = await worker.recognize(image, {}, TEXT_ONLY_OUTPUT)
+      return text
+    } finally {
+      await worker.terminate()
+    }
+  }
+
+  const scheduler = await getScheduler()
+  const { data: { text } } = await scheduler.addJob('recognize', image, {}, TEXT_ONLY_OUTPUT)
+  return text
+}
+
+/**
+ * Terminate the pool's workers; the next recognizeText call starts a new pool
+ */
+export const shutdownTesseractPool = async () => {
+  if (!schedulerPromise) return
+  const pending = schedulerPromise
+  schedulerPromise = null
+  try {
+    await (await pending).terminate()
+  } catch {}
+}
+
+export default {
+  recognizeText,
+  shutdownTesseractPool,
+}
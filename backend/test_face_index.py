@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Test that the face search index recovers from appends interrupted between its files"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'services'))
+from faceIndex import FaceIndex  # noqa: E402
+
+DIM = 8
+
+
+def vector(seed):
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def interrupted_index(index_dir):
+    """Index with ids a, b whose append of x stopped after the vectors were written"""
+    index = FaceIndex(index_dir)
+    index.add([('a', vector(1)), ('b', vector(2))], model='insightface')
+    with open(index.embeddings_path, 'ab') as f:
+        f.write(vector(3).tobytes())
+    return index
+
+
+def test_vectors_written_without_ids():
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = interrupted_index(index_dir)
+        assert index.add([('c', vector(4))], model='insightface') == 2
+        match = index.search(vector(4), k=1, model='insightface')['matches'][0]
+        assert match['id'] == 'c' and match['score'] > 0.99
+        assert index.count() == len(index.ids()) == 3
+
+
+def test_partial_id_line():
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = interrupted_index(index_dir)
+        with open(index.ids_path, 'a', encoding='utf-8') as f:
+            f.write('x-partial')
+        index.add([('c', vector(4))], model='insightface')
+        assert FaceIndex(index_dir).ids() == ['a', 'b', 'c']
+
+
+def test_ivf_assignments_follow_rows():
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = FaceIndex(index_dir)
+        index.add([(f'v{i}', vector(i)) for i in range(20)], model='insightface')
+        index.train_ivf(nlist=4)
+        # Vectors and ids written, partitions not
+        with open(index.embeddings_path, 'ab') as f:
+            f.write(vector(100).tobytes())
+        with open(index.ids_path, 'a', encoding='utf-8') as f:
+            f.write('v100\n')
+        index.add([('c', vector(200))], model='insightface')
+        assert index.assign_path.stat().st_size // 4 == index.count() == 22
+        match = index.search(vector(200), k=1, nprobe=4, model='insightface')['matches'][0]
+        assert match['id'] == 'c'
+
+
+if __name__ == '__main__':
+    print("Testing face index recovery from interrupted appends...\n")
+    for test in (test_vectors_written_without_ids, test_partial_id_line, test_ivf_assignments_follow_rows):
+        test()
+        print(f"✅ {test.__name__}")
+    print("\n✅ Face index recovers from interrupted appends")